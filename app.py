@@ -1,70 +1,47 @@
 import streamlit as st
-import pandas as pd
 import datetime
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 import streamlit.components.v1 as components
-import openai
-from sklearn.linear_model import LinearRegression
-import numpy as np
-
-import json
-import os
-
-# --- 設定 ---
-SPREADSHEET_NAME = 'muscle_db'
-EXERCISES_FILE = 'exercises.json'
-
-DEFAULT_EXERCISES = {
-    "胸": ["ベンチプレス", "インクラインベンチプレス", "インクラインダンベルプレス", "ディップス", "ペックフライ", "マシンプレス"],
-    "背中": ["デッドリフト", "フロントプル", "ラットプル", "ローロー", "チンニング"],
-    "脚": ["スクワット", "レッグエクステンション", "レッグカール", "レッグプレス", "ブルガリアンスクワット"],
-    "肩": ["サイドレイズ", "ダンベルショルダープレス", "バーベルショルダープレス"],
-    "腕": ["スカルクラッシャー", "インクラインカール", "バーベルカール", "ケーブルプレスダウン"]
-}
-
-def load_exercises():
-    if os.path.exists(EXERCISES_FILE):
-        try:
-            with open(EXERCISES_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return DEFAULT_EXERCISES
-    return DEFAULT_EXERCISES
 
-def save_exercises(exercises):
-    with open(EXERCISES_FILE, 'w', encoding='utf-8') as f:
-        json.dump(exercises, f, ensure_ascii=False, indent=4)
+from catalog import get_catalog
+from coach import (PROMPTS, AdviceJob, build_messages, get_advice_service, get_briefing_store,
+                   get_openai_client, get_openai_settings, prompt_key)
+from forecast import ForecastEngine
+from storage import ARCHIVE_HORIZON_DAYS, WEIGHT_DECIMALS, concat_frames, get_storage, rollup_best_sets, update_exercise_summary
+from strength import FORMULAS, PRIndex, one_rep_maxes
+import tracing
+from lazy import IMPORT_TIMES, lazy_import
+from volume import METRIC_LABELS, VolumeAggregates
+
+pd = lazy_import('pandas')  # ログイン画面では読み込まない
+
+# --- 表示量の上限 (記録が増えても1回の描画でブラウザへ送る量を一定に保つ) ---
+HISTORY_PAGE_SIZE = 20  # 履歴の1ページの行数
+CHART_MAX_POINTS = 300  # これを超える推移グラフは日ごと (それでも多ければ週ごと) の最大値に間引く
+EXERCISE_LIST_PAGE = 12  # 種目一覧で一度に表示する件数 (残りは「さらに表示」で)
+PR_HISTORY_ROWS = 20  # ベスト更新の履歴に表示する件数 (新しい順)
+
+# --- 再実行の計測 ---
+def trace_context():
+    # 計測するか (全再実行をログに出すか ?debug=1 のセッションか) と、計測結果に付けるメタ情報
+    show_panel = st.query_params.get(tracing.TRACE_QUERY_PARAM) == '1'
+    meta = {'user': st.session_state.get('username'), 'view': st.session_state.get('current_view')}
+    return tracing.TRACE_LOG or show_panel, meta
+
+def rerun_entry(name):
+    # コールバックは main() より先に、フラグメントだけの再実行は main() を通らずに動くので、
+    # それぞれが計測の入口になる (全体の再実行の中で呼ばれたときはその区間になる)
+    return tracing.entrypoint(name, trace_context)
+
+# --- 種目カタログ ---
+def get_exercises():
+    # 部位 -> 種目名のタプル。全セッションで共有する読み取り専用のカタログ
+    return get_catalog(st.session_state.get('username')).get()
+
+def get_part_lookup():
+    return get_catalog(st.session_state.get('username')).part_lookup()
 
 def get_body_part(exercise_name):
-    # セッションステートから取得、なければデフォルト
-    exercises = st.session_state.get('exercises', DEFAULT_EXERCISES)
-    for part, ex_list in exercises.items():
-        if exercise_name in ex_list:
-            return part
-    return "その他"
-
-def get_recovery_status(df):
-    status = {}
-    if df.empty:
-        return status
-    
-            # ユーザー固有のデータでフィルタリング済みであることを前提とする
-    # 各部位の最終トレーニング日を取得
-    exercises_dict = st.session_state.get('exercises', DEFAULT_EXERCISES)
-    for part in exercises_dict.keys():
-        # その部位に関連する種目を抽出
-        exercises = exercises_dict[part]
-        part_df = df[df['種目名'].isin(exercises)]
-        
-        if not part_df.empty:
-            last_date = pd.to_datetime(part_df['日付']).max()
-            days_since = (datetime.datetime.now() - last_date).days
-            status[part] = days_since
-        else:
-            status[part] = 999  # 未実施
-            
-    return status
+    return get_part_lookup().get(exercise_name, "その他")
 
 # --- JSタイマー機能 ---
 def render_js_timer():
@@ -153,180 +130,104 @@ def render_js_timer():
     """
     components.html(timer_html, height=200)
 
-def predict_next_weight(df, target_event):
-    df_event = df[df['種目名'] == target_event].copy()
-    if len(df_event) < 3:
-        return None
-    df_event['日付'] = pd.to_datetime(df_event['日付'])
-    start_date = df_event['日付'].min()
-    df_event['days_passed'] = (df_event['日付'] - start_date).dt.days
-    df_event['重量(kg)'] = pd.to_numeric(df_event['重量(kg)'], errors='coerce')
-    df_event = df_event.dropna(subset=['重量(kg)'])
-    X = df_event[['days_passed']]
-    y = df_event['重量(kg)']
-    model = LinearRegression()
-    model.fit(X, y)
-    today_days = (datetime.datetime.now() - start_date).days
-    predicted_weight = model.predict([[today_days]])[0]
-    return round(predicted_weight, 1)
-
-def get_ai_agent_advice(df, mode):
+@tracing.traced('predict_next_weights')
+def predict_next_weights(df, exercises):
+    # 全種目分の回帰直線はデータバージョンごとに一度だけ作り、ここでは表示する種目の分を1回の配列演算で引く
     if df.empty:
-        return "データがありません。まずは初回のトレーニングを記録しましょう！"
-
-    # --- 1. 現状分析 (Context) ---
-    df_sorted = df.sort_values('日付', ascending=False)
-    last_record = df_sorted.iloc[0]
-    last_date = pd.to_datetime(last_record['日付'])
-    last_part = last_record['部位'] # 部位カラムを使う
-    days_since = (datetime.datetime.now() - last_date).days
-    
-    # 回復状況計算
-    recovery_status = get_recovery_status(df)
-    # 値が999(未実施)を除外してソートするか、そのまま使うか。
-    # ここでは未実施(999)は除外せずに、単純に日数が多い順(回復している順)に提案する
-    sorted_recovery = sorted(recovery_status.items(), key=lambda x: x[1], reverse=True)
-    recommended_part = sorted_recovery[0][0]
-
-    # --- 2. モード別プロンプト分岐 ---
-    # --- 2. モード別プロンプト分岐 ---
-    if mode == "🔥 鬼軍曹":
-        system_prompt = """
-        あなたは地獄の鬼軍曹です。ユーザーは新兵です。
-        甘えは一切許しません。以下の口調で、次に鍛えるべき部位を命令してください。
-        
-        【口調のルール】
-        - 「貴様」「～だ！」「甘えるな！」などの強い言葉を使う。
-        - 褒めない。煽ってやる気を引き出す。
-        - 絵文字は🔥や💢のみ使用可。
-        - 回復している部位（サボっている部位）を徹底的に攻めるよう命令する。
-        - 100文字以内で短く怒鳴るように。
-        """
-        user_prompt = f"""
-        新兵の状況: 前回 {days_since}日前に {last_part} を実施。
-        最もサボっている部位: {recommended_part} ({recovery_status[recommended_part]}日経過)
-        
-        新兵を罵倒し、ジムへ叩き出してください。
-        """
-
-    elif mode == "✨ 励ましエンジェル":
-        system_prompt = """
-        あなたはユーザーを推している「アイドルのような天使」です。
-        とにかくハイテンションで、ユーザーの努力を全肯定してください。
-        
-        【口調のルール】
-        - 「すごい！」「えらい！」「優勝！」など、ポジティブな言葉を連発する。
-        - 絵文字（✨💖🥺🎉）を多用する。
-        - 回復している部位を「次はここを育てようね♡」と優しく提案する。
-        - 120文字以内で、読むだけで元気がでるメッセージを。
-        """
-        status_text = "\n".join([f"- {k}: {v}日お休み中" for k, v in recovery_status.items() if v != 999])
-        user_prompt = f"""
-        推しの状況: 前回 {days_since}日前に {last_part} を頑張った！
-        今の回復状況:\n{status_text}
-        おすすめ: {recommended_part}
-        
-        最高の笑顔で応援してください。
-        """
-
-    elif mode == "🤖 システムOS":
-        system_prompt = """
-        あなたは近未来のトレーニング支援OS「LIFT OS」のシステムボイスです。
-        感情を持たず、機械的かつクールに状況を報告してください。
-        
-        【口調のルール】
-        - 「スキャン完了」「推奨」「プロトコル開始」などのSF用語を使う。
-        - ユーザーを「パイロット」と呼ぶ。
-        - 感情的な言葉は排除し、事実と推奨事項のみを伝える。
-        - 100文字以内。
-        """
-        user_prompt = f"""
-        Pilot Status: Last Workout {days_since} days ago ({last_part}).
-        Target Recommendation: {recommended_part}.
-        
-        Generate mission briefing.
-        """
-    else:
-         return "モードエラー: 不明なモードです"
+        return {}
+    return get_derived('forecast').forecasts(st.session_state.get('username'), exercises)
 
-    # --- 3. 生成 ---
-    try:
-        if "OPENAI_API_KEY" in st.secrets:
-            client = openai.OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.7,
-            )
-            return response.choices[0].message.content
-        else:
-            return "APIキー設定なし"
-    except Exception as e:
-        return f"エラー: {e}"
-
-def get_worksheet():
-    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(dict(st.secrets["gcp_service_account"]), scope)
-    client = gspread.authorize(creds)
-    try:
-        sheet = client.open(SPREADSHEET_NAME)
-        return sheet.sheet1
-    except gspread.exceptions.SpreadsheetNotFound:
-        st.error(f"スプレッドシート '{SPREADSHEET_NAME}' が見つかりません。")
-        st.stop()
+@tracing.traced('get_ai_agent_advice')
+def get_ai_agent_advice(df, mode, generate=True):
+    # 生成はバックグラウンドで行い、途中経過を持つ AdviceJob をすぐに返す。
+    # generate=False ならキャッシュ済みのときだけ返し、なければ None (APIを呼ばない)
+    if df.empty:
+        return AdviceJob("データがありません。まずは初回のトレーニングを記録しましょう！")
 
+    # --- 1. 現状分析 (Context) ---
+    # プロンプトは (モード, おすすめの部位, 日数の区切り) だけで決まる
+    if mode not in PROMPTS:
+        return AdviceJob("モードエラー: 不明なモードです")
+    last_dates = get_storage().last_dates(st.session_state.get('username'))
+    key = prompt_key(mode, last_dates, get_exercises().keys(), get_part_lookup())
+
+    # --- 2. 生成 ---
+    # キーが同じなら、ユーザーや再実行をまたいで応答を共有できる
+    if not generate:
+        cached = get_advice_service().cache.get(key)
+        if cached is not None:
+            return AdviceJob(cached)
+        # 朝の一括生成で作っておいた今日のブリーフィング
+        briefing = get_briefing_store().get(key)
+        return AdviceJob(briefing[0], generated_on=briefing[1]) if briefing else None
+    api_key, base_url = get_openai_settings()
+    if not api_key:
+        return AdviceJob("APIキー設定なし")
+    return get_advice_service().request(key, build_messages(key), get_openai_client(api_key, base_url))
+
+@tracing.traced('load_data')
 def load_data():
-    worksheet = get_worksheet()
-    data = worksheet.get_all_values()
-    
-    if not data:
-        return pd.DataFrame(columns=['日付', '部位', '種目名', '重量(kg)', '回数(レップ)', 'ユーザー名'])
-    
-    header = data[0]
-    
-    # スキーママイグレーション: ユーザー名カラムがない場合に追加
-    if 'ユーザー名' not in header:
-        try:
-            # 6列目(F列)にヘッダーを追加
-            worksheet.update_cell(1, 6, 'ユーザー名')
-            header.append('ユーザー名')
-        except Exception as e:
-            st.warning(f"スキーマ更新中にエラーが発生しましたが続行します: {e}")
-
-    rows = data[1:]
-    if not rows:
-        return pd.DataFrame(columns=header)
-    
-    # 行の長さがヘッダーと異なる場合の補完処理
-    aligned_rows = []
-    for row in rows:
-        if len(row) < len(header):
-            row += [''] * (len(header) - len(row))
-        aligned_rows.append(row)
-
-    df = pd.DataFrame(aligned_rows, columns=header)
-    
-    # 現在のユーザーでフィルタリング
     current_user = st.session_state.get('username')
-    if current_user:
-         df = df[df['ユーザー名'] == current_user]
-    
-    return df
+    return get_storage().load(current_user)
 
+@tracing.traced('save_new_data')
 def save_new_data(date, body_part, exercise, weight, reps):
-    worksheet = get_worksheet()
     current_user = st.session_state.get('username', 'Unknown')
+    storage = get_storage()
     
     row = [str(date), body_part, exercise, str(weight), str(reps), str(current_user)]
+    before = storage.version(current_user)
+    storage.append(row)
     
-    # シートが空の場合のヘッダー作成
-    if len(worksheet.get_all_values()) == 0:
-        worksheet.append_row(['日付', '部位', '種目名', '重量(kg)', '回数(レップ)', 'ユーザー名'])
-    
-    worksheet.append_row(row)
+    # 変化が保存した1行だけなら、派生インデックスは作り直さずにその行だけ反映する
+    if storage.version(current_user) == before + 1:
+        for name, (_, update) in DERIVED_INDEXES.items():
+            cached = st.session_state.get(f'derived_{name}')
+            if cached and cached['key'] == (current_user, before):
+                update(cached['value'], row)
+                cached['key'] = (current_user, before + 1)
+
+# --- 派生インデックス (セッション単位、データバージョンごとに作成) ---
+# 名前 -> (ユーザーのデータから作る関数, 1行を反映する関数)
+DERIVED_INDEXES = {
+    'exercise_summary': (
+        lambda user: get_storage().exercise_summary(user),
+        update_exercise_summary,
+    ),
+    'forecast': (
+        lambda user: ForecastEngine(get_storage().load(user)),
+        lambda engine, row: engine.update(row),
+    ),
+    'volume': (
+        lambda user: VolumeAggregates(get_storage().load(user), get_storage().rollups(user)),
+        lambda aggregates, row: aggregates.update(row),
+    ),
+    'prs': (
+        lambda user: PRIndex(load_with_best_sets(user)),
+        lambda prs, row: prs.update(row),
+    ),
+}
+
+def load_with_best_sets(user):
+    # アーカイブ済みの日ごとの最高セットをホットの記録の前に並べた表 (ベストの計算用)。
+    # 予測は直近の傾向を見るものなので、ホットの記録だけで作る
+    storage = get_storage()
+    return concat_frames([rollup_best_sets(storage.rollups(user)), storage.load(user)])
+
+def get_derived(name):
+    # データバージョンが変わったときだけ作り直す
+    current_user = st.session_state.get('username')
+    key = (current_user, get_storage().version(current_user))
+    cached = st.session_state.get(f'derived_{name}')
+    if not cached or cached['key'] != key:
+        build, _ = DERIVED_INDEXES[name]
+        cached = {'key': key, 'value': build(current_user)}
+        st.session_state[f'derived_{name}'] = cached
+    return cached['value']
+
+def get_exercise_summary():
+    # 種目ごとの最新セット・最高セット・セット数
+    return get_derived('exercise_summary')
 
 def init_session_state():
     if 'current_view' not in st.session_state:
@@ -335,8 +236,6 @@ def init_session_state():
         st.session_state['selected_exercise'] = None
     if 'selected_body_part' not in st.session_state:
         st.session_state['selected_body_part'] = 'All'
-    if 'exercises' not in st.session_state:
-        st.session_state['exercises'] = load_exercises()
     if 'username' not in st.session_state:
         st.session_state['username'] = None
     if 'is_logged_in' not in st.session_state:
@@ -390,7 +289,162 @@ def logout():
     st.session_state['current_view'] = 'dashboard'
     st.rerun()
 
+@rerun_entry('render_ai_message')
+def render_ai_message(advice_key):
+    job = st.session_state.get(f'{advice_key}_job')
+    if job is not None and (job.done or job.timed_out):
+        st.session_state[advice_key] = job.result() if job.done else "エラー: 応答がタイムアウトしました"
+        del st.session_state[f'{advice_key}_job']
+        # 定期実行を止めるため全体を再実行する
+        st.rerun()
+    if job is not None:
+        text = f"{job.text}▌" if job.text else "思考中..."
+    else:
+        text = st.session_state[advice_key]
+    st.markdown(f'<div class="ai-message">{text}</div>', unsafe_allow_html=True)
+
+@rerun_entry('render_exercise_manager')
+def render_exercise_manager():
+    # 入力中の操作はこの部分だけを再実行する。カタログを変えたときは一覧も変わるので全体を再実行
+    catalog = get_catalog(st.session_state.get('username'))
+    exercises = catalog.get()
+    with st.expander("🛠 種目管理"):
+        st.caption("新しい種目の追加")
+        new_ex_name = st.text_input("種目名", key="new_ex_name")
+        new_ex_part = st.selectbox("部位", list(exercises.keys()), key="new_ex_part")
+        if st.button("追加", key="add_ex_btn"):
+            if new_ex_name and new_ex_part:
+                # 他のセッションの変更と競合しないよう、判定と書き込みはカタログがロック下で行う
+                if catalog.add(new_ex_part, new_ex_name):
+                    st.success(f"{new_ex_name} を追加しました")
+                    st.rerun()
+                else:
+                    st.warning("その種目は既に存在します")
+        
+        st.divider()
+        st.caption("種目の削除")
+        del_part = st.selectbox("部位選択", list(exercises.keys()), key="del_part_select")
+        del_ex = st.selectbox("削除する種目", exercises[del_part], key="del_ex_select")
+        if st.button("削除", key="del_ex_btn"):
+            if catalog.remove(del_part, del_ex):
+                st.success(f"{del_ex} を削除しました")
+            st.rerun()
+
+@rerun_entry('refresh_advice')
+def refresh_advice(df, ai_mode, advice_key):
+    st.session_state.pop(f'{advice_key}_date', None)
+    job = get_ai_agent_advice(df, ai_mode)
+    if job.done:
+        st.session_state[advice_key] = job.result()
+    else:
+        st.session_state[f'{advice_key}_job'] = job
+
+def render_ai_panel(df, ai_mode):
+    with st.container(border=True):
+        col_ai_icon, col_ai_text = st.columns([1, 6])
+        with col_ai_icon:
+            st.image("https://api.dicebear.com/7.x/bottts/svg?seed=WorkoutAI", width=60)
+        with col_ai_text:
+            st.markdown('<div class="ai-title">AI Coach Agent</div>', unsafe_allow_html=True)
+            if not df.empty:
+                # モードが変わったらアドバイスも再生成したいので、キーにモードを含める
+                advice_key = f'ai_advice_{ai_mode}'
+                
+                if advice_key not in st.session_state:
+                     # 初回ロード時は、同じ状態の生成済みアドバイスがあればそれを、なければデフォルトメッセージ（API節約）
+                     cached = get_ai_agent_advice(df, ai_mode, generate=False)
+                     st.session_state[advice_key] = cached.result() if cached else ("今日も限界を超えていきましょう。" if ai_mode == "🔥 鬼軍曹" else "今日も頑張りましょう！")
+                     if cached and cached.generated_on:
+                         st.session_state[f'{advice_key}_date'] = cached.generated_on
+                
+                # 生成中はこの部分だけを1秒ごとに再実行して、届いた分から表示する
+                pending = f'{advice_key}_job' in st.session_state
+                st.fragment(render_ai_message, run_every=1 if pending else None)(advice_key)
+                if f'{advice_key}_date' in st.session_state:
+                    st.caption(f"📅 {st.session_state[f'{advice_key}_date']} のブリーフィング")
+                
+                st.button("アドバイスを更新", key="refresh_ai", disabled=pending,
+                          on_click=refresh_advice, args=(df, ai_mode, advice_key))
+            else:
+                st.markdown('<div class="ai-message">データがありません。</div>', unsafe_allow_html=True)
+
+@rerun_entry('render_volume_charts')
+def render_volume_charts():
+    # 集計表 (日・週ごと) から描くので、記録が増えても描画のコストは変わらない
+    with st.expander("📊 トレーニング量", expanded=True):
+        c1, c2 = st.columns(2)
+        with c1:
+            metric = st.radio("指標", list(METRIC_LABELS), format_func=METRIC_LABELS.get, horizontal=True, key="volume_metric")
+        with c2:
+            grain = st.radio("単位", ['week', 'day'], format_func={'week': '週', 'day': '日'}.get, horizontal=True, key="volume_grain")
+        # 週は直近12週、日は直近4週
+        since = datetime.date.today() - datetime.timedelta(weeks=12 if grain == 'week' else 4)
+        chart = get_derived('volume').series(st.session_state['username'], grain, 'part', metric, since)
+        if chart.empty:
+            st.info("この期間の記録はありません。")
+        else:
+            st.bar_chart(chart, y_label=METRIC_LABELS[metric])
+
+def select_body_part(part):
+    st.session_state['selected_body_part'] = part
+    st.session_state['exercise_list_limit'] = EXERCISE_LIST_PAGE
+
+def show_more_exercises():
+    st.session_state['exercise_list_limit'] = st.session_state.get('exercise_list_limit', EXERCISE_LIST_PAGE) + EXERCISE_LIST_PAGE
+
+@rerun_entry('render_exercise_list')
+def render_exercise_list(df):
+    # 部位の切り替えではデータの読み込みや他の部分を再実行しない
+    # (状態はボタンのコールバックで先に変えるので、再実行し直す必要もない)
+    # 3. ナビゲーション & フィルタ
+    st.write("##### 部位フィルター")
+    exercises_dict = get_exercises()
+    parts = ["All"] + list(exercises_dict.keys())
+    cols = st.columns(len(parts))
+    for i, part in enumerate(parts):
+        cols[i].button(part, key=f"filter_{part}", use_container_width=True, type="primary" if st.session_state['selected_body_part'] == part else "secondary",
+                       on_click=select_body_part, args=(part,))
+
+    # 4. 種目リスト
+    st.markdown("### 種目一覧")
+    target_part = st.session_state['selected_body_part']
+    if target_part == "All":
+        target_exercises = []
+        for p in exercises_dict:
+            target_exercises.extend(exercises_dict[p])
+    else:
+        target_exercises = exercises_dict[target_part]
+
+    # 表示する分だけ予測を引き、枠を作る
+    limit = st.session_state.get('exercise_list_limit', EXERCISE_LIST_PAGE)
+    summary = get_exercise_summary() if not df.empty else {}
+    visible = target_exercises[:limit]
+    forecasts = predict_next_weights(df, visible)
+    for exercise in visible:
+        last_rec_text = "記録なし"
+        if exercise in summary:
+            last = summary[exercise]['last']
+            last_rec_text = f"{last['weight']}kg x {last['reps']} ({pd.Timestamp(last['date']).strftime('%m/%d')})"
+            forecast = forecasts.get(exercise, {})
+            if 'weight' in forecast:
+                last_rec_text += f" • 📈 目安 {forecast['weight']}kg"
+                if '1rm' in forecast:
+                    last_rec_text += f" (1RM {forecast['1rm']}kg)"
+
+        with st.container(border=True):
+            c1, c2 = st.columns([4, 1.5])
+            with c1:
+                st.markdown(f"**{exercise}**")
+                st.caption(f"{get_body_part(exercise)} • {last_rec_text}")
+            with c2:
+                if st.button("記録", key=f"nav_{exercise}", use_container_width=True):
+                    navigate_to('detail', exercise)
+    if len(target_exercises) > limit:
+        st.button(f"さらに表示 (残り {len(target_exercises) - limit} 種目)", key="more_exercises",
+                  on_click=show_more_exercises, use_container_width=True)
+
 # --- ダッシュボード (メイン画面) ---
+@tracing.traced('render_dashboard')
 def render_dashboard(df):
     # CSS注入 (統合版)
     st.markdown("""
@@ -470,96 +524,29 @@ def render_dashboard(df):
         st.divider()
         
         # --- 種目管理 ---
-        with st.expander("🛠 種目管理"):
-            st.caption("新しい種目の追加")
-            new_ex_name = st.text_input("種目名", key="new_ex_name")
-            new_ex_part = st.selectbox("部位", list(st.session_state['exercises'].keys()), key="new_ex_part")
-            if st.button("追加", key="add_ex_btn"):
-                if new_ex_name and new_ex_part:
-                    if new_ex_name not in st.session_state['exercises'][new_ex_part]:
-                        st.session_state['exercises'][new_ex_part].append(new_ex_name)
-                        save_exercises(st.session_state['exercises'])
-                        st.success(f"{new_ex_name} を追加しました")
-                        st.rerun()
-                    else:
-                        st.warning("その種目は既に存在します")
-            
-            st.divider()
-            st.caption("種目の削除")
-            del_part = st.selectbox("部位選択", list(st.session_state['exercises'].keys()), key="del_part_select")
-            del_ex = st.selectbox("削除する種目", st.session_state['exercises'][del_part], key="del_ex_select")
-            if st.button("削除", key="del_ex_btn"):
-                if del_ex in st.session_state['exercises'][del_part]:
-                    st.session_state['exercises'][del_part].remove(del_ex)
-                    save_exercises(st.session_state['exercises'])
-                    st.success(f"{del_ex} を削除しました")
-                    st.rerun()
+        st.fragment(render_exercise_manager)()
+
+    # 型変換できずに読み込みから除外した行があれば知らせる
+    quarantine = get_storage().quarantine(st.session_state['username'])
+    if not quarantine.empty:
+        with st.sidebar:
+            st.warning(f"読み込めなかった行が {len(quarantine)} 件あります")
+            with st.expander("除外した行"):
+                st.dataframe(quarantine, use_container_width=True, hide_index=True)
 
     # 1. AIエージェントエリア (OFFなら表示しない)
     if ai_mode != "🤐 OFF":
-        with st.container(border=True):
-            col_ai_icon, col_ai_text = st.columns([1, 6])
-            with col_ai_icon:
-                st.image("https://api.dicebear.com/7.x/bottts/svg?seed=WorkoutAI", width=60)
-            with col_ai_text:
-                st.markdown('<div class="ai-title">AI Coach Agent</div>', unsafe_allow_html=True)
-                if not df.empty:
-                    # モードが変わったらアドバイスも再生成したいので、キーにモードを含める
-                    advice_key = f'ai_advice_{ai_mode}'
-                    
-                    if advice_key not in st.session_state:
-                         # 初回ロード時はとりあえずデフォルトメッセージ（API節約）
-                         st.session_state[advice_key] = "今日も限界を超えていきましょう。" if ai_mode == "🔥 鬼軍曹" else "今日も頑張りましょう！"
-                    
-                    st.markdown(f'<div class="ai-message">{st.session_state[advice_key]}</div>', unsafe_allow_html=True)
-                    
-                    if st.button("アドバイスを更新", key="refresh_ai"):
-                        with st.spinner("思考中..."):
-                            # ★変更: モードを渡す
-                            advice = get_ai_agent_advice(df, ai_mode)
-                            st.session_state[advice_key] = advice
-                            st.rerun()
-                else:
-                    st.markdown('<div class="ai-message">データがありません。</div>', unsafe_allow_html=True)
-
-    # 2. ナビゲーション & フィルタ
-    st.write("##### 部位フィルター")
-    exercises_dict = st.session_state['exercises']
-    parts = ["All"] + list(exercises_dict.keys())
-    cols = st.columns(len(parts))
-    for i, part in enumerate(parts):
-        if cols[i].button(part, key=f"filter_{part}", use_container_width=True, type="primary" if st.session_state['selected_body_part'] == part else "secondary"):
-            st.session_state['selected_body_part'] = part
-            st.rerun()
+        st.fragment(render_ai_panel)(df, ai_mode)
 
-    # 3. 種目リスト
-    st.markdown("### 種目一覧")
-    target_part = st.session_state['selected_body_part']
-    if target_part == "All":
-        target_exercises = []
-        for p in exercises_dict:
-            target_exercises.extend(exercises_dict[p])
-    else:
-        target_exercises = exercises_dict[target_part]
-
-    for exercise in target_exercises:
-        last_rec_text = "記録なし"
-        if not df.empty:
-            ex_df = df[df['種目名'] == exercise].sort_values('日付', ascending=False)
-            if not ex_df.empty:
-                last = ex_df.iloc[0]
-                last_rec_text = f"{last['重量(kg)']}kg x {last['回数(レップ)']} ({last['日付'].strftime('%m/%d')})"
+    # 2. トレーニング量の推移
+    if not df.empty:
+        st.fragment(render_volume_charts)()
 
-        with st.container(border=True):
-            c1, c2 = st.columns([4, 1.5])
-            with c1:
-                st.markdown(f"**{exercise}**")
-                st.caption(f"{get_body_part(exercise)} • {last_rec_text}")
-            with c2:
-                if st.button("記録", key=f"nav_{exercise}", use_container_width=True):
-                    navigate_to('detail', exercise)
+    # 3. ナビゲーション & フィルタ, 4. 種目リスト
+    st.fragment(render_exercise_list)(df)
 
 # --- 詳細画面 (入力 & グラフ) ---
+@tracing.traced('render_detail_view')
 def render_detail_view(df, exercise_name):
     # ヘッダー
     c1, c2 = st.columns([1, 5])
@@ -569,23 +556,35 @@ def render_detail_view(df, exercise_name):
     with c2:
         st.markdown(f'<div class="custom-title" style="font-size: 2rem;">{exercise_name}</div>', unsafe_allow_html=True)
 
-    if not df.empty:
-        ex_df = df[df['種目名'] == exercise_name].sort_values('日付')
-        ex_df['重量(kg)'] = pd.to_numeric(ex_df['重量(kg)'], errors='coerce').fillna(0)
-        ex_df['回数(レップ)'] = pd.to_numeric(ex_df['回数(レップ)'], errors='coerce').fillna(0)
+    # タイマーは記録の保存で再描画されない (リセットされない) よう、記録部分の外に置く
+    with st.expander("⏱ インターバルタイマー"):
+        render_js_timer()
+
+    st.fragment(render_exercise_log)(exercise_name)
+
+@rerun_entry('submit_record')
+def submit_record(exercise_name):
+    input_weight = st.session_state['input_weight']
+    input_reps = st.session_state['input_reps']
+    if input_weight > 0 and input_reps > 0:
+        body_part = get_body_part(exercise_name)
+        is_pr = get_derived('prs').is_pr(exercise_name, input_weight, input_reps)
+        save_new_data(st.session_state['input_date'], body_part, exercise_name, input_weight, input_reps)
+        st.session_state['record_message'] = ('success', "🎉 自己ベスト更新！保存しました！" if is_pr else "保存しました！")
     else:
-        ex_df = pd.DataFrame()
+        st.session_state['record_message'] = ('error', "重量と回数を入力してください。")
+
+@rerun_entry('render_exercise_log')
+def render_exercise_log(exercise_name):
+    # 記録・グラフ・履歴。保存してもこの部分だけを再実行する
+    ex_df = get_storage().exercise_history(st.session_state['username'], exercise_name)
 
     # Stats Header
-    if not ex_df.empty:
-        ex_df['1RM'] = ex_df['重量(kg)'] * (1 + ex_df['回数(レップ)'] / 30)
-        last_item = ex_df.iloc[-1]
-        last_date = last_item['日付'].strftime('%m/%d')
-        
-        max_weight = ex_df['重量(kg)'].max()
-        pr_text = f"{int(max_weight)} kg"
-        
-        count = len(ex_df)
+    stats = get_exercise_summary().get(exercise_name)
+    if stats:
+        last_date = pd.Timestamp(stats['last']['date']).strftime('%m/%d')
+        pr_text = f"{stats['best']['weight']:g} kg × {stats['best']['reps']}"
+        count = stats['count']
     else:
         last_date = "-"
         pr_text = "-- kg"
@@ -596,69 +595,232 @@ def render_detail_view(df, exercise_name):
     h2.metric("前回", last_date)
     h3.metric("👑 最高記録", pr_text)
 
+    # レップ帯ごとのベストと、ベスト更新の履歴 (どちらも索引を引くだけ)
+    prs = get_derived('prs')
+    bests = prs.bests(exercise_name)
+    if bests:
+        with st.expander("🏆 レップ帯別ベスト"):
+            st.dataframe(
+                pd.DataFrame(
+                    [(f"{label} 回", rec['weight'], rec['reps'], rec['date']) for label, rec in bests.items()],
+                    columns=['レップ帯', '重量(kg)', '回数(レップ)', '日付'],
+                ),
+                use_container_width=True, hide_index=True,
+            )
+            st.caption("ベスト更新の履歴")
+            st.dataframe(
+                pd.DataFrame(
+                    [(rec['date'], f"{label} 回", rec['weight'], rec['reps'])
+                     for label, rec in prs.pr_history(exercise_name, PR_HISTORY_ROWS)],
+                    columns=['日付', 'レップ帯', '重量(kg)', '回数(レップ)'],
+                ),
+                use_container_width=True, hide_index=True,
+            )
+
     st.markdown("---")
 
     # グラフ
     st.subheader("推移 (推定1RM)")
+    st.radio("推定式", list(FORMULAS), format_func=lambda name: FORMULAS[name][0], horizontal=True, key="rm_formula")
+    rollups = get_storage().rollups(st.session_state['username'])
+    has_archive = not rollups.empty and (rollups['種目名'] == exercise_name).any()
+    if has_archive:
+        # アーカイブは全期間を選んだときだけ読む
+        st.radio("期間", ['recent', 'all'], horizontal=True, key="history_period",
+                 format_func={'recent': f"直近{ARCHIVE_HORIZON_DAYS}日", 'all': "全期間"}.get)
+        if st.session_state['history_period'] == 'all':
+            archived = get_storage().archive_history(st.session_state['username'], exercise_name)
+            ex_df = concat_frames([archived, ex_df]).sort_values('日付', kind='stable')
+    if not ex_df.empty:
+        ex_df = ex_df.assign(**{'1RM': one_rep_maxes(ex_df)[st.session_state.get('rm_formula', 'epley')]})
     if not ex_df.empty and count > 1:
-        chart_data = ex_df[['日付', '1RM']].set_index('日付')
+        chart_data, grain = downsample_chart(ex_df)
         st.line_chart(chart_data, color="#4CAF50")
+        if grain:
+            st.caption(f"記録が多いため{grain}の最大値を表示しています")
     else:
         st.info("データが2件以上あるとグラフが表示されます。")
 
     st.markdown("---")
 
-    with st.expander("⏱ インターバルタイマー"):
-        render_js_timer()
-
     st.subheader("新規記録")
     with st.form("record_form"):
         f1, f2, f3 = st.columns(3)
         with f1:
-            input_date = st.date_input("日付", datetime.date.today())
+            st.date_input("日付", datetime.date.today(), key="input_date")
         with f2:
-            input_weight = st.number_input("重量 (kg)", min_value=0.0, step=1.0)
+            st.number_input("重量 (kg)", min_value=0.0, step=1.0, key="input_weight")
         with f3:
-            input_reps = st.number_input("回数", min_value=0, step=1)
+            st.number_input("回数", min_value=0, step=1, key="input_reps")
         
-        submitted = st.form_submit_button("記録を保存", type="primary", use_container_width=True)
+        # 保存はコールバックで先に済ませるので、この再実行で統計・グラフ・履歴にも反映される
+        st.form_submit_button("記録を保存", type="primary", use_container_width=True,
+                              on_click=submit_record, args=(exercise_name,))
         
-        if submitted:
-            if input_weight > 0 and input_reps > 0:
-                body_part = get_body_part(exercise_name)
-                save_new_data(input_date, body_part, exercise_name, input_weight, input_reps)
-                st.success("保存しました！")
-                st.rerun()
-            else:
-                st.error("重量と回数を入力してください。")
+        message = st.session_state.pop('record_message', None)
+        if message and message[0] == 'success':
+            st.success(message[1])
+        elif message:
+            st.error(message[1])
 
     st.subheader("履歴")
     if not ex_df.empty:
-        display_df = ex_df.sort_values('日付', ascending=False)[['日付', '重量(kg)', '回数(レップ)', '1RM']]
-        display_df['日付'] = display_df['日付'].dt.strftime('%Y/%m/%d')
-        display_df['1RM'] = display_df['1RM'].apply(lambda x: f"{x:.1f}kg")
-        st.dataframe(display_df, use_container_width=True, hide_index=True)
+        render_history_page(ex_df, exercise_name, has_archive)
+
+def downsample_chart(ex_df):
+    # (グラフの表, 間引いた単位)。点が多いときは日ごと、それでも多ければ週ごとの最大値にする
+    series = ex_df.set_index('日付')['1RM']
+    grain = None
+    if len(series) > CHART_MAX_POINTS:
+        series = series.groupby(series.index.normalize()).max()
+        grain = '日ごと'
+    if len(series) > CHART_MAX_POINTS:
+        series = series.resample('W-MON', label='left', closed='left').max().dropna()
+        grain = '週ごと'
+    return series.to_frame(), grain
+
+def history_page(dates, cursor, size=HISTORY_PAGE_SIZE):
+    # dates は古い順に並んだ日付。表示は新しい順で、cursor は (日付, その日の記録のうち古い方から数えてページに入る手前までの件数)。
+    # 位置ではなく日付で区切り、同じ日の中も古い方から数えるので、新しい記録が増えても
+    # (表示中の日に追加した分はその日の末尾に並ぶ) 表示中のページはずれない。
+    # 返り値は古い順の位置での範囲 [start, end) と、次の (より古い) ページのカーソル
+    if cursor is None:
+        end = len(dates)
+    else:
+        day = pd.Timestamp(cursor[0])
+        end = min(int(dates.searchsorted(day, side='left')) + cursor[1], int(dates.searchsorted(day, side='right')))
+    start = max(end - size, 0)
+    if start == 0:
+        return start, end, None
+    date = dates.iloc[start - 1]
+    return start, end, (date.isoformat(), start - int(dates.searchsorted(date, side='left')))
+
+def older_history(cursor, to_archive=False):
+    st.session_state['history_cursors'].append(cursor)
+    if to_archive:
+        # ホットの範囲を読み終えたので、ここから先はアーカイブも読む
+        st.session_state['history_period'] = 'all'
+
+def newer_history():
+    st.session_state['history_cursors'].pop()
+
+def render_history_page(ex_df, exercise_name, has_archive):
+    # 1ページ分だけを送る。ページ位置は種目ごとにカーソルの積み重ねで持つ
+    if st.session_state.get('history_exercise') != exercise_name:
+        st.session_state['history_exercise'] = exercise_name
+        st.session_state['history_cursors'] = [None]
+    cursors = st.session_state['history_cursors']
+    dates = ex_df['日付'].reset_index(drop=True)
+    start, end, next_cursor = history_page(dates, cursors[-1])
+    if end == 0 and len(cursors) > 1:
+        # 期間を狭めたなどで、カーソルより古い記録がなくなった
+        cursors[:] = [None]
+        start, end, next_cursor = history_page(dates, None)
+
+    # 表示形式は列設定で指定し、行ごとの文字列変換はしない (float32 の重量だけは丸めておく)
+    page = ex_df.iloc[start:end][::-1][['日付', '重量(kg)', '回数(レップ)', '1RM']]
+    st.dataframe(
+        page.astype({'重量(kg)': float}).round({'重量(kg)': WEIGHT_DECIMALS}),
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            '日付': st.column_config.DateColumn(format="YYYY/MM/DD"),
+            '1RM': st.column_config.NumberColumn(format="%.1fkg"),
+        },
+    )
+    to_archive = next_cursor is None and has_archive and st.session_state.get('history_period') != 'all'
+    if to_archive:
+        next_cursor = (dates.iloc[0].isoformat(), 0)
+    p1, p2, p3 = st.columns([1, 2, 1])
+    p1.button("← 新しい", key="history_newer", disabled=len(cursors) == 1, on_click=newer_history,
+              use_container_width=True)
+    p2.caption(f"{len(dates) - end + 1}–{len(dates) - start} 件目 / 全 {len(dates)} 件")
+    p3.button("古い →", key="history_older", disabled=next_cursor is None, on_click=older_history,
+              args=(next_cursor, to_archive), use_container_width=True)
+
+# --- 同期状態 (シートから読むときだけ表示) ---
+@rerun_entry('sync_now')
+def sync_now():
+    try:
+        get_storage().sync_now(st.session_state['username'])
+    except Exception as e:
+        st.session_state['sync_error'] = str(e)
+
+def render_sync_status():
+    freshness = get_storage().freshness(st.session_state['username'])
+    if freshness is None:
+        return
+    fetched_at, error = freshness
+    with st.sidebar:
+        st.divider()
+        age = datetime.datetime.now().timestamp() - fetched_at
+        age_text = f"{int(age)}秒前" if age < 60 else f"{int(age // 60)}分前"
+        st.caption(f"🔄 最終同期: {age_text}" if fetched_at else "🔄 未同期")
+        if error is not None:
+            st.warning("シートに接続できないため、前回のデータを表示しています。")
+        sync_error = st.session_state.pop('sync_error', None)
+        if sync_error:
+            st.error(f"同期に失敗しました: {sync_error}")
+        st.button("今すぐ同期", key="sync_now_btn", on_click=sync_now, use_container_width=True)
+
+# --- 計測パネル (?debug=1 で開いたときだけ) ---
+def render_trace_panel(trace):
+    with st.sidebar:
+        with st.expander("⏱ 計測 (この再実行)", expanded=True):
+            st.caption(f"合計 {trace.total_ms:.1f} ms")
+            spans = pd.DataFrame(
+                [(f"{'　' * depth}{name}", start, ms) for name, depth, start, ms in trace.spans],
+                columns=['区間', '開始 (ms)', '時間 (ms)'],
+            )
+            st.dataframe(spans.round(1), use_container_width=True, hide_index=True)
+            if trace.api_calls:
+                calls = pd.DataFrame(sorted(trace.api_calls.items()), columns=['API', '回数'])
+                st.dataframe(calls, use_container_width=True, hide_index=True)
+            else:
+                st.caption("API 呼び出しなし")
+            if IMPORT_TIMES:
+                # このプロセスで遅延読み込みしたモジュール (読み込みは最初の1回だけ)
+                imports = pd.DataFrame(
+                    [(name, sec * 1000) for name, sec in IMPORT_TIMES.items()], columns=['モジュール', '読み込み (ms)'])
+                st.dataframe(imports.round(1), use_container_width=True, hide_index=True)
 
 def main():
     st.set_page_config(page_title="LIFT OS", layout="centered") 
     init_session_state()
 
+    enabled, meta = trace_context()
+    with tracing.rerun_trace(enabled, entry='main', **meta) as trace:
+        run_view()
+    if st.query_params.get(tracing.TRACE_QUERY_PARAM) == '1':
+        render_trace_panel(trace)
+
+def run_view():
     if not st.session_state['is_logged_in']:
         render_login()
         return
 
     try:
         df = load_data()
-        if not df.empty:
-            df['日付'] = pd.to_datetime(df['日付'])
     except Exception as e:
         st.error(f"データ読み込みエラー: {e}")
         return
 
+    # 先に表示していた記録がシートへの保存に失敗して取り消されていれば知らせる
+    rejected = get_storage().rejected(st.session_state['username'])
+    if not rejected.empty:
+        st.error(f"保存できなかった記録が {len(rejected)} 件あります。表示から取り消しました。")
+        with st.expander("取り消した記録"):
+            st.dataframe(rejected, use_container_width=True, hide_index=True)
+            if st.button("確認しました", key="dismiss_rejected"):
+                get_storage().dismiss_rejected(st.session_state['username'])
+                st.rerun()
+
     if st.session_state['current_view'] == 'dashboard':
         render_dashboard(df)
     elif st.session_state['current_view'] == 'detail':
         render_detail_view(df, st.session_state['selected_exercise'])
 
+    render_sync_status()
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
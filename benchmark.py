@@ -0,0 +1,222 @@
+"""app.py のデータ処理を合成データで計測し、結果を JSON に保存する。
+
+    python benchmark.py --rows 1000 100000 1000000 --users 1 100 10000 --output bench.json
+    python benchmark.py --compare before.json after.json
+
+gspread の代わりにメモリ上の偽ワークシート (fakesheets.py) を使うので、ネットワークや認証は不要。
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import app
+import storage
+from catalog import DEFAULT_EXERCISES
+from fakesheets import FakeSpreadsheet
+
+# --- 合成データ ---
+def generate_rows(n_rows, n_users, years=3, seed=0):
+    # training_data.csv と同じ列 + ユーザー名。日付順に追記された形で返す
+    rng = np.random.default_rng(seed)
+    catalog = [(part, ex) for part, exs in DEFAULT_EXERCISES.items() for ex in exs]
+    parts = np.array([p for p, _ in catalog])
+    names = np.array([e for _, e in catalog])
+    base_weight = rng.uniform(20, 120, len(catalog))
+
+    # 記録の多いユーザーと少ないユーザーがいるよう、利用頻度は裾の長い分布にする
+    user_weights = 1 / np.arange(1, n_users + 1) ** 0.8
+    users = rng.choice(n_users, n_rows, p=user_weights / user_weights.sum())
+    exercise = rng.integers(0, len(catalog), n_rows)
+    days = np.sort(rng.integers(0, years * 365, n_rows))
+    progress = 1 + 0.3 * days / (years * 365)
+    weight = np.round(base_weight[exercise] * progress * rng.normal(1, 0.05, n_rows) / 2.5) * 2.5
+    reps = rng.integers(3, 13, n_rows)
+    start = np.datetime64('today') - np.timedelta64(years * 365, 'D')
+    dates = (start + days.astype('timedelta64[D]')).astype(str)
+
+    return [
+        [d, p, e, f"{w:g}", str(r), f"user{u}"]
+        for d, p, e, w, r, u in zip(dates, parts[exercise], names[exercise], weight, reps, users)
+    ]
+
+def build_spreadsheet(rows, latency=0.0, quota_per_minute=None):
+    sheets = {}
+    if storage.PARTITION_BY_USER:
+        for row in rows:
+            sheets.setdefault(storage.get_partition(row[5]), [storage.SHEET_HEADER]).append(row)
+        return FakeSpreadsheet(sheets, latency, quota_per_minute)
+    fake = FakeSpreadsheet(latency=latency, quota_per_minute=quota_per_minute)
+    fake.sheet1.rows = [storage.SHEET_HEADER] + rows
+    return fake
+
+# --- 計測 ---
+def measure(fn, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    # メモリは計測のオーバーヘッドが大きいので別に1回だけ測る
+    if setup:
+        setup()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'median_ms': round(statistics.median(times), 3),
+        'min_ms': round(min(times), 3),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+def reset_session(username):
+    for key in list(st.session_state.keys()):
+        del st.session_state[key]
+    app.init_session_state()
+    st.session_state['username'] = username
+    st.session_state['is_logged_in'] = True
+
+def run_scale(n_rows, n_users, repeat):
+    rows = generate_rows(n_rows, n_users)
+    fake = build_spreadsheet(rows)
+    storage.get_sheet_handle().use_spreadsheet(fake)
+    storage.get_sheet_cache.clear()
+
+    # 最も記録の多いユーザーで測る
+    username = 'user0'
+    reset_session(username)
+    exercise = DEFAULT_EXERCISES['胸'][0]
+    # 種目一覧の1ページ目 (部位フィルターが All のときに表示するカード)
+    exercises = [ex for part in DEFAULT_EXERCISES.values() for ex in part][:app.EXERCISE_LIST_PAGE]
+    mode = next(iter(app.PROMPTS))
+    df = app.load_data()
+
+    def cold_cache():
+        # 流量制限も作り直す (前の回の呼び出しでトークンが尽き、待ち時間を測ってしまわないように)
+        storage.get_sheet_cache.clear()
+        storage.get_rate_limiter.clear()
+
+    def cold_session():
+        reset_session(username)
+
+    cases = {
+        'load_data (cold)': (app.load_data, cold_cache),
+        'load_data (warm)': (app.load_data, None),
+        # 回復状況からプロンプトのキーを作り、キャッシュ済みのアドバイスだけを引く (API は呼ばない)
+        'get_ai_agent_advice (cached)': (lambda: app.get_ai_agent_advice(df, mode, generate=False), None),
+        'predict_next_weights (cold)': (lambda: app.predict_next_weights(df, exercises), cold_session),
+        'predict_next_weights (warm)': (lambda: app.predict_next_weights(df, exercises), None),
+        # render_dashboard / render_detail_view の重い部分はフラグメントで、Streamlit の外では実行されないので直接呼ぶ
+        'render_exercise_list': (lambda: app.render_exercise_list(df), cold_session),
+        'render_exercise_log': (lambda: app.render_exercise_log(exercise), cold_session),
+    }
+    results = []
+    for name, (fn, setup) in cases.items():
+        calls = fake.calls
+        result = measure(fn, repeat, setup)
+        result['api_calls'] = round((fake.calls - calls) / (repeat + 1), 2)  # 1回あたり
+        result.update({'rows': n_rows, 'users': n_users, 'user_rows': len(df), 'function': name})
+        results.append(result)
+        print(f"{n_rows:>8} rows {n_users:>6} users  {name:<28} {result['median_ms']:>10.2f} ms  {result['peak_kb']:>10.1f} KB  {result['api_calls']:>6} calls")
+    return results
+
+HEAVY_MODULES = ('pandas', 'numpy', 'gspread', 'oauth2client', 'openai', 'requests')
+
+COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import app
+ms = (time.perf_counter() - start) * 1000
+print(json.dumps({'ms': ms, 'loaded': [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+def run_cold_start(repeat):
+    # 新しいプロセスで app を読み込むまでの時間 (ログイン画面を出す前に払うコスト)
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    samples = []
+    for _ in range(repeat + 1):
+        out = subprocess.run([sys.executable, '-c', COLD_START_SCRIPT], capture_output=True, text=True, cwd=cwd, check=True)
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    times = [s['ms'] for s in samples[1:]]  # 1回目はディスクキャッシュを温めるだけ
+    result = {
+        'function': 'import app (cold)', 'rows': 0, 'users': 0, 'user_rows': 0,
+        'median_ms': round(statistics.median(times), 2), 'min_ms': round(min(times), 2),
+        'loaded_modules': samples[-1]['loaded'],
+    }
+    print(f"{'import app (cold)':<52} {result['median_ms']:>10.2f} ms  読み込み済み: {', '.join(result['loaded_modules']) or 'なし'}")
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+def compare(before_path, after_path):
+    with open(before_path, encoding='utf-8') as f:
+        before = json.load(f)
+    with open(after_path, encoding='utf-8') as f:
+        after = json.load(f)
+    key = lambda r: (r['rows'], r['users'], r['function'])
+    old = {key(r): r for r in before['results']}
+    print(f"{before['meta'].get('commit')} -> {after['meta'].get('commit')}")
+    for r in after['results']:
+        o = old.get(key(r))
+        if o is None:
+            continue
+        ratio = r['median_ms'] / o['median_ms'] if o['median_ms'] else float('inf')
+        print(f"{r['rows']:>8} rows {r['users']:>6} users  {r['function']:<28} "
+              f"{o['median_ms']:>10.2f} -> {r['median_ms']:>10.2f} ms  (x{ratio:.2f})")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 100])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='2つの結果 JSON を比べる')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    # streamlit run 以外で動かすときの警告を抑え、本物の書き込みログには触れない
+    logging.disable(logging.WARNING)
+    storage.WRITE_LOG_FILE = os.path.join(tempfile.mkdtemp(), 'pending_sets.jsonl')
+    storage.STORAGE_BACKEND = 'sheets'
+
+    results = [run_cold_start(args.repeat)]
+    for n_rows in args.rows:
+        for n_users in args.users:
+            results.extend(run_scale(n_rows, n_users, args.repeat))
+
+    meta = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'partition_by_user': storage.PARTITION_BY_USER,
+        'repeat': args.repeat,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'meta': meta, 'results': results}, f, ensure_ascii=False, indent=2)
+    print(f"結果を {args.output} に保存しました")
+
+if __name__ == '__main__':
+    main()
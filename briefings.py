@@ -0,0 +1,110 @@
+"""全ユーザー・全コーチングモードの今日のブリーフィングを一括生成し、briefings.json に保存する。
+
+    python briefings.py [--target sheets|sqlite] [--user U] [--workers 8] [--rpm 60]
+    python briefings.py --stub [--stub-latency 0.5] [--stub-error-rate 0.1]
+
+毎朝1回動かす想定で、ダッシュボードは保存された今日の分を開いた時点で表示する。
+プロンプトは (モード, おすすめの部位, 日数の区切り) だけで決まるので、同じ状態のユーザーは1回の生成を共有する。
+今日すでに生成した分は作り直さないので、途中で止まっても再実行すればよい。
+--stub はローカルの偽エンドポイント (fakeopenai.py) に向けて動かす (API キー不要)。
+"""
+import argparse
+import datetime
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import openai
+
+import storage
+from catalog import get_catalog
+from coach import OPENAI_MODEL, PROMPTS, BriefingStore, BRIEFINGS_FILE, build_messages, get_openai_settings, prompt_key
+from fakeopenai import FakeChatServer
+
+# --- 設定 ---
+BRIEFING_WORKERS = 8  # 同時に生成するリクエスト数
+BRIEFING_REQUESTS_PER_MINUTE = 60  # 生成の流量上限 (アカウントの割り当てに合わせる)
+BRIEFING_TIMEOUT = 60  # 秒
+BRIEFING_MAX_RETRIES = 4  # 429 / 5xx は openai クライアントが待ってから再試行する
+BRIEFING_WRITE_LOG_FILE = 'pending_briefings.jsonl'  # 読むだけでも load() が書き込みキューを開くので、アプリのログとは分ける
+
+def collect_keys(backend, users, modes, now):
+    # ユーザー -> モードごとのキー (記録のないユーザーは空)
+    keys = {}
+    for user in users:
+        catalog = get_catalog(user)
+        last_dates = backend.last_dates(user)
+        user_keys = [prompt_key(mode, last_dates, catalog.get().keys(), catalog.part_lookup(), now) for mode in modes]
+        keys[user] = [key for key in user_keys if key is not None]
+    return keys
+
+def generate(client, key, limiter):
+    limiter.acquire()
+    response = client.chat.completions.create(model=OPENAI_MODEL, messages=build_messages(key), temperature=0.7)
+    return response.choices[0].message.content
+
+def run(backend, client, store, users=None, modes=None, workers=BRIEFING_WORKERS,
+        rpm=BRIEFING_REQUESTS_PER_MINUTE, force=False, now=None):
+    # (今日のブリーフィング {キー: 本文}, 失敗 {キー: 例外}, 統計) を返し、成功した分を保存する
+    now = now or datetime.datetime.now()
+    today = now.date()
+    keys_by_user = collect_keys(backend, users or backend.users(), modes or list(PROMPTS), now)
+    wanted = list(dict.fromkeys(key for keys in keys_by_user.values() for key in keys))
+    briefings = {} if force else store.texts(today)
+    todo = [key for key in wanted if key not in briefings]
+
+    limiter = storage.TokenBucket(rpm / 60, min(workers, rpm))
+    failed = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(generate, client, key, limiter): key for key in todo}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                briefings[key] = future.result()
+            except Exception as e:
+                failed[key] = e
+    store.save(today, briefings)
+    stats = {'users': len(keys_by_user), 'keys': len(wanted), 'generated': len(todo) - len(failed),
+             'reused': len(wanted) - len(todo), 'failed': len(failed)}
+    return briefings, failed, stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', choices=['sheets', 'sqlite'], default=storage.STORAGE_BACKEND)
+    parser.add_argument('--user', action='append', help='対象ユーザー (複数指定可、省略時は全員)')
+    parser.add_argument('--mode', action='append', choices=list(PROMPTS), help='コーチングモード (省略時は全て)')
+    parser.add_argument('--workers', type=int, default=BRIEFING_WORKERS)
+    parser.add_argument('--rpm', type=float, default=BRIEFING_REQUESTS_PER_MINUTE, help='1分あたりの生成リクエスト数の上限')
+    parser.add_argument('--output', default=BRIEFINGS_FILE)
+    parser.add_argument('--force', action='store_true', help='今日すでに生成した分も作り直す')
+    parser.add_argument('--stub', action='store_true', help='ローカルの偽エンドポイントを起動して使う')
+    parser.add_argument('--stub-latency', type=float, default=0.5)
+    parser.add_argument('--stub-error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    # streamlit run 以外で動かすときの警告を抑える
+    logging.disable(logging.WARNING)
+    # 同じディレクトリでアプリが動いていても、アプリの未送信セットを再送したりログを書き直したりしない
+    storage.WRITE_LOG_FILE = BRIEFING_WRITE_LOG_FILE
+    if args.stub:
+        stub = FakeChatServer(args.stub_latency, args.stub_error_rate).start()
+        api_key, base_url = 'stub', stub.base_url
+    else:
+        api_key, base_url = get_openai_settings()
+    client = openai.OpenAI(api_key=api_key, base_url=base_url, timeout=BRIEFING_TIMEOUT, max_retries=BRIEFING_MAX_RETRIES)
+
+    start = time.perf_counter()
+    _, failed, stats = run(storage.make_backend(args.target), client, BriefingStore(args.output), args.user,
+                           args.mode, args.workers, args.rpm, args.force)
+    elapsed = time.perf_counter() - start
+    print(f"{stats['users']} ユーザー / {stats['keys']} 種類のブリーフィング: 生成 {stats['generated']}、"
+          f"生成済み {stats['reused']}、失敗 {stats['failed']} ({elapsed:.1f} 秒)")
+    if args.stub:
+        print(f"スタブ: {stub.calls} リクエスト (429 {stub.errors} 回)、最大同時 {stub.max_in_flight}")
+    for key, e in failed.items():
+        print(f"  失敗 {key}: {e}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+import streamlit as st
+
+import json
+import os
+import threading
+import time
+from types import MappingProxyType
+from urllib.parse import quote
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# --- 設定 ---
+EXERCISES_FILE = 'exercises.json'
+CATALOG_PER_USER = os.environ.get('LIFTOS_CATALOG_PER_USER') == '1'  # ユーザーごとに種目カタログを持つ
+CATALOG_USER_DIR = 'exercises'  # ユーザー別カタログの置き場所 (未作成のユーザーは共有カタログを使う)
+CATALOG_CHECK_INTERVAL = 1.0  # 秒: この間隔内はファイルの更新を確認しない
+
+DEFAULT_EXERCISES = {
+    "胸": ["ベンチプレス", "インクラインベンチプレス", "インクラインダンベルプレス", "ディップス", "ペックフライ", "マシンプレス"],
+    "背中": ["デッドリフト", "フロントプル", "ラットプル", "ローロー", "チンニング"],
+    "脚": ["スクワット", "レッグエクステンション", "レッグカール", "レッグプレス", "ブルガリアンスクワット"],
+    "肩": ["サイドレイズ", "ダンベルショルダープレス", "バーベルショルダープレス"],
+    "腕": ["スカルクラッシャー", "インクラインカール", "バーベルカール", "ケーブルプレスダウン"]
+}
+
+def freeze(exercises):
+    # 全セッションで共有するので、読み手が書き換えられない形にする
+    return MappingProxyType({part: tuple(ex_list) for part, ex_list in exercises.items()})
+
+class _FileLock:
+    # プロセスをまたぐ排他 (同じファイルを使う別のサーバープロセスや CLI と競合しないように)
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.file = open(self.path, 'a+')
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+        return False
+
+# --- 種目カタログ (プロセス内で共有) ---
+class ExerciseCatalog:
+    def __init__(self, path, fallback=None):
+        self.path = path
+        self.fallback = fallback  # ファイルがまだないときに内容を借りるカタログ
+        self.lock = threading.Lock()
+        self.stamp = None  # 読み込んだファイルの (mtime_ns, size)
+        self.data = None
+        self.checked_at = 0.0
+        self.rev = 0  # 内容が変わるたびに増える (カタログから作る索引のキー)
+        self.lookup = None  # (rev, 種目名 -> 部位)
+
+    def _stat(self):
+        try:
+            info = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (info.st_mtime_ns, info.st_size)
+
+    def _read(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                pass  # 壊れたファイルは既定のカタログとして扱う
+        if self.fallback is not None:
+            return {part: list(ex_list) for part, ex_list in self.fallback.get().items()}
+        return {part: list(ex_list) for part, ex_list in DEFAULT_EXERCISES.items()}
+
+    def get(self):
+        # ファイルの mtime が変わったときだけ読み直す
+        with self.lock:
+            now = time.time()
+            if self.data is not None and now - self.checked_at < CATALOG_CHECK_INTERVAL:
+                return self.data
+            self.checked_at = now
+            stamp = self._stat()
+            if self.data is None or stamp != self.stamp or (stamp is None and self.fallback is not None):
+                data = freeze(self._read())
+                if data != self.data:
+                    self.data = data
+                    self.rev += 1
+                self.stamp = stamp
+            return self.data
+
+    def update(self, fn):
+        # ファイルロック下で最新の内容を読み、fn で書き換えたものを原子的に書き戻す。
+        # fn は変更したら True を返す
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self.lock, _FileLock(self.path + '.lock'):
+            exercises = self._read()
+            if not fn(exercises):
+                return False
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(exercises, f, ensure_ascii=False, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.data = freeze(exercises)
+            self.stamp = self._stat()
+            self.checked_at = time.time()
+            self.rev += 1
+            return True
+
+    def add(self, part, exercise):
+        def apply(exercises):
+            ex_list = exercises.setdefault(part, [])
+            if exercise in ex_list:
+                return False
+            ex_list.append(exercise)
+            return True
+        return self.update(apply)
+
+    def remove(self, part, exercise):
+        def apply(exercises):
+            if exercise not in exercises.get(part, []):
+                return False
+            exercises[part].remove(exercise)
+            return True
+        return self.update(apply)
+
+    def part_lookup(self):
+        # 種目名 -> 部位 の逆引き。カタログが変わったときだけ作り直す
+        exercises = self.get()
+        cached = self.lookup
+        if cached is None or cached[0] != self.rev:
+            lookup = {}
+            for part, ex_list in exercises.items():
+                for ex in ex_list:
+                    lookup.setdefault(ex, part)
+            cached = (self.rev, lookup)
+            self.lookup = cached
+        return cached[1]
+
+@st.cache_resource
+def get_catalog(username=None):
+    shared = _get_shared_catalog()
+    if not CATALOG_PER_USER or not username:
+        return shared
+    return ExerciseCatalog(os.path.join(CATALOG_USER_DIR, f"{quote(username, safe='')}.json"), fallback=shared)
+
+@st.cache_resource
+def _get_shared_catalog():
+    return ExerciseCatalog(EXERCISES_FILE)
@@ -0,0 +1,289 @@
+import streamlit as st
+
+import datetime
+import json
+import os
+import threading
+import time
+
+import tracing
+from lazy import lazy_import
+
+openai = lazy_import('openai')  # アドバイスを生成するときだけ読み込む
+pd = lazy_import('pandas')
+
+# --- 設定 ---
+OPENAI_MODEL = 'gpt-4o-mini'
+ADVICE_TIMEOUT = 20  # 秒: これを過ぎた生成は打ち切る
+ADVICE_CACHE_TTL = 6 * 60 * 60  # 秒
+ADVICE_CACHE_SIZE = 512
+BRIEFINGS_FILE = 'briefings.json'  # 一括生成した今日のブリーフィング (briefings.py が書く)
+BRIEFINGS_CHECK_INTERVAL = 5.0  # 秒: この間隔内はファイルの更新を確認しない
+
+# 前回トレーニングからの日数の区切り (この区切りが同じなら同じアドバイスを使い回す)
+DAYS_BUCKETS = [
+    (0, '当日', 'today'),
+    (1, '1日前', '1 day ago'),
+    (2, '2日前', '2 days ago'),
+    (3, '3〜4日前', '3-4 days ago'),
+    (5, '5〜7日前', '5-7 days ago'),
+    (8, '1〜2週間前', '1-2 weeks ago'),
+    (15, '2週間以上前', 'over 2 weeks ago'),
+]
+
+def days_bucket(days):
+    # (日本語ラベル, 英語ラベル)
+    label = DAYS_BUCKETS[0]
+    for bucket in DAYS_BUCKETS:
+        if days >= bucket[0]:
+            label = bucket
+    return label[1], label[2]
+
+# モード -> (システムプロンプト, ユーザープロンプト)。ユーザープロンプトの {part} {days_ja} {days_en} は状態で埋める
+PROMPTS = {
+    "🔥 鬼軍曹": (
+        """
+        あなたは地獄の鬼軍曹です。ユーザーは新兵です。
+        甘えは一切許しません。以下の口調で、次に鍛えるべき部位を命令してください。
+        
+        【口調のルール】
+        - 「貴様」「～だ！」「甘えるな！」などの強い言葉を使う。
+        - 褒めない。煽ってやる気を引き出す。
+        - 絵文字は🔥や💢のみ使用可。
+        - 回復している部位（サボっている部位）を徹底的に攻めるよう命令する。
+        - 100文字以内で短く怒鳴るように。
+        """,
+        """
+        新兵の状況: 前回のトレーニングは{days_ja}。
+        最もサボっている部位: {part}
+        
+        新兵を罵倒し、ジムへ叩き出してください。
+        """,
+    ),
+    "✨ 励ましエンジェル": (
+        """
+        あなたはユーザーを推している「アイドルのような天使」です。
+        とにかくハイテンションで、ユーザーの努力を全肯定してください。
+        
+        【口調のルール】
+        - 「すごい！」「えらい！」「優勝！」など、ポジティブな言葉を連発する。
+        - 絵文字（✨💖🥺🎉）を多用する。
+        - 回復している部位を「次はここを育てようね♡」と優しく提案する。
+        - 120文字以内で、読むだけで元気がでるメッセージを。
+        """,
+        """
+        推しの状況: 前回のトレーニングは{days_ja}、頑張った！
+        おすすめ: {part}
+        
+        最高の笑顔で応援してください。
+        """,
+    ),
+    "🤖 システムOS": (
+        """
+        あなたは近未来のトレーニング支援OS「LIFT OS」のシステムボイスです。
+        感情を持たず、機械的かつクールに状況を報告してください。
+        
+        【口調のルール】
+        - 「スキャン完了」「推奨」「プロトコル開始」などのSF用語を使う。
+        - ユーザーを「パイロット」と呼ぶ。
+        - 感情的な言葉は排除し、事実と推奨事項のみを伝える。
+        - 100文字以内。
+        """,
+        """
+        Pilot Status: Last Workout {days_en}.
+        Target Recommendation: {part}.
+        
+        Generate mission briefing.
+        """,
+    ),
+}
+
+def recovery_status(last_dates, parts, part_lookup, now=None):
+    # 部位 -> 最後に鍛えてからの日数 (未実施は 999)。last_dates は 種目 -> 最終日
+    dates = pd.Series(last_dates, dtype='datetime64[ns]')
+    part_last = dates.groupby(dates.index.map(part_lookup)).max()
+    days_since = (pd.Timestamp(now or datetime.datetime.now()) - part_last).dt.days
+    return {part: int(days_since[part]) if part in days_since.index else 999 for part in parts}
+
+def prompt_key(mode, last_dates, parts, part_lookup, now=None):
+    # プロンプトを決める (モード, おすすめの部位, 日数の区切り)。記録がなければ None
+    if not last_dates:
+        return None
+    now = now or datetime.datetime.now()
+    # 同じ状態なら同じアドバイスを使い回せるよう、日数は区切りに丸めてプロンプトに渡す
+    days_ja, _ = days_bucket((now - max(last_dates.values())).days)
+    # 未実施(999)も除外せずに、単純に日数が多い順(回復している順)に提案する
+    status = recovery_status(last_dates, parts, part_lookup, now)
+    recommended_part = sorted(status.items(), key=lambda x: x[1], reverse=True)[0][0]
+    return (mode, recommended_part, days_ja)
+
+def build_messages(key):
+    mode, part, days_ja = key
+    days_en = next(en for _, ja, en in DAYS_BUCKETS if ja == days_ja)
+    system_prompt, user_prompt = PROMPTS[mode]
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt.format(part=part, days_ja=days_ja, days_en=days_en)}
+    ]
+
+# --- OpenAI クライアント (プロセス内で共有) ---
+def get_openai_settings():
+    # ローカルのスタブサーバーで試すときは OPENAI_BASE_URL を secrets か環境変数で指定する
+    try:
+        secrets = dict(st.secrets)
+    except Exception:
+        secrets = {}  # secrets.toml がない
+    return secrets.get("OPENAI_API_KEY"), secrets.get("OPENAI_BASE_URL", os.environ.get("OPENAI_BASE_URL"))
+
+@st.cache_resource
+def get_openai_client(api_key, base_url=None):
+    return openai.OpenAI(api_key=api_key, base_url=base_url, timeout=ADVICE_TIMEOUT, max_retries=0)
+
+# --- 応答キャッシュ ---
+class AdviceCache:
+    def __init__(self, ttl=ADVICE_CACHE_TTL, size=ADVICE_CACHE_SIZE):
+        self.lock = threading.Lock()
+        self.ttl = ttl
+        self.size = size
+        self.entries = {}  # キー -> (保存時刻, 本文)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.ttl:
+                del self.entries[key]
+                return None
+            return entry[1]
+
+    def put(self, key, text):
+        with self.lock:
+            now = time.time()
+            # 期限切れを捨て、それでも多ければ古いものから捨てる
+            self.entries = {k: v for k, v in self.entries.items() if now - v[0] <= self.ttl}
+            while len(self.entries) >= self.size:
+                del self.entries[min(self.entries, key=lambda k: self.entries[k][0])]
+            self.entries[key] = (now, text)
+
+# --- バックグラウンド生成 ---
+class AdviceJob:
+    def __init__(self, text='', done=True, generated_on=None):
+        self.text = text  # 生成済みの部分 (ストリーミング中は途中まで)
+        self.done = done
+        self.generated_on = generated_on  # 一括生成したブリーフィングならその日付
+        self.error = None
+        self.started_at = time.time()
+
+    def result(self):
+        if self.error:
+            return f"エラー: {self.error}"
+        return self.text
+
+    @property
+    def timed_out(self):
+        return not self.done and time.time() - self.started_at > ADVICE_TIMEOUT
+
+class AdviceService:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cache = AdviceCache()
+        self.jobs = {}  # 生成中のキー -> AdviceJob (同じ状態の生成は1本にまとめる)
+
+    def request(self, key, messages, client):
+        cached = self.cache.get(key)
+        if cached is not None:
+            return AdviceJob(cached)
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is None:
+                job = AdviceJob(done=False)
+                self.jobs[key] = job
+                tracing.count('openai.chat')
+                threading.Thread(target=self._generate, args=(key, messages, client, job), daemon=True).start()
+            return job
+
+    def _generate(self, key, messages, client, job):
+        try:
+            stream = client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=messages,
+                temperature=0.7,
+                stream=True,
+            )
+            for chunk in stream:
+                if time.time() - job.started_at > ADVICE_TIMEOUT:
+                    stream.close()
+                    raise TimeoutError(f"{ADVICE_TIMEOUT}秒以内に応答がありませんでした")
+                if chunk.choices and chunk.choices[0].delta.content:
+                    job.text += chunk.choices[0].delta.content
+            self.cache.put(key, job.text)
+        except Exception as e:
+            job.error = e
+        finally:
+            job.done = True
+            with self.lock:
+                self.jobs.pop(key, None)
+
+@st.cache_resource
+def get_advice_service():
+    return AdviceService()
+
+# --- 一括生成したブリーフィング ---
+class BriefingStore:
+    # briefings.json を読む。ファイルが書き換えられたときだけ読み直す
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stamp = None
+        self.checked_at = 0.0
+        self.data = {}
+
+    def _load(self):
+        with self.lock:
+            now = time.time()
+            if now - self.checked_at < BRIEFINGS_CHECK_INTERVAL:
+                return self.data
+            self.checked_at = now
+            try:
+                info = os.stat(self.path)
+                stamp = (info.st_mtime_ns, info.st_size)
+                if stamp != self.stamp:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    self.data = {'date': data['date'],
+                                 'texts': {(b['mode'], b['part'], b['days']): b['text'] for b in data['briefings']}}
+                    self.stamp = stamp
+            except (OSError, ValueError, KeyError):
+                self.data, self.stamp = {}, None  # まだ生成していない・壊れている
+            return self.data
+
+    def texts(self, today=None):
+        # 今日生成した {キー: 本文} (前日以前の分は使わない)
+        data = self._load()
+        if data.get('date') != (today or datetime.date.today()).isoformat():
+            return {}
+        return dict(data['texts'])
+
+    def get(self, key, today=None):
+        # (本文, 生成日) または None
+        text = self.texts(today).get(key)
+        return (text, self.data['date']) if text is not None else None
+
+    def save(self, date, briefings):
+        # briefings は {キー: 本文}。書きかけを読まれないよう置き換える
+        data = {
+            'date': date.isoformat(),
+            'generated_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'briefings': [{'mode': m, 'part': p, 'days': d, 'text': text} for (m, p, d), text in briefings.items()],
+        }
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+        with self.lock:
+            self.checked_at = 0.0
+
+@st.cache_resource
+def get_briefing_store():
+    return BriefingStore(BRIEFINGS_FILE)
@@ -0,0 +1,127 @@
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- ローカルの偽 Chat Completions エンドポイント (一括生成・負荷試験用) ---
+# openai クライアントが使う POST /v1/chat/completions だけを、同じ応答の形で返す
+# (stream=True なら SSE で少しずつ)。応答までの遅延と、429 を返す割合を指定できる。
+#
+#     python fakeopenai.py --port 8001   # アプリは OPENAI_BASE_URL=http://127.0.0.1:8001/v1 で使う
+
+class FakeChatServer:
+    def __init__(self, latency=0.2, error_rate=0.0, port=0, seed=0):
+        self.latency = latency  # 秒
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0  # 同時に処理していたリクエスト数の最大
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='fake-openai', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reply(self, messages):
+        # 応答は入力から決まる短い文 (同じプロンプトには同じ本文)
+        prompt = ' '.join(line.strip() for line in messages[-1]['content'].splitlines() if line.strip())
+        return f"[stub] {prompt[:80]}"
+
+    def _enter(self):
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            rejected = self.random.random() < self.error_rate
+            if rejected:
+                self.errors += 1
+            return rejected
+
+    def _leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, body, headers=None):
+                payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    self._send_json(404, {'error': {'message': 'not found', 'type': 'invalid_request_error'}})
+                    return
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                rejected = server._enter()
+                try:
+                    time.sleep(server.latency)
+                    if rejected:
+                        self._send_json(429, {'error': {'message': 'Rate limit reached (stub)', 'type': 'rate_limit_error'}},
+                                        {'retry-after-ms': '100'})
+                        return
+                    text = server.reply(request.get('messages', []))
+                    base = {'id': f"chatcmpl-{uuid.uuid4().hex}", 'created': int(time.time()),
+                            'model': request.get('model', 'stub')}
+                    if request.get('stream'):
+                        self._stream(base, text)
+                    else:
+                        self._send_json(200, {
+                            **base, 'object': 'chat.completion',
+                            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text},
+                                         'finish_reason': 'stop'}],
+                            'usage': {'prompt_tokens': 0, 'completion_tokens': len(text), 'total_tokens': len(text)},
+                        })
+                finally:
+                    server._leave()
+
+            def _stream(self, base, text):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.end_headers()
+                pieces = [text[i:i + 8] for i in range(0, len(text), 8)]
+                for i, piece in enumerate(pieces + [None]):
+                    delta = {'content': piece} if piece is not None else {}
+                    chunk = {**base, 'object': 'chat.completion.chunk',
+                             'choices': [{'index': 0, 'delta': delta, 'finish_reason': None if piece else 'stop'}]}
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+                self.wfile.write(b"data: [DONE]\n\n")
+
+        return Handler
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ローカルの偽 Chat Completions エンドポイントを起動する')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.5, help='応答までの秒数')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='429 を返す割合')
+    args = parser.parse_args()
+    stub = FakeChatServer(args.latency, args.error_rate, args.port)
+    print(f"OPENAI_BASE_URL={stub.base_url}")
+    stub.server.serve_forever()
@@ -0,0 +1,184 @@
+import gspread
+import requests
+
+import json
+import re
+import threading
+import time
+from collections import deque
+
+# --- メモリ上の偽スプレッドシート (ベンチマーク・負荷試験用) ---
+# storage.SheetHandle が使う gspread の API だけを、同じ戻り値の形で実装する。
+# 負荷試験では呼び出しごとの遅延と、1分あたりの割り当て (超えると 429) も再現できる。
+
+def api_error(code, status, message):
+    # Sheets が返すのと同じ形の APIError
+    response = requests.Response()
+    response.status_code = code
+    response._content = json.dumps({'error': {'code': code, 'status': status, 'message': message}}).encode('utf-8')
+    return gspread.exceptions.APIError(response)
+
+def quota_error():
+    return api_error(429, 'RESOURCE_EXHAUSTED', 'Quota exceeded (fake)')
+
+class FakeQuota:
+    # 直近1分の呼び出し回数が上限に達していれば断る (スプレッドシート全体で共有)
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.lock = threading.Lock()
+        self.recent = deque()  # 受け付けた呼び出しの時刻
+        self.rejected = 0
+
+    def admit(self):
+        with self.lock:
+            now = time.monotonic()
+            while self.recent and now - self.recent[0] >= 60:
+                self.recent.popleft()
+            if len(self.recent) >= self.per_minute:
+                self.rejected += 1
+                return False
+            self.recent.append(now)
+            return True
+
+class FakeWorksheet:
+    def __init__(self, title, rows=None, latency=0.0, quota=None, spreadsheet=None, sheet_id=0):
+        self.title = title
+        self.id = sheet_id
+        self.spreadsheet = spreadsheet
+        self.rows = [list(r) for r in rows or []]
+        self.lock = threading.Lock()
+        self.calls = 0  # API 呼び出し回数 (429 で断られた分も含む)
+        self.latency = latency  # 秒: 1回の呼び出しにかかる時間
+        self.quota = quota
+
+    def _call(self):
+        with self.lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.quota is not None and not self.quota.admit():
+            raise quota_error()
+
+    def get_all_values(self):
+        self._call()
+        with self.lock:
+            return [list(r) for r in self.rows]
+
+    def get_values(self, range_name=None, **kwargs):
+        self._call()
+        m = re.fullmatch(r'A(\d+):[A-Z]+(\d*)', range_name or '')
+        start = int(m.group(1)) if m else 1
+        end = int(m.group(2)) if m and m.group(2) else None
+        with self.lock:
+            return [list(r) for r in self.rows[start - 1:end]]
+
+    def row_values(self, row):
+        self._call()
+        with self.lock:
+            return list(self.rows[row - 1]) if len(self.rows) >= row else []
+
+    def append_rows(self, values, **kwargs):
+        self._call()
+        with self.lock:
+            start = len(self.rows) + 1
+            self.rows.extend(list(r) for r in values)
+            end = len(self.rows)
+        return {'updates': {'updatedRange': f"'{self.title}'!A{start}:F{end}"}}
+
+    def append_row(self, values, **kwargs):
+        return self.append_rows([values])
+
+    def update_cell(self, row, col, value):
+        self._call()
+        with self.lock:
+            while len(self.rows[row - 1]) < col:
+                self.rows[row - 1].append('')
+            self.rows[row - 1][col - 1] = value
+
+    def update(self, values, range_name='A1', **kwargs):
+        # A1 から始まる範囲の上書きだけに対応する
+        self._call()
+        with self.lock:
+            for i, row in enumerate(values):
+                if i < len(self.rows):
+                    self.rows[i] = list(row)
+                else:
+                    self.rows.append(list(row))
+
+    def batch_clear(self, ranges):
+        self._call()
+        with self.lock:
+            for range_name in ranges:
+                m = re.fullmatch(r'A(\d+):[A-Z]+(\d+)', range_name)
+                for i in range(int(m.group(1)) - 1, min(int(m.group(2)), len(self.rows))):
+                    self.rows[i] = []
+            while self.rows and not any(self.rows[-1]):
+                self.rows.pop()
+
+    def delete_rows(self, start_index, end_index=None):
+        self._call()
+        with self.lock:
+            del self.rows[start_index - 1:end_index or start_index]
+
+    def clear(self):
+        self._call()
+        with self.lock:
+            self.rows = []
+
+class FakeSpreadsheet:
+    def __init__(self, sheets=None, latency=0.0, quota_per_minute=None):
+        self.lock = threading.Lock()
+        self.latency = latency
+        self.quota = FakeQuota(quota_per_minute) if quota_per_minute else None
+        self.sheets = {}
+        self.next_id = 0  # ワークシートの sheetId
+        self.sheet1 = self._new_sheet('sheet1')
+        self.sheets['sheet1'] = self.sheet1
+        for title, rows in (sheets or {}).items():
+            self.sheets[title] = self._new_sheet(title, rows)
+        # ワークシートの取得・追加も API 呼び出しとして数える
+        self.meta = self._new_sheet('(metadata)')
+
+    def _new_sheet(self, title, rows=None):
+        self.next_id += 1
+        return FakeWorksheet(title, rows, self.latency, self.quota, self, self.next_id)
+
+    def worksheet(self, title):
+        self.meta._call()
+        with self.lock:
+            if title not in self.sheets:
+                raise gspread.exceptions.WorksheetNotFound(title)
+            return self.sheets[title]
+
+    def add_worksheet(self, title, rows=0, cols=0):
+        self.meta._call()
+        with self.lock:
+            self.sheets[title] = self._new_sheet(title)
+            return self.sheets[title]
+
+    def worksheets(self):
+        self.meta._call()
+        with self.lock:
+            return list(self.sheets.values())
+
+    def batch_update(self, body):
+        # deleteDimension (行の削除) だけに対応する。Sheets と同じく要求を順に適用する
+        self.meta._call()
+        with self.lock:
+            by_id = {ws.id: ws for ws in self.sheets.values()}
+        for request in body['requests']:
+            target = request['deleteDimension']['range']
+            worksheet = by_id[target['sheetId']]
+            with worksheet.lock:
+                del worksheet.rows[target['startIndex']:target['endIndex']]
+        return {'replies': [{} for _ in body['requests']]}
+
+    @property
+    def calls(self):
+        with self.lock:
+            return sum(ws.calls for ws in self.sheets.values()) + self.meta.calls
+
+    @property
+    def rejected(self):
+        # 割り当て超過で 429 を返した回数
+        return self.quota.rejected if self.quota is not None else 0
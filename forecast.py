@@ -0,0 +1,94 @@
+import datetime
+
+from lazy import lazy_import
+from strength import epley_1rm
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# --- 伸び予測エンジン ---
+# (ユーザー, 種目) ごとに「経過日数 -> 重量 / 推定1RM」の単回帰直線を持つ。
+# 係数は十分統計量 (n, Σx, Σx², Σy, Σxy) から閉形式で求めるので、
+# 全種目分を一度の集計で作れ、1セット追加は統計量への加算 (逐次最小二乗の1ステップ) で済む。
+
+METRICS = ['weight', '1rm']
+MIN_SAMPLES = 3  # これ未満の種目は予測しない
+_N, _SX, _SXX, _SY, _SXY = range(5)
+
+class ForecastEngine:
+    def __init__(self, df):
+        # df は 日付 / 種目名 / 重量(kg) / 回数(レップ) / ユーザー名 を持つ記録
+        self.index = {}  # (ユーザー, 種目) -> 行番号
+        self.origin = np.zeros(0, dtype='datetime64[D]')  # 各直線の x=0 の日付
+        self.stats = np.zeros((0, len(METRICS), 5))
+        if not df.empty:
+            self._build(df)
+
+    def _build(self, df):
+        dates = pd.to_datetime(df['日付'], errors='coerce').to_numpy().astype('datetime64[D]')
+        weight = pd.to_numeric(df['重量(kg)'], errors='coerce').to_numpy(dtype=float)
+        reps = pd.to_numeric(df['回数(レップ)'], errors='coerce').to_numpy(dtype=float)
+        valid = ~np.isnat(dates)
+        keys = pd.MultiIndex.from_arrays([df['ユーザー名'].to_numpy()[valid], df['種目名'].to_numpy()[valid]])
+        codes, uniques = pd.factorize(keys)
+        dates, weight, reps = dates[valid], weight[valid], reps[valid]
+        groups = len(uniques)
+
+        # 各グループの最初の日付を原点にする
+        origin = np.full(groups, np.datetime64('NaT'), dtype='datetime64[D]')
+        order = np.lexsort((dates, codes))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = codes[order][1:] != codes[order][:-1]
+        origin[codes[order][first]] = dates[order][first]
+        x = (dates - origin[codes]).astype(float)
+
+        stats = np.zeros((groups, len(METRICS), 5))
+        for m, y in enumerate([weight, epley_1rm(weight, reps)]):
+            ok = ~np.isnan(y)
+            c, xs, ys = codes[ok], x[ok], y[ok]
+            for k, w in ((_N, None), (_SX, xs), (_SXX, xs * xs), (_SY, ys), (_SXY, xs * ys)):
+                stats[:, m, k] = np.bincount(c, weights=w, minlength=groups)
+
+        self.index = {key: i for i, key in enumerate(uniques)}
+        self.origin = origin
+        self.stats = stats
+
+    def update(self, row):
+        # 1セット分を統計量に加える
+        date, _, exercise, weight, reps, user = row[:6]
+        day = np.datetime64(pd.Timestamp(date).date(), 'D')
+        key = (user, exercise)
+        i = self.index.get(key)
+        if i is None:
+            i = len(self.index)
+            self.index[key] = i
+            self.origin = np.append(self.origin, day)
+            self.stats = np.concatenate([self.stats, np.zeros((1, len(METRICS), 5))])
+        x = float((day - self.origin[i]).astype(int))
+        weight = pd.to_numeric(weight, errors='coerce')
+        reps = pd.to_numeric(reps, errors='coerce')
+        for m, y in enumerate([weight, epley_1rm(weight, reps)]):
+            if not np.isnan(y):
+                self.stats[i, m] += [1, x, x * x, y, x * y]
+
+    def forecasts(self, user, exercises, when=None):
+        # user の exercises (表示するカードの種目) の予測を配列演算でまとめて求める。
+        # {種目: {'weight': 重量, '1rm': 推定1RM}} (記録が MIN_SAMPLES 未満の指標は含めない)
+        pairs = [(exercise, self.index[(user, exercise)]) for exercise in exercises if (user, exercise) in self.index]
+        if not pairs:
+            return {}
+        rows = np.array([i for _, i in pairs])
+        when = np.datetime64(when or datetime.date.today(), 'D')
+        n, sx, sxx, sy, sxy = np.moveaxis(self.stats[rows], 2, 0)
+        denom = n * sxx - sx * sx
+        # 全て同じ日の記録なら傾き0 (平均値をそのまま予測)
+        flat = denom <= 1e-9
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = np.where(flat, 0.0, (n * sxy - sx * sy) / np.where(flat, 1, denom))
+            intercept = (sy - slope * sx) / n
+        x = (when - self.origin[rows]).astype(int).astype(float)[:, None]
+        pred = np.round(intercept + slope * x, 1)
+        return {
+            exercise: {metric: float(pred[j, m]) for m, metric in enumerate(METRICS) if n[j, m] >= MIN_SAMPLES}
+            for j, (exercise, _) in enumerate(pairs)
+        }
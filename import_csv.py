@@ -0,0 +1,211 @@
+"""古いアプリや他のアプリから書き出した CSV の記録を、まとめてストレージへ取り込む。
+
+    python import_csv.py training_data.csv --user akito [--target sheets|sqlite] [--dry-run]
+
+列の並びは行ごとに種目カタログと突き合わせて判定する (日付,種目名,重量,回数,部位 と
+日付,部位,種目名,重量,回数 が混在していてもよい)。ファイルは chunk ごとに読み、
+検証・重複除去したうえで数千行ずつの append_rows で書き込む。
+取り込み先に既にある行は飛ばすので、途中で止まっても同じコマンドを再実行すればよい。
+"""
+import argparse
+import contextlib
+import csv
+import itertools
+import logging
+from collections import Counter
+
+import pandas as pd
+
+import storage
+from catalog import get_catalog
+
+# --- 設定 ---
+IMPORT_CHUNK_ROWS = 10000  # 一度に読み込んで検証する行数
+IMPORT_BATCH_SIZE = 2000  # append_rows 1回で送る行数 (Sheets の1リクエストに収まる大きさ)
+IMPORT_WRITE_LOG_FILE = 'pending_import.jsonl'  # 取り込み専用の先行書き込みログ (動いているアプリのログとは分ける)
+
+# CSV の列名 -> SHEET_HEADER の列名 (書き出し元によって単位の表記が違う)
+COLUMN_ALIASES = {
+    '日付': '日付', '部位': '部位', '種目名': '種目名', '種目': '種目名',
+    '重量(kg)': '重量(kg)', '重量': '重量(kg)', '回数(レップ)': '回数(レップ)', '回数': '回数(レップ)',
+    'ユーザー名': 'ユーザー名', 'ユーザー': 'ユーザー名',
+}
+
+# ヘッダーと違う並びで書かれた行を判定するときの候補
+KNOWN_LAYOUTS = [
+    ('日付', '種目名', '重量(kg)', '回数(レップ)', '部位'),
+    ('日付', '部位', '種目名', '重量(kg)', '回数(レップ)'),
+    tuple(storage.SHEET_HEADER),
+]
+
+def _is_number(value):
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
+
+def parse_header(row):
+    # 既知の列名でなければヘッダーなし (1行目もデータ) とみなして None
+    layout = tuple(COLUMN_ALIASES.get(name.strip()) for name in row)
+    if '種目名' not in layout or '日付' not in layout:
+        return None
+    return layout
+
+class LayoutDetector:
+    def __init__(self, exercises, default_layout=None):
+        self.parts = set(exercises)
+        self.lookup = {ex: part for part, ex_list in exercises.items() for ex in ex_list}
+        self.default_layout = default_layout or KNOWN_LAYOUTS[0]
+        self.candidates = [self.default_layout] + [l for l in KNOWN_LAYOUTS if l != self.default_layout]
+
+    def _score(self, layout, fields):
+        record = dict(zip(layout, fields))
+        score = 0
+        if record.get('種目名', '') in self.lookup:
+            score += 2
+        if record.get('部位', '') in self.parts:
+            score += 1
+        score += _is_number(record.get('重量(kg)', '')) + _is_number(record.get('回数(レップ)', ''))
+        return score
+
+    def detect(self, fields):
+        # 最も辻褄の合う並び。同点ならヘッダーの並びを優先する
+        fields = [f.strip() for f in fields]
+        layouts = [l for l in self.candidates if len(l) >= len(fields) or l is self.default_layout]
+        return max(layouts, key=lambda l: self._score(l, fields))
+
+    def to_row(self, fields, layout, username):
+        record = dict(zip(layout, (f.strip() for f in fields)))
+        record.pop(None, None)
+        exercise = record.get('種目名', '')
+        # 部位が書かれていない行はカタログから補う
+        part = record.get('部位', '') or self.lookup.get(exercise, '')
+        return [record.get('日付', ''), part, exercise, record.get('重量(kg)', ''),
+                record.get('回数(レップ)', ''), record.get('ユーザー名', '') or username]
+
+def read_chunks(path, chunk_rows):
+    # (ヘッダー, [(行番号, フィールド), ...]) を chunk ごとに返す
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        numbered = ((n, row) for n, row in enumerate(csv.reader(f), start=1) if any(v.strip() for v in row))
+        first = next(numbered, None)
+        if first is None:
+            return
+        header = parse_header(first[1])
+        if header is None:
+            numbered = itertools.chain([first], numbered)
+        while True:
+            chunk = list(itertools.islice(numbered, chunk_rows))
+            if not chunk:
+                return
+            yield header, chunk
+
+def validate(rows, numbers, lookup):
+    # (取り込む行, 除外した行) を返す。型の検証は読み込み時と同じ ingest() で行う
+    typed, quarantine = storage.ingest(pd.DataFrame(rows, columns=storage.SHEET_HEADER), numbers)
+    dropped = set(quarantine['行'])
+    kept_numbers = [n for n in numbers if n not in dropped]
+    reason = pd.Series('', index=typed.index)
+    reason[~typed['種目名'].astype(str).isin(list(lookup))] = '未登録の種目'
+    reason[typed['回数(レップ)'] < 1] = '回数'
+    reason[typed['重量(kg)'] < 0] = '重量'
+    reason[typed['ユーザー名'].astype(str) == ''] = 'ユーザー名'
+    bad = (reason != '').to_numpy()
+    if bad.any():
+        extra = pd.DataFrame(storage.to_raw_rows(typed[bad]), columns=storage.SHEET_HEADER)
+        extra.insert(0, '理由', reason[bad].to_numpy())
+        extra.insert(0, '行', [n for n, b in zip(kept_numbers, bad) if b])
+        quarantine = pd.concat([quarantine, extra], ignore_index=True)
+        typed = typed[~bad]
+    return storage.to_raw_rows(typed), quarantine
+
+class Importer:
+    def __init__(self, backend, username=None, dry_run=False):
+        self.backend = backend
+        self.username = username
+        self.dry_run = dry_run
+        self.existing = {}  # ユーザー -> 取り込み先にある行の Counter (重複した同じセットも個数で数える)
+        self.stats = Counter()
+        self.layouts = Counter()
+        self.skipped = Counter()  # 除外理由 -> 行数
+
+    def _remaining(self, user):
+        if user not in self.existing:
+            self.existing[user] = Counter(tuple(r) for r in storage.to_raw_rows(self.backend.load(user)))
+        return self.existing[user]
+
+    def dedupe(self, rows):
+        new_rows = []
+        for row in rows:
+            remaining = self._remaining(row[-1])
+            if remaining[tuple(row)] > 0:
+                remaining[tuple(row)] -= 1
+                self.stats['duplicate'] += 1
+            else:
+                new_rows.append(row)
+        return new_rows
+
+    def run(self, path, exercises, chunk_rows=IMPORT_CHUNK_ROWS, rejects=None):
+        # rejects は除外した行を [行, 理由, *SHEET_HEADER] の形で受け取る csv.writer
+        detector = None
+        for header, chunk in read_chunks(path, chunk_rows):
+            if detector is None:
+                detector = LayoutDetector(exercises, header)
+            rows, numbers = [], []
+            for number, fields in chunk:
+                layout = detector.detect(fields)
+                self.layouts[layout] += 1
+                rows.append(detector.to_row(fields, layout, self.username))
+                numbers.append(number)
+            self.stats['read'] += len(rows)
+            valid, quarantine = validate(rows, numbers, detector.lookup)
+            for reason in quarantine['理由']:
+                self.skipped[reason or '不明'] += 1
+            if rejects is not None:
+                rejects.writerows(quarantine.values.tolist())
+            new_rows = self.dedupe(valid)
+            self.stats['imported'] += len(new_rows)
+            if new_rows and not self.dry_run:
+                # ログへ記録してから送信するので、途中で止まっても書きかけの chunk は再実行で補われる
+                self.backend.append_many(new_rows)
+                self.backend.flush()
+            print(f"{self.stats['read']} 行を処理 (取り込み {self.stats['imported']} / 重複 {self.stats['duplicate']} / "
+                  f"除外 {sum(self.skipped.values())})")
+        return self.stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='取り込む CSV ファイル')
+    parser.add_argument('--user', help='ユーザー名の列がない行の持ち主')
+    parser.add_argument('--target', choices=['sheets', 'sqlite'], default=storage.STORAGE_BACKEND)
+    parser.add_argument('--chunk-rows', type=int, default=IMPORT_CHUNK_ROWS)
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='append_rows 1回で送る行数')
+    parser.add_argument('--rejects', help='除外した行を書き出す CSV ファイル')
+    parser.add_argument('--dry-run', action='store_true', help='書き込まずに件数だけ表示する')
+    args = parser.parse_args()
+
+    # streamlit run 以外で動かすときの警告を抑える
+    logging.disable(logging.WARNING)
+    storage.WRITE_BATCH_SIZE = args.batch_size
+    # 同じディレクトリでアプリが動いていても、互いのログを書き直したり再送したりしない
+    storage.WRITE_LOG_FILE = IMPORT_WRITE_LOG_FILE
+    importer = Importer(storage.make_backend(args.target), args.user, args.dry_run)
+    with contextlib.ExitStack() as stack:
+        rejects = None
+        if args.rejects:
+            f = stack.enter_context(open(args.rejects, 'w', newline='', encoding='utf-8-sig'))
+            rejects = csv.writer(f)
+            rejects.writerow(['行', '理由'] + storage.SHEET_HEADER)
+        stats = importer.run(args.path, get_catalog(args.user).get(), args.chunk_rows, rejects)
+
+    for layout, n in importer.layouts.most_common():
+        print(f"  {','.join(layout)}: {n} 行")
+    for reason, n in importer.skipped.most_common():
+        print(f"  除外 ({reason}): {n} 行")
+    if args.rejects and importer.skipped:
+        print(f"除外した行を {args.rejects} に書き出しました")
+    verb = '取り込めます' if args.dry_run else '取り込みました'
+    print(f"{stats['read']} 行中 {stats['imported']} 行を{verb} (重複 {stats['duplicate']} 行)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+import importlib
+import sys
+import threading
+import time
+
+import tracing
+
+# --- 重いモジュールの遅延読み込み ---
+# gspread / oauth2client / openai / pandas / numpy は読み込みだけで数百ミリ秒かかる。
+# 最初に属性を参照したときに読み込むことで、ログイン画面はこれらを待たずに描画できる。
+
+IMPORT_TIMES = {}  # モジュール名 -> 遅延読み込みにかかった秒数 (このプロセスで実際に読み込んだものだけ)
+_lock = threading.RLock()
+
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            with _lock:
+                if self._module is None:
+                    loaded = self._name in sys.modules
+                    start = time.perf_counter()
+                    # 計測中の再実行であれば、読み込みも1つの区間として記録される
+                    with tracing.span(f'import {self._name}'):
+                        self._module = importlib.import_module(self._name)
+                    if not loaded:
+                        IMPORT_TIMES[self._name] = time.perf_counter() - start
+                module = self._module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module '{self._name}' ({state})>"
+
+def lazy_import(name):
+    return LazyModule(name)
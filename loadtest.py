@@ -0,0 +1,215 @@
+"""多数のセッションで app.py を同時に操作し、同時接続数ごとの再実行の待ち時間と API 呼び出し数を測る。
+
+    python loadtest.py --concurrency 1 2 4 8 16 --sessions 2 --latency 0.15 --quota 60
+    python loadtest.py --concurrency 8 --users 200 --rows 100000 --output loadtest.json
+
+各セッションは Streamlit のテスト用 API (AppTest) で本物の main() を動かし、
+ログイン -> ダッシュボード -> 部位で絞り込み -> 種目を開く -> セットを記録 の順に操作する。
+ストレージはメモリ上の偽ワークシート (fakesheets.py) で、呼び出しごとの遅延と
+1分あたりの割り当て (超えると 429) を再現する。同時接続数ごとにプロセス内の共有キャッシュを空にして、
+起動直後のサーバーに N 人が同時に使い始めた状態から測る。
+
+AppTest はボタンを押すたびにスクリプト全体を再実行する。本番ではフラグメントの中の操作
+(部位の切り替え・記録の保存) はその部分だけを再実行するので、ここでの待ち時間はそれより長めに出る。
+また、並行に動かすために Streamlit の内部を差し替えているので、確かめた版 (LOADTEST_STREAMLIT_VERSIONS) 以外では動かない。
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+import numpy as np
+import streamlit as st
+from streamlit import config
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest, app_test, local_script_runner
+from streamlit.testing.v1.util import build_mock_config_get_option
+
+import storage
+from benchmark import build_spreadsheet, generate_rows, git_commit
+
+# --- 設定 ---
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+LOADTEST_STREAMLIT_VERSIONS = ('1.65.0',)  # share_process_state() の差し替えを確かめた Streamlit の版
+LOADTEST_SETS_PER_SESSION = 3  # 1セッションで記録するセット数
+LOADTEST_BODY_PART = '胸'  # 絞り込む部位
+LOADTEST_RERUN_TIMEOUT = 120  # 秒: 429 の再試行で待つ分も含める
+STALE_WARNING = 'シートに接続できないため'  # 取得に失敗して前回のデータを表示したときの警告
+FRAGMENT_NOTE = ('AppTest はクリックのたびにスクリプト全体を再実行するので、フラグメントだけの再実行は再現していない '
+                 '(部位の切り替えと記録の保存は、本番より重く測られる)')
+
+class _SharedRuntime(type):
+    # AppTest が実行ごとに差し替える Runtime の代役を、実行が終わっても外さない
+    def __setattr__(cls, name, value):
+        if value is not None:
+            setattr(Runtime, name, value)
+
+@contextlib.contextmanager
+def share_process_state():
+    # AppTest は実行のたびにスクリプトのキャッシュ・Runtime の代役・テスト用の設定を用意し、終わると外す。
+    # 並行に動かすと、別のセッションの後片付けやコンパイルと衝突するので、
+    # 本物のサーバーと同じくプロセスで1つを共有する。
+    # (Streamlit の内部に手を入れるので、LOADTEST_STREAMLIT_VERSIONS の版でだけ確かめてある。抜けるときに元へ戻す)
+    script_cache = ScriptCache()
+    patches = [
+        mock.patch.object(local_script_runner, 'ScriptCache', lambda: script_cache),
+        mock.patch.object(app_test, 'ScriptCache', lambda: script_cache),
+        mock.patch.object(app_test, 'Runtime', _SharedRuntime('Runtime', (Runtime,), {})),
+        mock.patch.object(config, 'get_option', new=build_mock_config_get_option({'global.appTest': True})),
+        mock.patch.object(app_test, 'patch_config_options', lambda overrides: contextlib.nullcontext()),
+    ]
+    with contextlib.ExitStack() as stack:
+        for patch in patches:
+            stack.enter_context(patch)
+        try:
+            yield
+        finally:
+            Runtime._instance = None
+
+class Session:
+    # 1人分の操作。再実行ごとの所要時間 (秒) を記録する
+    def __init__(self, username, sets=LOADTEST_SETS_PER_SESSION, think=0.0):
+        self.username = username
+        self.sets = sets
+        self.think = think  # 秒: 操作の間に待つ時間
+        self.latencies = []
+        self.stale = 0  # 前回のデータで表示した再実行の数
+        self.error = None
+        self.at = AppTest.from_file(APP_PATH, default_timeout=LOADTEST_RERUN_TIMEOUT)
+
+    def _rerun(self, action=None):
+        if self.think and self.latencies:
+            time.sleep(self.think)
+        start = time.perf_counter()
+        (action or self.at).run()
+        self.latencies.append(time.perf_counter() - start)
+        if self.at.exception:
+            raise RuntimeError(self.at.exception[0].message)
+        if self.at.error:
+            # 読み込みや同期の失敗は画面にエラーとして出る (この先の操作はできない)
+            raise RuntimeError(self.at.error[0].value)
+        if any(STALE_WARNING in w.value for w in self.at.warning):
+            self.stale += 1
+
+    def _button(self, key=None, label=None):
+        for button in self.at.button:
+            if (key is not None and button.key == key) or (label is not None and button.label == label):
+                return button
+        raise RuntimeError(f"ボタンが見つかりません: {key or label} (画面: {self.at.session_state['current_view']})")
+
+    def run(self):
+        try:
+            self._rerun()  # ログイン画面
+            self.at.text_input[0].input(self.username)
+            self._rerun(self._button(label='Start').click())  # ダッシュボード
+            self._rerun(self._button(key=f"filter_{LOADTEST_BODY_PART}").click())
+            nav = next((b for b in self.at.button if b.key and b.key.startswith('nav_')), None)
+            if nav is None:
+                raise RuntimeError(f"{LOADTEST_BODY_PART} の種目がありません")
+            self._rerun(nav.click())  # 詳細画面
+            for i in range(self.sets):
+                self.at.number_input(key='input_weight').set_value(40.0 + 2.5 * i)
+                self.at.number_input(key='input_reps').set_value(8)
+                self._rerun(self._button(label='記録を保存').click())
+        except Exception as e:
+            self.error = e
+        return self
+
+def reset_server(fake):
+    # 起動直後のプロセスと同じ状態にする (共有キャッシュ・流量制限・書き込みキューを作り直す)
+    st.cache_resource.clear()
+    storage.get_sheet_handle().use_spreadsheet(fake)
+
+def run_level(concurrency, sessions_per_worker, rows, users, args):
+    fake = build_spreadsheet(rows, args.latency, args.quota)
+    reset_server(fake)
+    usernames = (f"user{i % users}" for i in itertools.count())
+    queue = [Session(next(usernames), args.sets, args.think) for _ in range(concurrency * sessions_per_worker)]
+    lock = threading.Lock()
+    done = []
+
+    def worker():
+        while True:
+            with lock:
+                if not queue:
+                    return
+                session = queue.pop()
+            done.append(session.run())
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, name=f"session-{i}") for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    # 記録したセットはバックグラウンドで送られるので、残りを送り切ってから数える
+    storage.get_write_queue().flush()
+
+    latencies = np.array([t for s in done for t in s.latencies]) * 1000
+    errors = [s.error for s in done if s.error is not None]
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (np.nan,) * 3
+    result = {
+        'concurrency': concurrency, 'sessions': len(done), 'reruns': len(latencies),
+        'p50_ms': round(float(p50), 1), 'p95_ms': round(float(p95), 1), 'p99_ms': round(float(p99), 1),
+        'max_ms': round(float(latencies.max()), 1) if len(latencies) else None,
+        'reruns_per_sec': round(len(latencies) / elapsed, 2),
+        'sessions_per_min': round(len(done) / elapsed * 60, 1),
+        'api_calls_per_session': round(fake.calls / len(done), 1),
+        'quota_errors': fake.rejected, 'stale_reruns': sum(s.stale for s in done),
+        'failed_sessions': len(errors), 'elapsed_sec': round(elapsed, 2),
+    }
+    print(f"{concurrency:>4} 同時 {result['sessions']:>4} セッション  "
+          f"p50 {result['p50_ms']:>8.1f}  p95 {result['p95_ms']:>8.1f}  p99 {result['p99_ms']:>8.1f} ms  "
+          f"{result['reruns_per_sec']:>7.2f} 再実行/秒  API {result['api_calls_per_session']:>6.1f} 回/セッション  "
+          f"429 {result['quota_errors']:>4}  古い表示 {result['stale_reruns']:>4}  失敗 {result['failed_sessions']}")
+    for e in errors[:3]:
+        print(f"    失敗: {e!r}")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16], help='同時に操作するセッション数')
+    parser.add_argument('--sessions', type=int, default=2, help='同時接続1つあたりに続けて流すセッション数')
+    parser.add_argument('--users', type=int, default=100, help='合成データのユーザー数 (セッションは順に割り当てる)')
+    parser.add_argument('--rows', type=int, default=20000, help='合成データの行数')
+    parser.add_argument('--sets', type=int, default=LOADTEST_SETS_PER_SESSION, help='1セッションで記録するセット数')
+    parser.add_argument('--think', type=float, default=0.0, help='操作の間に待つ秒数')
+    parser.add_argument('--latency', type=float, default=0.15, help='Sheets API 1回の所要秒数')
+    parser.add_argument('--quota', type=int, default=storage.SHEETS_REQUESTS_PER_MINUTE,
+                        help='1分あたりの Sheets API の割り当て (0 で無制限)')
+    parser.add_argument('--rpm', type=float, default=storage.SHEETS_REQUESTS_PER_MINUTE,
+                        help='アプリ側の流量制限 (storage.SHEETS_REQUESTS_PER_MINUTE)')
+    parser.add_argument('--output', help='結果を保存する JSON ファイル')
+    args = parser.parse_args()
+    if st.__version__ not in LOADTEST_STREAMLIT_VERSIONS:
+        parser.error(f"Streamlit {st.__version__} では確かめていません (対応: {', '.join(LOADTEST_STREAMLIT_VERSIONS)})。"
+                     "内部の差し替えを確かめてから LOADTEST_STREAMLIT_VERSIONS に加えてください")
+
+    # streamlit run 以外で動かすときの警告を抑え、本物の書き込みログには触れない
+    logging.disable(logging.WARNING)
+    storage.WRITE_LOG_FILE = os.path.join(tempfile.mkdtemp(), 'pending_sets.jsonl')
+    storage.STORAGE_BACKEND = 'sheets'
+    storage.SHEETS_REQUESTS_PER_MINUTE = args.rpm
+
+    rows = generate_rows(args.rows, args.users)
+    with share_process_state():
+        results = [run_level(n, args.sessions, rows, args.users, args) for n in args.concurrency]
+    print(FRAGMENT_NOTE)
+
+    if args.output:
+        meta = {'commit': git_commit(), 'streamlit': st.__version__, 'note': FRAGMENT_NOTE,
+                **{k: v for k, v in vars(args).items() if k != 'output'}}
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'meta': meta, 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"結果を {args.output} に保存しました")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""sheet1 に全ユーザー分まとめて入っている記録を、ユーザーごとのワークシートへ分割する。
+
+    python migrate_partitions.py [--dry-run] [--clear-source]
+
+何度実行しても同じ行が二重に書き込まれることはない (移行先に既にある行は飛ばす)。
+移行が終わってから LIFTOS_PARTITION_BY_USER=1 でアプリを起動し直すと、ユーザーごとのワークシートを読み書きする
+(それまでは sheet1 のまま動く)。--clear-source は、読み込んだ後に sheet1 へ追記された行も消してしまうので、
+アプリを止めてから使う。
+Sheets API はアプリと同じく storage.api_call を通して呼ぶ (流量制限を守り、429/5xx は再試行する)。
+"""
+import argparse
+from collections import Counter, defaultdict
+
+import gspread
+
+import storage
+
+
+def split_rows(data):
+    # ユーザーごとの行は SHEET_HEADER の列だけにし、sheet1 に残す行はそのままの形で返す
+    header = data[0]
+    user_col = header.index('ユーザー名') if 'ユーザー名' in header else None
+    by_user = defaultdict(list)
+    unassigned = []
+    for raw in data[1:]:
+        row = (raw + [''] * len(storage.SHEET_HEADER))[:len(storage.SHEET_HEADER)]
+        if not any(row):
+            continue
+        user = row[user_col] if user_col is not None else ''
+        if user:
+            by_user[user].append(row)
+        else:
+            unassigned.append(raw)
+    return by_user, unassigned
+
+
+def migrate(dry_run=False, clear_source=False):
+    handle = storage.get_sheet_handle()
+    source = handle.get(None)
+    data = storage.api_call('sheets.get_all_values', source.get_all_values)
+    if not data:
+        print("sheet1 は空です。")
+        return
+
+    by_user, unassigned = split_rows(data)
+    for user, rows in by_user.items():
+        partition = storage.user_partition(user)
+        target = handle.get(partition, create=not dry_run)
+        existing = storage.api_call('sheets.get_all_values', target.get_all_values) if target is not None else []
+        # 移行先に既にある行 (前回の移行分や分割後の新規記録) は書き込まない
+        # (書き込みキューが付けた記録ID の列は比べない)
+        remaining = Counter(tuple(r[:len(storage.SHEET_HEADER)]) for r in existing[1:])
+        new_rows = []
+        for row in rows:
+            if remaining[tuple(row)] > 0:
+                remaining[tuple(row)] -= 1
+            else:
+                new_rows.append(row)
+        print(f"{partition}: {len(rows)} 行中 {len(new_rows)} 行を移行")
+        if dry_run or not new_rows:
+            continue
+        payload = new_rows if existing else [storage.SHEET_HEADER] + new_rows
+        storage.api_call('sheets.append_rows', target.append_rows, payload, idempotent=False)
+
+    if unassigned:
+        print(f"ユーザー名のない {len(unassigned)} 行は sheet1 に残します。")
+
+    if clear_source and not dry_run:
+        # 残す行を先頭から上書きしてから、その後ろだけを消す (途中で失敗しても残す行は失われない)
+        # (短い行は空文字で埋めて、前の行の右端のセルも上書きする)
+        width = max(len(row) for row in data)
+        keep = [(row + [''] * width)[:width] for row in [data[0]] + unassigned]
+        storage.api_call('sheets.update', source.update, keep, 'A1')
+        if len(data) > len(keep):
+            last_col = gspread.utils.rowcol_to_a1(1, width).rstrip('0123456789')
+            storage.api_call('sheets.batch_clear', source.batch_clear, [f"A{len(keep) + 1}:{last_col}{len(data)}"])
+        print("sheet1 から移行済みの行を削除しました。")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dry-run', action='store_true', help='書き込まずに移行行数だけ表示する')
+    parser.add_argument('--clear-source', action='store_true', help='移行後に sheet1 から移行済みの行を削除する')
+    args = parser.parse_args()
+    migrate(dry_run=args.dry_run, clear_source=args.clear_source)
@@ -0,0 +1,1446 @@
+import streamlit as st
+
+
+import argparse
+import datetime
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter, deque
+
+import tracing
+from lazy import lazy_import
+from strength import RANGE_LABELS, rep_range
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+pd = lazy_import('pandas')
+gspread = lazy_import('gspread')
+requests = lazy_import('requests')
+service_account = lazy_import('oauth2client.service_account')
+
+# --- 設定 ---
+STORAGE_BACKEND = os.environ.get('LIFTOS_STORAGE', 'sheets')  # 'sheets' または 'sqlite'
+SQLITE_PATH = os.environ.get('LIFTOS_SQLITE_PATH', 'lift_os.db')
+SPREADSHEET_NAME = 'muscle_db'
+# ユーザーごとのワークシートに分けて保存する。既存の sheet1 は migrate_partitions.py で分割してから有効にする
+PARTITION_BY_USER = os.environ.get('LIFTOS_PARTITION_BY_USER', '0') == '1'
+USER_SHEET_PREFIX = 'user_'
+SHEET_HEADER = ['日付', '部位', '種目名', '重量(kg)', '回数(レップ)', 'ユーザー名']
+ROW_ID_HEADER = '記録ID'  # 書き込みキューが行ごとに付ける ID (SHEET_HEADER の次の列)
+ROW_ID_INDEX = len(SHEET_HEADER)
+WEIGHT_DECIMALS = 3  # 重量は float32 で持つので、表示・集計に出すときはこの桁で丸める
+SHEET_REFRESH_INTERVAL = 30  # 秒: この間隔内の再実行ではシートへ問い合わせない
+SHEET_FULL_RELOAD_INTERVAL = 600  # 秒: 途中行の編集を拾うための定期フルリロード
+WRITE_LOG_FILE = 'pending_sets.jsonl'  # 未送信セットの先行書き込みログ (1つのプロセスだけが使う)
+CLI_WRITE_LOG_FILE = 'pending_cli.jsonl'  # python storage.py で書き込むときのログ (アプリのログとは分ける)
+# 1回のトレーニング (セット間は 90〜120 秒の休憩) の記録を、なるべく1回の append_rows で送る
+WRITE_FLUSH_IDLE = 180  # 秒: 最後の記録からこれだけ新しい記録がなければ送る
+WRITE_FLUSH_MAX_AGE = 1800  # 秒: 記録が続いていても、最も古い未送信の行がこれより古くなれば送る
+WRITE_FLUSH_ROWS = 100  # 未送信の行がこれだけたまったらすぐ送る
+WRITE_BATCH_SIZE = 500
+WRITE_MAX_BACKOFF = 300  # 秒
+WRITE_VERIFY_WINDOW = 1000  # 送信結果が不明なバッチを探すシート末尾の行数
+# 行の内容そのものが拒否されたエラー (この行は取り消す)。403 (権限を失った) や 404 (ワークシートが消された) は
+# 設定の問題で行に非はないので、取り消さずにバックオフしながら送り直す
+WRITE_REJECT_STATUSES = (400,)
+SHEETS_REQUESTS_PER_MINUTE = 60  # プロセス全体での Sheets API 呼び出しの上限 (ユーザーあたりの割り当てに合わせる)
+SHEETS_BURST = 10  # 上限内で連続して呼べる回数
+SHEETS_RETRY_STATUSES = (429, 500, 502, 503, 504)
+SHEETS_MAX_RETRIES = 5
+SHEETS_RETRY_MAX_DELAY = 32  # 秒
+SHEET_ERROR_BACKOFF = 15  # 秒: 取得に失敗したら、この間は前回のデータを返して問い合わせない
+SHEET_SYNC_INTERVAL = float(os.environ.get('LIFTOS_SYNC_INTERVAL', '0'))  # 秒: 0 より大きければバックグラウンドで同期する
+SHEET_SYNC_IDLE = 600  # 秒: この間読まれていないワークシートは同期しない
+ARCHIVE_HORIZON_DAYS = int(os.environ.get('LIFTOS_ARCHIVE_DAYS', '180'))  # 圧縮でこれより古いセットをアーカイブへ移す
+ARCHIVE_SHEET_PREFIX = 'archive_'  # 圧縮で移したセット (ユーザーごと)
+ROLLUP_SHEET_PREFIX = 'rollup_'  # アーカイブの日ごとの集計 (ユーザーごと)
+ROLLUP_HEADER = ['日付', '部位', '種目名', 'レップ帯', '重量(kg)', '回数(レップ)', 'セット数', '合計回数', 'ボリューム', 'ユーザー名']
+ROLLUP_REFRESH_INTERVAL = 600  # 秒: ロールアップは圧縮時にしか変わらないので、まれに確認すれば足りる
+
+# --- API 呼び出しの流量制限と再試行 ---
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.lock = threading.Lock()
+        self.rate = rate  # 1秒あたりに補充するトークン数
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def acquire(self):
+        # トークンが1つ取れるまで待つ
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+@st.cache_resource
+def get_rate_limiter():
+    return TokenBucket(SHEETS_REQUESTS_PER_MINUTE / 60, SHEETS_BURST)
+
+def _status(e):
+    return getattr(getattr(e, 'response', None), 'status_code', None)
+
+def _retry_delay(e, attempt):
+    # Retry-After があれば従い、なければ指数バックオフ (揺らぎ付き)
+    retry_after = getattr(getattr(e, 'response', None), 'headers', {}).get('Retry-After')
+    if retry_after and str(retry_after).isdigit():
+        return min(int(retry_after), SHEETS_RETRY_MAX_DELAY)
+    return min(2 ** attempt, SHEETS_RETRY_MAX_DELAY) * random.uniform(0.5, 1.0)
+
+def api_call(kind, fn, *args, idempotent=True, **kwargs):
+    # Sheets API を1回呼ぶ。流量制限を守り、429/5xx は指数バックオフで再試行する。
+    # 結果が不明になりうる書き込み (idempotent=False) は 429 (未処理が確実) のときだけ再試行する。
+    # 流量制限の待ちと再試行も含めて kind の区間として計測し、取り込み (ingest) の時間と分けて見られるようにする
+    limiter = get_rate_limiter()
+    with tracing.span(kind):
+        for attempt in range(SHEETS_MAX_RETRIES + 1):
+            limiter.acquire()
+            tracing.count(kind)
+            try:
+                return fn(*args, **kwargs)
+            except gspread.exceptions.APIError as e:
+                status = _status(e)
+                retryable = status == 429 or (idempotent and status in SHEETS_RETRY_STATUSES)
+                if not retryable or attempt == SHEETS_MAX_RETRIES:
+                    raise
+                error = e
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if not idempotent or attempt == SHEETS_MAX_RETRIES:
+                    raise
+                error = e
+            time.sleep(_retry_delay(error, attempt))
+
+# --- gspread クライアント (プロセス内で共有) ---
+class SheetHandle:
+    def __init__(self):
+        self.lock = threading.Lock()  # 下の辞書と接続の差し替え用 (API 呼び出しの間は持たない)
+        self.connect_lock = threading.Lock()
+        self.partition_locks = {}  # パーティション -> Lock (同じワークシートの問い合わせを1本にする)
+        self.client = None
+        self.spreadsheet = None
+        self.worksheets = {}  # パーティション -> Worksheet (None は sheet1)
+        self.missing = {}  # パーティション -> 見つからなかった時刻 (この間は問い合わせ直さない)
+        self.has_header = {}  # パーティション -> bool (未確認なら無し)
+
+    def get(self, partition=None, create=False):
+        with self.lock:
+            worksheet = self.worksheets.get(partition)
+            if worksheet is not None:
+                return worksheet
+            partition_lock = self.partition_locks.setdefault(partition, threading.Lock())
+        # 流量制限の待ちや再試行で止まるのは同じパーティションを探す呼び出しだけにする
+        with partition_lock:
+            with self.lock:
+                worksheet = self.worksheets.get(partition)
+                missing_at = self.missing.get(partition)
+            if worksheet is not None:
+                return worksheet
+            if partition is not None and not create and missing_at and time.time() - missing_at < SHEET_REFRESH_INTERVAL:
+                return None
+            spreadsheet = self.open()
+            created = False
+            if partition is None:
+                worksheet = api_call('sheets.sheet1', lambda: spreadsheet.sheet1)
+            else:
+                try:
+                    worksheet = api_call('sheets.worksheet', spreadsheet.worksheet, partition)
+                except gspread.exceptions.WorksheetNotFound:
+                    if not create:
+                        # まだ一度も記録していないユーザー。別のプロセスが作ることもあるので、しばらくしたら確かめ直す
+                        with self.lock:
+                            if self.spreadsheet is spreadsheet:
+                                self.missing[partition] = time.time()
+                        return None
+                    cols = len(ROLLUP_HEADER) if partition.startswith(ROLLUP_SHEET_PREFIX) else len(SHEET_HEADER)
+                    worksheet = api_call('sheets.add_worksheet', spreadsheet.add_worksheet,
+                                         partition, rows=1000, cols=cols, idempotent=False)
+                    created = True
+            with self.lock:
+                # 問い合わせ中に接続が差し替えられていたら、古いワークシートは覚えない
+                if self.spreadsheet is spreadsheet:
+                    self.worksheets[partition] = worksheet
+                    self.missing.pop(partition, None)
+                    if created:
+                        self.has_header[partition] = False
+            return worksheet
+
+    def open(self):
+        # 接続済みのスプレッドシート (未接続なら接続する。待つのは最初の接続の間だけ)
+        with self.lock:
+            spreadsheet = self.spreadsheet
+        if spreadsheet is not None:
+            return spreadsheet
+        with self.connect_lock:
+            with self.lock:
+                spreadsheet = self.spreadsheet
+            if spreadsheet is None:
+                spreadsheet = self._connect()
+                with self.lock:
+                    self.spreadsheet = spreadsheet
+            return spreadsheet
+
+    def _connect(self):
+        # 認可はプロセスで一度だけ。アクセストークンの更新は gspread のセッションが期限切れ時にのみ行う
+        scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+        creds = service_account.ServiceAccountCredentials.from_json_keyfile_dict(dict(st.secrets["gcp_service_account"]), scope)
+        self.client = gspread.authorize(creds)
+        try:
+            return api_call('sheets.open', self.client.open, SPREADSHEET_NAME)
+        except gspread.exceptions.SpreadsheetNotFound:
+            st.error(f"スプレッドシート '{SPREADSHEET_NAME}' が見つかりません。")
+            st.stop()
+
+    def use_spreadsheet(self, spreadsheet):
+        # 認可を経ずに、与えたスプレッドシート (ベンチマーク用の偽物など) を使う
+        with self.lock:
+            self.spreadsheet = spreadsheet
+            self.worksheets = {}
+            self.missing = {}
+            self.has_header = {}
+
+    def forget(self, partition):
+        # ワークシートが消された (404) ときに、覚えていたものを捨てて次の呼び出しで探し直させる
+        with self.lock:
+            self.worksheets.pop(partition, None)
+            self.has_header.pop(partition, None)
+
+    def reset(self):
+        with self.lock:
+            self.client = None
+            self.spreadsheet = None
+            self.worksheets = {}
+            self.missing = {}
+            self.has_header = {}
+
+    def run(self, fn, partition=None, create=False):
+        # トークンが失効・取り消しされていた場合のみ再認可して一度だけやり直す
+        try:
+            return fn(self.get(partition, create))
+        except gspread.exceptions.APIError as e:
+            if _status(e) != 401:
+                raise
+            self.reset()
+            return fn(self.get(partition, create))
+
+    def refresh(self, cache, partition=None, force=False):
+        # キャッシュの鮮度を先に確かめ、問い合わせが要るときだけワークシートを解決する (401 の扱いは run() と同じ)
+        try:
+            return cache.refresh(lambda: self.get(partition), force)
+        except gspread.exceptions.APIError as e:
+            if _status(e) != 401:
+                raise
+            self.reset()
+            return cache.refresh(lambda: self.get(partition), force)
+
+@st.cache_resource
+def get_sheet_handle():
+    return SheetHandle()
+
+def user_partition(username):
+    return f"{USER_SHEET_PREFIX}{username}"
+
+def get_partition(username):
+    # ユーザーのデータを持つワークシート名 (None は共有の sheet1)
+    if PARTITION_BY_USER and username:
+        return user_partition(username)
+    return None
+
+# --- 型付きスキーマ (取り込み時に一度だけ変換する) ---
+CATEGORY_COLUMNS = ['部位', '種目名', 'ユーザー名']
+SCHEMA_DTYPES = {
+    '日付': 'datetime64[ns]',
+    '部位': 'category',
+    '種目名': 'category',
+    '重量(kg)': 'float32',
+    '回数(レップ)': 'int16',
+    'ユーザー名': 'category',
+}
+
+def empty_frame():
+    return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in SCHEMA_DTYPES.items()})
+
+@tracing.traced('ingest')
+def ingest(raw, row_numbers=None):
+    # 文字列の表を型付きの表に変換する。変換できない行は理由を付けて quarantine に分ける
+    if raw.empty:
+        return empty_frame(), pd.DataFrame(columns=['行', '理由'] + SHEET_HEADER)
+    raw = raw.reindex(columns=SHEET_HEADER, fill_value='')
+    date = pd.to_datetime(raw['日付'], errors='coerce', format='mixed')
+    weight = pd.to_numeric(raw['重量(kg)'], errors='coerce')
+    reps = pd.to_numeric(raw['回数(レップ)'], errors='coerce')
+    
+    bad_date = date.isna()
+    bad_weight = weight.isna()
+    bad_reps = reps.isna() | (reps != reps.round()) | (reps.abs() > 32767)
+    bad = (bad_date | bad_weight | bad_reps).to_numpy()
+    
+    typed = pd.DataFrame({
+        '日付': date[~bad].to_numpy(),
+        '部位': pd.Categorical(raw['部位'][~bad]),
+        '種目名': pd.Categorical(raw['種目名'][~bad]),
+        '重量(kg)': weight[~bad].to_numpy(dtype='float32'),
+        '回数(レップ)': reps[~bad].to_numpy().astype('int16'),
+        'ユーザー名': pd.Categorical(raw['ユーザー名'][~bad]),
+    })
+    
+    quarantine = raw[bad].copy()
+    reasons = (bad_date.map({True: '日付 ', False: ''}) + bad_weight.map({True: '重量 ', False: ''})
+               + bad_reps.map({True: '回数', False: ''}))
+    quarantine.insert(0, '理由', reasons[bad].str.strip().to_numpy())
+    numbers = row_numbers if row_numbers is not None else range(1, len(raw) + 1)
+    quarantine.insert(0, '行', pd.Series(list(numbers), index=raw.index)[bad].to_numpy())
+    return typed, quarantine.reset_index(drop=True)
+
+def concat_frames(frames):
+    # カテゴリ列のカテゴリをそろえてから連結する (そろえないと object 列に戻ってしまう)
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return empty_frame()
+    if len(frames) == 1:
+        return frames[0]
+    for col in CATEGORY_COLUMNS:
+        categories = pd.api.types.union_categoricals([f[col] for f in frames]).categories
+        frames = [f.assign(**{col: f[col].cat.set_categories(categories)}) for f in frames]
+    return pd.concat(frames, ignore_index=True)
+
+def to_raw_rows(df):
+    # 型付きの表をシートに書く文字列の行に戻す
+    return [
+        [date.strftime('%Y-%m-%d'), str(part), str(exercise), f"{float(weight):g}", str(int(reps)), str(user)]
+        for date, part, exercise, weight, reps, user in df[SHEET_HEADER].itertuples(index=False)
+    ]
+
+# --- シートキャッシュ (全セッション共有) ---
+class Snapshot:
+    # ある時点のワークシートの内容。公開後は変更しないので、読み手はロックなしで使える
+    def __init__(self, version, frame, quarantine, fetched_at, error=None, ids=frozenset(), changes=None):
+        self.version = version
+        self.changes = changes or {}  # ユーザー -> 全体の読み直しの後に他所から追記された行数
+        self.frame = frame
+        self.quarantine = quarantine
+        self.ids = ids  # 末尾付近の行の記録ID (送信済みの行を送信待ちの行と二重に数えないため)
+        self.fetched_at = fetched_at  # シートと突き合わせた時刻 (0 は未取得)
+        self.error = error  # 直前の取得の失敗 (前回のデータを表示している)
+
+    def user_version(self, username):
+        # ユーザーのデータバージョン。ほかのユーザーの行が増えても変わらない (None は全員分)
+        if username:
+            return self.version + self.changes.get(username, 0)
+        return self.version + sum(self.changes.values())
+
+class SheetCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.header = list(SHEET_HEADER)
+        self.frame = empty_frame()  # 型付きの記録
+        self.quarantine = pd.DataFrame()  # 型変換できなかった行
+        self.tail_ids = deque(maxlen=WRITE_VERIFY_WINDOW)  # 末尾の行の記録ID (送信確認用)
+        self.version = 0  # 全体を読み直すたびに、どのユーザーのバージョンよりも大きく進める
+        self.changes = Counter()  # ユーザー -> 読み直しの後に他所から追記された行数
+        self.row_count = 0  # ヘッダーを含む、シート上で把握している行数
+        self.last_row = None  # 最終行 (編集・削除の検出用)
+        self.fetched_at = 0.0
+        self.full_loaded_at = 0.0
+        self.stale = True
+        self.error = None  # 直前の取得の失敗
+        self.retry_at = 0.0  # 失敗後、この時刻までは問い合わせない
+        self.snapshot = Snapshot(0, self.frame, self.quarantine, 0.0)
+
+    def _publish(self):
+        self.snapshot = Snapshot(self.version, self.frame, self.quarantine, self.fetched_at, self.error,
+                                 frozenset(self.tail_ids), dict(self.changes))
+
+    def _rebase(self):
+        # 全体が変わりうる (読み直し・空になった): 全ユーザーのバージョンをこれまでのどれよりも大きくする
+        self.version += sum(self.changes.values()) + 1
+        self.changes = Counter()
+
+    def invalidate(self):
+        # 次回の refresh で必ずシートを確認させる
+        self.stale = True
+
+    def refresh(self, get_ws, force=False):
+        # 取得はロック下で1本だけ行い、同時に来た読み手はその結果を待って共有する
+        with self.lock:
+            now = time.time()
+            if not force and not self.stale and now - self.fetched_at < SHEET_REFRESH_INTERVAL:
+                return self.version
+            if not force and now < self.retry_at:
+                # 直前の取得が失敗した: 待っていた読み手がそろって問い合わせ直さない
+                if self.fetched_at:
+                    return self.version
+                raise self.error
+            try:
+                worksheet = get_ws()
+                if worksheet is None:
+                    self._reset_empty()
+                elif self.row_count == 0 or now - self.full_loaded_at >= SHEET_FULL_RELOAD_INTERVAL:
+                    self._full_reload(worksheet)
+                elif not self._fetch_tail(worksheet):
+                    # 既知の最終行が一致しない = 編集または削除があった
+                    self._full_reload(worksheet)
+            except Exception as e:
+                if _status(e) == 401:
+                    raise  # 再認可は SheetHandle.run に任せる
+                self.error = e
+                self.retry_at = time.time() + SHEET_ERROR_BACKOFF
+                self._publish()
+                # 一度でも読めていれば前回のデータを返す (読み込みエラーで画面を止めない)
+                if self.fetched_at and not force:
+                    return self.version
+                raise
+            self.fetched_at = time.time()
+            self.stale = False
+            self.error = None
+            self.retry_at = 0.0
+            self._publish()
+            return self.version
+
+    def _align(self, row):
+        # 行の長さをヘッダーに揃える
+        row = list(row[:len(self.header)])
+        if len(row) < len(self.header):
+            row += [''] * (len(self.header) - len(row))
+        return row
+
+    def _last_col(self):
+        # 取得する範囲の最後の列 (ヘッダーに名前がなくても記録ID の列までは読む)
+        width = max(len(self.header), ROW_ID_INDEX + 1)
+        return gspread.utils.rowcol_to_a1(1, width).rstrip('0123456789')
+
+    def _reset_empty(self):
+        if self.row_count > 0 or self.version == 0:
+            self._rebase()
+        self.header = list(SHEET_HEADER)
+        self.frame = empty_frame()
+        self.quarantine = pd.DataFrame()
+        self.tail_ids.clear()
+        self.row_count = 0
+        self.last_row = None
+
+    def _full_reload(self, worksheet):
+        data = api_call('sheets.get_all_values', worksheet.get_all_values)
+        if not data:
+            self._reset_empty()
+        else:
+            header = data[0]
+            # スキーママイグレーション: ユーザー名カラムがない場合に追加
+            if 'ユーザー名' not in header:
+                try:
+                    # 6列目(F列)にヘッダーを追加
+                    api_call('sheets.update_cell', worksheet.update_cell, 1, 6, 'ユーザー名')
+                    header.append('ユーザー名')
+                except Exception as e:
+                    st.warning(f"スキーマ更新中にエラーが発生しましたが続行します: {e}")
+            self.header = header
+            rows = [self._align(row) for row in data[1:]]
+            self.frame, self.quarantine = ingest(pd.DataFrame(rows, columns=self.header), range(2, len(data) + 1))
+            self.tail_ids.clear()
+            self.tail_ids.extend(_row_id(row) for row in data[1:])
+            self.row_count = len(data)
+            self.last_row = self._align(data[-1])
+            self._rebase()
+        self.full_loaded_at = time.time()
+
+    def _fetch_tail(self, worksheet):
+        # 既知の最終行から末尾までだけを取得し、新規行を追記する
+        values = api_call('sheets.get_values', worksheet.get_values, f"A{self.row_count}:{self._last_col()}")
+        if not values or self._align(values[0]) != self.last_row:
+            return False
+        self._append(values[1:])
+        return True
+
+    def _append(self, raw_rows, own=False):
+        # own は自プロセスの書き込みキューが送った行 (送信前から表示に含めているのでバージョンは変えない)
+        if not raw_rows:
+            return
+        self.tail_ids.extend(_row_id(row) for row in raw_rows)
+        rows = [self._align(row) for row in raw_rows]
+        if not own:
+            user_col = self.header.index('ユーザー名') if 'ユーザー名' in self.header else None
+            self.changes.update(row[user_col] if user_col is not None else '' for row in rows)
+        numbers = range(self.row_count + 1, self.row_count + len(rows) + 1)
+        typed, quarantine = ingest(pd.DataFrame(rows, columns=self.header), numbers)
+        self.frame = concat_frames([self.frame, typed])
+        if not quarantine.empty:
+            self.quarantine = pd.concat([self.quarantine, quarantine], ignore_index=True)
+        self.row_count += len(rows)
+        self.last_row = rows[-1]
+
+    def absorb(self, start_row, rows):
+        # 自プロセスで追記した行を、既知の末尾に連続している場合だけ直接取り込む
+        with self.lock:
+            end_row = start_row + len(rows) - 1
+            if self.stale or self.row_count == 0 or start_row > self.row_count + 1:
+                self.stale = True
+            elif end_row <= self.row_count and self._align(rows[-1]) != self.last_row:
+                # 把握している行数より前に追記された = 圧縮などで行が減っていた
+                self.stale = True
+            elif end_row > self.row_count:
+                if start_row == self.row_count + 1:
+                    self._append(rows, own=True)
+                    self._publish()
+                else:
+                    self.stale = True
+
+    def find_ids(self, ids):
+        # ids のうち末尾付近の行にあるもの (送信結果が不明なバッチの確認用)
+        with self.lock:
+            known = set(self.tail_ids)
+        return {entry_id for entry_id in ids if entry_id in known}
+
+@st.cache_resource
+def get_sheet_cache(partition=None):
+    # パーティション (ワークシート) ごとに1つ
+    return SheetCache()
+
+# --- バックグラウンド同期 (SHEET_SYNC_INTERVAL > 0 のとき) ---
+class SyncWorker:
+    # 最近読まれたワークシートとロールアップを一定間隔でシートと突き合わせ、スナップショットを公開する。
+    # これが動いている間、読み手は (初回を除き) ネットワークを待たずにスナップショットを読む
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.active = {}  # (パーティション, ユーザー) -> 最後に読まれた時刻
+        self.wake = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='sheet-sync', daemon=True)
+        self.thread.start()
+
+    def touch(self, partition, username=None):
+        with self.lock:
+            self.active[(partition, username)] = time.time()
+
+    def _run(self):
+        while True:
+            self.wake.wait(timeout=self.interval)
+            self.wake.clear()
+            now = time.time()
+            with self.lock:
+                self.active = {key: t for key, t in self.active.items() if now - t < SHEET_SYNC_IDLE}
+                active = list(self.active)
+            for partition in dict.fromkeys(partition for partition, _ in active):
+                self.sync(partition)
+            for partition, username in active:
+                if username:
+                    self.sync_rollups(partition, username)
+
+    def sync(self, partition):
+        cache = get_sheet_cache(partition)
+        if time.time() < cache.retry_at:
+            return  # 失敗直後は間を空ける
+        try:
+            get_sheet_handle().refresh(cache, partition, force=True)
+        except Exception:
+            pass  # 失敗はスナップショットの error として表示される
+
+    def sync_rollups(self, partition, username):
+        # ロールアップは ColdStore 側の間隔 (またはホットのシートの読み直し) で確認する
+        try:
+            get_cold_store(username).refresh(get_sheet_cache(partition).full_loaded_at)
+        except Exception:
+            pass  # 前回のロールアップのまま (次の確認で取り直す)
+
+@st.cache_resource
+def get_sync_worker():
+    # サーバープロセスで1つだけ起動する
+    return SyncWorker(SHEET_SYNC_INTERVAL) if SHEET_SYNC_INTERVAL > 0 else None
+
+def row_user(row):
+    return row[SHEET_HEADER.index('ユーザー名')]
+
+def row_partition(row):
+    return get_partition(row[SHEET_HEADER.index('ユーザー名')])
+
+def _row_id(row):
+    return row[ROW_ID_INDEX] if len(row) > ROW_ID_INDEX else ''
+
+def append_sheet_rows(rows, ids):
+    # rows は同じパーティションの行だけを含む (WriteQueue がまとめる単位)。
+    # 各行の末尾に記録ID を付けて送り、送信結果が分からなくなっても同じ値のセットと区別できるようにする
+    partition = row_partition(rows[0])
+    handle = get_sheet_handle()
+    cache = get_sheet_cache(partition)
+    
+    # ヘッダーの有無は一度だけ確認して覚えておく (キャッシュ済みならAPIを呼ばない)
+    if partition not in handle.has_header:
+        if cache.row_count > 0:
+            handle.has_header[partition] = True
+        else:
+            handle.has_header[partition] = bool(handle.run(
+                lambda ws: api_call('sheets.row_values', ws.row_values, 1), partition, create=True))
+    
+    # シートが空の場合はヘッダーと同じリクエストで追記する
+    tagged = [list(row) + [entry_id] for row, entry_id in zip(rows, ids)]
+    payload = tagged if handle.has_header[partition] else [SHEET_HEADER + [ROW_ID_HEADER]] + tagged
+    try:
+        response = handle.run(
+            lambda ws: api_call('sheets.append_rows', ws.append_rows, payload, idempotent=False), partition, create=True)
+    except gspread.exceptions.APIError as e:
+        if _status(e) == 404:
+            handle.forget(partition)  # 再送のときに作り直す
+        raise
+    handle.has_header[partition] = True
+    
+    # 追記位置が分かれば再取得せずにキャッシュへ取り込む
+    updated_range = (response or {}).get('updates', {}).get('updatedRange', '')
+    m = re.search(r'![A-Z]+(\d+)', updated_range)
+    if m and payload is tagged:
+        cache.absorb(int(m.group(1)), tagged)
+    else:
+        cache.invalidate()
+
+def sheet_row_ids(rows, ids):
+    # ids のうち、既にシートにある行の記録ID
+    partition = row_partition(rows[0])
+    cache = get_sheet_cache(partition)
+    get_sheet_handle().refresh(cache, partition, force=True)
+    return cache.find_ids(ids)
+
+# --- 書き込みキュー (先行書き込みログ + バックグラウンド送信) ---
+_write_log_guard = threading.Lock()
+_write_log_locks = {}  # ログの絶対パス -> このプロセスが持っているロックファイル
+
+def claim_write_log(path):
+    # ログを再生・書き直し・送信するのは1つのプロセスだけ (2つが同じログを使うと同じ行を二重に送る)。
+    # ロックはプロセスが終わるまで持ち、同じプロセスで作り直したキューはそのまま引き継ぐ
+    key = os.path.abspath(path)
+    with _write_log_guard:
+        if key in _write_log_locks:
+            return
+        f = open(key + '.lock', 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            f.close()
+            raise RuntimeError(f"書き込みログ {path} は別のプロセス (動いているアプリなど) が使っています。"
+                               "storage.WRITE_LOG_FILE に別のファイルを指定してください")
+        _write_log_locks[key] = f
+
+class WriteQueue:
+    def __init__(self, path, send, verify, key):
+        self.path = path
+        self.send = send  # (rows, ids) をシートへ追記する
+        self.verify = verify  # (rows, ids) のうち既にシートにある行の id を返す
+        self.key = key  # 1回の送信にまとめられる行の単位 (送信先)
+        self.lock = threading.Lock()  # pending の更新用 (ネットワークを待つ間は持たない)
+        self.flush_lock = threading.Lock()  # 同じバッチを二重に送らない
+        self.wake = threading.Event()
+        self.pending = []  # [(id, row)] 送信待ち (記録順)
+        self.added = Counter()  # ユーザーごとの受付行数 (データバージョンの一部)
+        self.rejected = []  # [(id, row, エラー)] シートに拒否されて取り消した行
+        self.rejected_count = Counter()  # ユーザーごとの取り消し行数 (データバージョンの一部)
+        self.uncertain = set()  # 送信を試みたが結果が分からない id
+        self.first_added_at = 0.0  # pending が空でなくなった時刻
+        self.last_added_at = 0.0  # 最後に記録を受け付けた時刻 (ログから復元した行は復元した時刻)
+        self.failures = 0
+        self.retry_at = 0.0
+        self.last_error = None
+        claim_write_log(path)
+        self._recover()
+        self.thread = threading.Thread(target=self._run, name='write-queue', daemon=True)
+        self.thread.start()
+
+    def _recover(self):
+        # ログを再生して、未完了の行と結果不明の送信を復元する
+        if not os.path.exists(self.path):
+            return
+        rows = {}
+        order = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # 書き込み途中で落ちた末尾行
+                if rec['op'] == 'add':
+                    rows[rec['id']] = rec['row']
+                    order.append(rec['id'])
+                elif rec['op'] == 'send':
+                    self.uncertain.update(rec['ids'])
+                elif rec['op'] == 'done':
+                    for entry_id in rec['ids']:
+                        rows.pop(entry_id, None)
+                        self.uncertain.discard(entry_id)
+                elif rec['op'] == 'reject':
+                    for entry_id in rec['ids']:
+                        if entry_id in rows:
+                            self.rejected.append((entry_id, rows.pop(entry_id), rec['error']))
+                        self.uncertain.discard(entry_id)
+        self.pending = [(entry_id, rows[entry_id]) for entry_id in order if entry_id in rows]
+        self.uncertain &= set(rows)
+        self.first_added_at = self.last_added_at = time.time()
+        self._compact()
+
+    def _log(self, rec):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(rec, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _compact(self):
+        # 完了済みの記録を捨ててログを書き直す
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry_id, row in self.pending:
+                f.write(json.dumps({'op': 'add', 'id': entry_id, 'row': row}, ensure_ascii=False) + '\n')
+            # 取り消した行は利用者が確認するまで残す
+            for entry_id, row, error in self.rejected:
+                f.write(json.dumps({'op': 'add', 'id': entry_id, 'row': row}, ensure_ascii=False) + '\n')
+                f.write(json.dumps({'op': 'reject', 'ids': [entry_id], 'error': error}, ensure_ascii=False) + '\n')
+            if self.uncertain:
+                f.write(json.dumps({'op': 'send', 'ids': sorted(self.uncertain)}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def add(self, row):
+        return self.add_many([row])[0]
+
+    def add_many(self, rows):
+        entries = [(uuid.uuid4().hex, list(row)) for row in rows]
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for entry_id, row in entries:
+                    f.write(json.dumps({'op': 'add', 'id': entry_id, 'row': row}, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            now = time.time()
+            if not self.pending:
+                self.first_added_at = now
+            self.last_added_at = now
+            self.pending.extend(entries)
+            for _, row in entries:
+                self.added[row_user(row)] += 1
+        self.wake.set()  # 送信の予定を計算し直させる
+        return [entry_id for entry_id, _ in entries]
+
+    def pending_rows(self):
+        with self.lock:
+            return [row for _, row in self.pending]
+
+    def changes(self, username):
+        # ユーザーの受付・取り消し行数の合計 (None は全員分)
+        with self.lock:
+            return self._changes(username)
+
+    def _changes(self, username):
+        if username:
+            return self.added[username] + self.rejected_count[username]
+        return sum(self.added.values()) + sum(self.rejected_count.values())
+
+    def pending_view(self, username):
+        # 送信待ちの (id, 行) と、ユーザーの受付・取り消し行数を同じ時点でまとめて返す
+        with self.lock:
+            return list(self.pending), self._changes(username)
+
+    def rejected_rows(self, key):
+        with self.lock:
+            return [(row, error) for _, row, error in self.rejected if self.key(row) == key]
+
+    def dismiss_rejected(self, key):
+        with self.lock:
+            self.rejected = [entry for entry in self.rejected if self.key(entry[1]) != key]
+            self._compact()
+
+    def _flush_delay(self):
+        # 次に送るまでの秒数。送るものがなければ None (追加されるまで待つ)
+        with self.lock:
+            if not self.pending:
+                return None
+            if len(self.pending) >= WRITE_FLUSH_ROWS:
+                due = 0.0
+            else:
+                due = min(self.last_added_at + WRITE_FLUSH_IDLE, self.first_added_at + WRITE_FLUSH_MAX_AGE)
+        return max(due, self.retry_at) - time.time()
+
+    def _run(self):
+        # 記録が途切れてから (または一定量・一定時間たまったら) まとめて送る。
+        # 行は記録した時点で表示に出ているので、送信を遅らせても利用者は待たない
+        while True:
+            delay = self._flush_delay()
+            if delay is None or delay > 0:
+                self.wake.wait(timeout=delay)
+                self.wake.clear()
+                continue
+            try:
+                self.flush()
+            except Exception as e:
+                # 指数バックオフで再試行する。行はログに残っているので失われない
+                self.failures += 1
+                self.last_error = e
+                self.retry_at = time.time() + min(2 ** self.failures, WRITE_MAX_BACKOFF)
+
+    def flush(self):
+        with self.flush_lock:
+            self._flush()
+
+    def _flush(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    return
+                # 送信先が同じ行だけを1バッチにする
+                key = self.key(self.pending[0][1])
+                batch = [entry for entry in self.pending if self.key(entry[1]) == key][:WRITE_BATCH_SIZE]
+                uncertain = [(entry_id, row) for entry_id, row in batch if entry_id in self.uncertain]
+            ids = [entry_id for entry_id, _ in batch]
+            rows = [row for _, row in batch]
+            
+            # 前回の送信結果が不明な行は、記録ID がシートに既にあるか確かめてから扱う
+            if uncertain:
+                found = self.verify([row for _, row in uncertain], [entry_id for entry_id, _ in uncertain])
+                if found:
+                    sent = [(entry_id, row) for entry_id, row in uncertain if entry_id in found]
+                    self._complete([entry_id for entry_id, _ in sent], [row for _, row in sent], None)
+                    continue
+            
+            # ログへの追記は _compact() の書き直しと重ならないよう、ほかの記録と同じくロック下で行う
+            with self.lock:
+                self._log({'op': 'send', 'ids': ids})
+                self.uncertain.update(ids)
+            try:
+                self._complete(ids, rows, self.send)
+            except gspread.exceptions.APIError as e:
+                if _status(e) not in WRITE_REJECT_STATUSES:
+                    raise
+                # 送信内容そのものが拒否された: 表示に先出ししていた行を取り消す
+                self._reject(ids, str(e))
+                continue
+            self.failures = 0
+            self.last_error = None
+
+    def _complete(self, ids, rows, send):
+        # 送信 (とキャッシュへの取り込み) が済んでから pending を外す。
+        # その間の読み手は同じ行をキャッシュと pending の両方に見るが、記録ID で重複を除く
+        if send is not None:
+            send(rows, ids)
+        with self.lock:
+            self._log({'op': 'done', 'ids': ids})
+            done = set(ids)
+            self.pending = [(entry_id, row) for entry_id, row in self.pending if entry_id not in done]
+            self.uncertain -= done
+            if not self.pending:
+                self._compact()
+
+    def _reject(self, ids, error):
+        with self.lock:
+            self._log({'op': 'reject', 'ids': ids, 'error': error})
+            rejected = set(ids)
+            for entry_id, row in self.pending:
+                if entry_id in rejected:
+                    self.rejected.append((entry_id, row, error))
+                    self.rejected_count[row_user(row)] += 1
+            self.pending = [(entry_id, row) for entry_id, row in self.pending if entry_id not in rejected]
+            self.uncertain -= rejected
+
+@st.cache_resource
+def get_write_queue():
+    return WriteQueue(WRITE_LOG_FILE, append_sheet_rows, sheet_row_ids, row_partition)
+
+# --- 種目ごとの集計 (最新セット・最高セット・セット数) ---
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+def build_exercise_summary(df, rollups=None):
+    # {種目名: {'count': n, 'last': セット, 'best': セット}} を列演算でまとめて作る。
+    # rollups があれば、アーカイブ済みの日ごとの最高セットも1セットとして含め、セット数を補う
+    if rollups is not None and not rollups.empty:
+        df = concat_frames([rollup_best_sets(rollups), df])
+    if df.empty:
+        return {}
+    work = pd.DataFrame({
+        'exercise': df['種目名'].to_numpy(),
+        'date': df['日付'].dt.strftime('%Y-%m-%d').to_numpy(),
+        # float32 の重量は丸めてから取り出す (22.7 が 22.700000762939453 にならないように)
+        'weight': df['重量(kg)'].to_numpy(dtype=float).round(WEIGHT_DECIMALS),
+        'reps': df['回数(レップ)'].to_numpy(dtype=int),
+    })
+    # 同じ日付なら後に記録したものを最新、同じ重量なら回数の多いものを最高とする
+    last = work.sort_values('date', kind='stable').groupby('exercise').tail(1)
+    best = work.sort_values(['weight', 'reps'], ascending=False, kind='stable').groupby('exercise').head(1)
+    counts = work.groupby('exercise').size()
+    
+    if rollups is not None and not rollups.empty:
+        extra = rollups.groupby('種目名')['セット数'].sum() - rollups.groupby('種目名').size()
+        counts = counts.add(extra, fill_value=0)
+    
+    summary = {ex: {'count': int(n)} for ex, n in counts.items()}
+    for key, part in (('last', last), ('best', best)):
+        for ex, date, weight, reps in part[['exercise', 'date', 'weight', 'reps']].itertuples(index=False):
+            summary[ex][key] = {'date': date, 'weight': float(weight), 'reps': int(reps)}
+    return summary
+
+def update_exercise_summary(summary, row):
+    # 1セット分を O(1) で反映する
+    date, _, exercise, weight, reps = row[:5]
+    record = {'date': str(date), 'weight': _to_float(weight), 'reps': int(_to_float(reps))}
+    entry = summary.get(exercise)
+    if entry is None:
+        summary[exercise] = {'count': 1, 'last': record, 'best': record}
+        return
+    entry['count'] += 1
+    if record['date'] >= entry['last']['date']:
+        entry['last'] = record
+    if (record['weight'], record['reps']) > (entry['best']['weight'], entry['best']['reps']):
+        entry['best'] = record
+
+# --- アーカイブとロールアップ (古いセットをホットのシートから移す) ---
+# 圧縮 (compact) は ARCHIVE_HORIZON_DAYS より古いセットをアーカイブのワークシートへ移し、
+# (日, 種目, レップ帯) ごとの最高セット・セット数・合計回数・ボリュームをロールアップに残す。
+# 普段の読み込みはホットのシートとロールアップだけで、アーカイブは全期間を表示するときだけ読む。
+
+def empty_rollups():
+    return pd.DataFrame(columns=ROLLUP_HEADER).astype({'日付': 'datetime64[ns]'})
+
+def build_rollups(df):
+    # 型付きのセットからロールアップ (型付き) を作る
+    if df.empty:
+        return empty_rollups()
+    r = rep_range(df['回数(レップ)'].to_numpy())
+    work = pd.DataFrame({
+        '日付': df['日付'].dt.normalize().to_numpy(),
+        '部位': df['部位'].astype(str).to_numpy(),
+        '種目名': df['種目名'].astype(str).to_numpy(),
+        'レップ帯': [RANGE_LABELS[i] if i >= 0 else '' for i in r],
+        '重量(kg)': df['重量(kg)'].to_numpy(dtype=float),
+        '回数(レップ)': df['回数(レップ)'].to_numpy(dtype=int),
+        'ユーザー名': df['ユーザー名'].astype(str).to_numpy(),
+    })
+    work['ボリューム'] = work['重量(kg)'] * work['回数(レップ)']
+    keys = ['日付', '部位', '種目名', 'レップ帯', 'ユーザー名']
+    # 最高セットは重量が重いもの、同じ重量なら回数が多いもの
+    best = work.sort_values(['重量(kg)', '回数(レップ)'], ascending=False, kind='stable').groupby(keys, sort=False).head(1)
+    totals = work.groupby(keys, sort=False).agg(
+        セット数=('回数(レップ)', 'size'), 合計回数=('回数(レップ)', 'sum'), ボリューム=('ボリューム', 'sum'))
+    rollups = best.drop(columns='ボリューム').merge(totals.reset_index(), on=keys)
+    return rollups.sort_values(['日付', '種目名', 'レップ帯'], kind='stable')[ROLLUP_HEADER].reset_index(drop=True)
+
+def ingest_rollups(raw):
+    # シートの文字列の表を型付きのロールアップにする (読めない行は捨てる: 圧縮のたびに作り直される)
+    if raw.empty:
+        return empty_rollups()
+    raw = raw.reindex(columns=ROLLUP_HEADER, fill_value='')
+    typed = pd.DataFrame({
+        '日付': pd.to_datetime(raw['日付'], errors='coerce', format='mixed'),
+        **{col: raw[col].astype(str) for col in ('部位', '種目名', 'レップ帯', 'ユーザー名')},
+        **{col: pd.to_numeric(raw[col], errors='coerce')
+           for col in ('重量(kg)', '回数(レップ)', 'セット数', '合計回数', 'ボリューム')},
+    })[ROLLUP_HEADER]
+    typed = typed.dropna().reset_index(drop=True)
+    return typed.astype({'回数(レップ)': int, 'セット数': int})
+
+def rollup_raw_rows(rollups):
+    return [
+        [date.strftime('%Y-%m-%d'), part, exercise, band, f"{weight:g}", str(int(reps)), str(int(sets)),
+         f"{total_reps:.12g}", f"{volume:.12g}", user]
+        for date, part, exercise, band, weight, reps, sets, total_reps, volume, user
+        in rollups[ROLLUP_HEADER].itertuples(index=False)
+    ]
+
+def rollup_best_sets(rollups):
+    # 各ロールアップ行の最高セットを1セットとみなした表 (SCHEMA_DTYPES の型)。
+    # レップ帯ごとのベストと種目ごとの最高記録はアーカイブを読まずにこれで求められる
+    if rollups.empty:
+        return empty_frame()
+    return pd.DataFrame({
+        '日付': rollups['日付'].to_numpy(),
+        '部位': pd.Categorical(rollups['部位']),
+        '種目名': pd.Categorical(rollups['種目名']),
+        '重量(kg)': rollups['重量(kg)'].to_numpy(dtype='float32'),
+        '回数(レップ)': rollups['回数(レップ)'].to_numpy().astype('int16'),
+        'ユーザー名': pd.Categorical(rollups['ユーザー名']),
+    })
+
+def archive_partition(username):
+    return f"{ARCHIVE_SHEET_PREFIX}{username}"
+
+def rollup_partition(username):
+    return f"{ROLLUP_SHEET_PREFIX}{username}"
+
+class ColdStore:
+    # ユーザー1人分のロールアップ (小さいので全体を読む) と、必要になるまで読まないアーカイブ
+    def __init__(self, username):
+        self.username = username
+        self.lock = threading.Lock()
+        self.raw = None  # 前回読んだロールアップの生の行 (変化の検出用)
+        self.rollups = empty_rollups()
+        self.version = 0  # ロールアップが変わるたびに増える (データバージョンに含める)
+        self.fetched_at = 0.0
+        self.archive = None  # (version, 型付きのアーカイブ)
+
+    def refresh(self, hot_reloaded_at=0.0):
+        # 一定間隔で、またはホットのシートを読み直した後 (圧縮で行が減ったときを含む) に確認する
+        with self.lock:
+            if self.fetched_at and time.time() - self.fetched_at < ROLLUP_REFRESH_INTERVAL \
+                    and hot_reloaded_at <= self.fetched_at:
+                return self.version
+            handle = get_sheet_handle()
+            values = handle.run(
+                lambda ws: api_call('sheets.get_all_values', ws.get_all_values) if ws is not None else [],
+                rollup_partition(self.username))
+            self.fetched_at = time.time()
+            if values != self.raw:
+                self.raw = values
+                self.rollups = ingest_rollups(pd.DataFrame(values[1:], columns=values[0]) if values else pd.DataFrame())
+                self.version += 1
+            return self.version
+
+    def load_archive(self):
+        with self.lock:
+            if self.archive is None or self.archive[0] != self.version:
+                values = get_sheet_handle().run(
+                    lambda ws: api_call('sheets.get_all_values', ws.get_all_values) if ws is not None else [],
+                    archive_partition(self.username))
+                frame = ingest(pd.DataFrame(values[1:], columns=values[0]))[0] if len(values) > 1 else empty_frame()
+                self.archive = (self.version, frame)
+            return self.archive[1]
+
+@st.cache_resource
+def get_cold_store(username):
+    return ColdStore(username)
+
+def compact(username, horizon_days=ARCHIVE_HORIZON_DAYS, dry_run=False):
+    # horizon_days より古いセットをアーカイブへ移してロールアップを作り直し、移した行数を返す。
+    # アーカイブへの追記 -> ロールアップ -> ホットからの削除 の順なので、途中で止まっても再実行すればよい
+    # (アーカイブに既にある行は追記しない)
+    handle = get_sheet_handle()
+    partition = get_partition(username)
+    hot = handle.get(partition)
+    if hot is None:
+        return 0
+    data = api_call('sheets.get_all_values', hot.get_all_values)
+    if len(data) < 2:
+        return 0
+    header = data[0]
+    rows = [(list(row) + [''] * len(header))[:len(header)] for row in data[1:]]
+    raw = pd.DataFrame(rows, columns=header).reindex(columns=SHEET_HEADER, fill_value='')
+    numbers = pd.Series(range(2, len(data) + 1))
+    _, quarantine = ingest(raw, numbers)
+    # 読めない行はホットに残して、画面の「除外した行」から見えるようにしておく
+    date = pd.to_datetime(raw['日付'], errors='coerce', format='mixed')
+    cutoff = pd.Timestamp(datetime.date.today() - datetime.timedelta(days=horizon_days))
+    cold = ((date < cutoff) & (raw['ユーザー名'] == username) & ~numbers.isin(quarantine['行'])).to_numpy()
+    if not cold.any():
+        return 0
+    cold_rows = raw[cold].values.tolist()
+    if dry_run:
+        return len(cold_rows)
+
+    archive = handle.get(archive_partition(username), create=True)
+    existing = api_call('sheets.get_all_values', archive.get_all_values)
+    remaining = Counter(tuple(r[:len(SHEET_HEADER)]) for r in existing[1:])
+    new_rows = []
+    for row in cold_rows:
+        if remaining[tuple(row)] > 0:
+            remaining[tuple(row)] -= 1
+        else:
+            new_rows.append(row)
+    if new_rows:
+        payload = new_rows if existing else [SHEET_HEADER] + new_rows
+        api_call('sheets.append_rows', archive.append_rows, payload, idempotent=False)
+
+    # ロールアップはアーカイブ全体から作り直す (小さいので上書きで足りる)
+    archived = ingest(pd.DataFrame([r[:len(SHEET_HEADER)] for r in existing[1:]] + new_rows, columns=SHEET_HEADER))[0]
+    rollup_rows = [ROLLUP_HEADER] + rollup_raw_rows(build_rollups(archived))
+    rollup_ws = handle.get(rollup_partition(username), create=True)
+    old_count = len(api_call('sheets.get_all_values', rollup_ws.get_all_values))
+    api_call('sheets.update', rollup_ws.update, rollup_rows, 'A1')
+    if old_count > len(rollup_rows):
+        api_call('sheets.batch_clear', rollup_ws.batch_clear, [f"A{len(rollup_rows) + 1}:J{old_count}"])
+
+    # 削除する行を含む範囲をまとめて1回読み、内容が変わっていないか確かめてから、
+    # 連続区間ごとの deleteDimension を1回の batch_update で送る (後ろの区間から並べるので前の行番号がずれない)。
+    # 追記は末尾にしか入らないので、確かめた後に増えた行は消さない
+    last_col = gspread.utils.rowcol_to_a1(1, len(header)).rstrip('0123456789')
+    runs = []
+    for number in numbers[cold]:
+        if runs and runs[-1][1] == number - 1:
+            runs[-1][1] = number
+        else:
+            runs.append([number, number])
+    first, last = runs[0][0], runs[-1][1]
+    current = api_call('sheets.get_values', hot.get_values, f"A{first}:{last_col}{last}")
+    current = [(list(row) + [''] * len(header))[:len(header)] for row in current]
+    if current != rows[first - 2:last - 1]:
+        raise RuntimeError(f"{partition} の {first}-{last} 行目が圧縮中に変更されました。もう一度実行してください")
+    deletes = [{'deleteDimension': {'range': {'sheetId': hot.id, 'dimension': 'ROWS',
+                                              'startIndex': start - 1, 'endIndex': end}}}
+               for start, end in reversed(runs)]
+    api_call('sheets.batch_update', hot.spreadsheet.batch_update, {'requests': deletes}, idempotent=False)
+
+    get_sheet_cache(partition).invalidate()
+    return len(cold_rows)
+
+# --- ストレージバックエンド ---
+class StorageBackend:
+    # 書き込みは SHEET_HEADER の並びの文字列の行、読み出しは SCHEMA_DTYPES の型付きの表。
+    # 問い合わせ系は load() の結果を pandas で処理する既定実装を持ち、
+    # 索引を持つバックエンドは上書きする。
+
+    def load(self, username):
+        raise NotImplementedError
+
+    def append(self, row):
+        raise NotImplementedError
+
+    def append_many(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def users(self):
+        raise NotImplementedError
+
+    def version(self, username):
+        # ユーザーのデータが変わるたびに増える整数 (1行追記すると1増える)
+        raise NotImplementedError
+
+    def flush(self):
+        # 書き込みを確定させる (バッファを持つバックエンドのみ)
+        pass
+
+    def quarantine(self, username):
+        # 型変換できずに load() から除外された行
+        return pd.DataFrame()
+
+    def freshness(self, username):
+        # (最後に保存先と突き合わせた時刻, 直前の取得の失敗)。常に最新を読むバックエンドは None
+        return None
+
+    def sync_now(self, username):
+        pass
+
+    def rejected(self, username):
+        # 表示には反映したが、保存先に拒否されて取り消した行 (非同期に書き込むバックエンドのみ)
+        return pd.DataFrame()
+
+    def dismiss_rejected(self, username):
+        pass
+
+    def rollups(self, username):
+        # 圧縮でアーカイブへ移したセットの日ごとの集計 (アーカイブを持つバックエンドのみ)
+        return empty_rollups()
+
+    def archive_history(self, username, exercise):
+        # アーカイブにある種目の記録。全期間を表示するときだけ呼ぶ
+        return empty_frame()
+
+    def exercise_history(self, username, exercise):
+        df = self.load(username)
+        return df[df['種目名'] == exercise].sort_values('日付', kind='stable')
+
+    def exercise_summary(self, username):
+        return build_exercise_summary(self.load(username), self.rollups(username))
+
+    def last_dates(self, username):
+        df = self.load(username)
+        dates = df.groupby('種目名', observed=True)['日付'].max().to_dict()
+        rollups = self.rollups(username)
+        if not rollups.empty:
+            for exercise, date in rollups.groupby('種目名')['日付'].max().items():
+                dates[exercise] = max(dates.get(exercise, date), date)
+        return dates
+
+class SheetsBackend(StorageBackend):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}  # ユーザー -> (データバージョン, 表示用の表)
+
+    def load(self, username):
+        # ログイン中のユーザーのワークシートだけを読む
+        partition = get_partition(username)
+        cache = get_sheet_cache(partition)
+        queue = get_write_queue()
+        worker = get_sync_worker()
+        if worker is not None:
+            worker.touch(partition, username)
+        for _ in range(2):
+            # 同期スレッドが動いていれば、一度読めたワークシートは公開済みのスナップショットを使う
+            # (自分の書き込みを取り込めなかったときだけはその場で読み直す)
+            if worker is None or not cache.snapshot.fetched_at or cache.stale:
+                get_sheet_handle().refresh(cache, partition)
+            # 送信待ちの行を先に、スナップショットを後に読む。間に送信が済んでも行は必ずどちらかにある
+            # (両方にある行はスナップショットの方を使う)
+            entries, changes = queue.pending_view(username)
+            snapshot = cache.snapshot
+            version = snapshot.user_version(username) + changes
+            df = snapshot.frame
+            pending = [row for entry_id, row in entries if entry_id not in snapshot.ids]
+            if not cache.stale:
+                break
+        # ロールアップも、同期スレッドが動いていれば初回以外は公開済みのものを使う
+        cold = get_cold_store(username) if username else None
+        if cold is not None and (worker is None or not cold.fetched_at):
+            try:
+                cold.refresh(cache.full_loaded_at)
+            except Exception:
+                pass  # 前回のロールアップのまま (次の確認で取り直す)
+        
+        # 同じデータバージョンなら前回組み立てた表をそのまま返す
+        with self.lock:
+            cached = self.views.get(username)
+        if cached and cached[0] == version:
+            return cached[1]
+        
+        # まだシートへ送信されていない行も先出しして表示に含める (送信に失敗すれば取り消される)
+        if pending:
+            df = concat_frames([df, ingest(pd.DataFrame(pending, columns=SHEET_HEADER))[0]])
+        
+        if username:
+            df = df[df['ユーザー名'] == username]
+        else:
+            df = df.copy()
+        with self.lock:
+            self.views[username] = (version, df)
+        return df
+
+    def quarantine(self, username):
+        q = get_sheet_cache(get_partition(username)).snapshot.quarantine
+        if username and not q.empty:
+            q = q[q['ユーザー名'] == username]
+        return q
+
+    def freshness(self, username):
+        snapshot = get_sheet_cache(get_partition(username)).snapshot
+        return snapshot.fetched_at, snapshot.error
+
+    def sync_now(self, username):
+        partition = get_partition(username)
+        cache = get_sheet_cache(partition)
+        get_sheet_handle().refresh(cache, partition, force=True)
+
+    def rejected(self, username):
+        rows = get_write_queue().rejected_rows(get_partition(username))
+        df = pd.DataFrame([row for row, _ in rows], columns=SHEET_HEADER)
+        df['理由'] = [error for _, error in rows]
+        if username and not df.empty:
+            df = df[df['ユーザー名'] == username]
+        return df
+
+    def dismiss_rejected(self, username):
+        get_write_queue().dismiss_rejected(get_partition(username))
+
+    def rollups(self, username):
+        return get_cold_store(username).rollups if username else empty_rollups()
+
+    def archive_history(self, username, exercise):
+        if not username:
+            return empty_frame()
+        df = get_cold_store(username).load_archive()
+        return df[df['種目名'] == exercise].sort_values('日付', kind='stable')
+
+    def append(self, row):
+        # ローカルのログへ記録した時点で表示に反映する。シートへはバックグラウンドでまとめて送る
+        get_write_queue().add(row)
+
+    def append_many(self, rows):
+        get_write_queue().add_many(rows)
+
+    def version(self, username):
+        partition = get_partition(username)
+        queue = get_write_queue()
+        cold = get_cold_store(username).version if username else 0
+        return get_sheet_cache(partition).snapshot.user_version(username) + queue.changes(username) + cold
+
+    def users(self):
+        if not PARTITION_BY_USER:
+            df = self.load(None)
+            return sorted(u for u in df['ユーザー名'].unique() if u)
+        handle = get_sheet_handle()
+        worksheets = handle.run(lambda ws: api_call('sheets.worksheets', handle.open().worksheets))
+        return sorted(w.title[len(USER_SHEET_PREFIX):] for w in worksheets if w.title.startswith(USER_SHEET_PREFIX))
+
+    def flush(self):
+        get_write_queue().flush()
+
+class SQLiteBackend(StorageBackend):
+    COLUMNS = ['date', 'part', 'exercise', 'weight', 'reps', 'user']  # SHEET_HEADER と同じ並び
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.frames = {}  # ユーザー -> (バージョン, 型付きの表, 除外行)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            # 値はシートと同じ文字列のまま持つ (バックエンド間で行をそのまま突き合わせられる)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS sets (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    date TEXT NOT NULL,
+                    part TEXT NOT NULL DEFAULT '',
+                    exercise TEXT NOT NULL,
+                    weight TEXT NOT NULL DEFAULT '',
+                    reps TEXT NOT NULL DEFAULT '',
+                    user TEXT NOT NULL
+                )""")
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_sets_user_exercise_date ON sets (user, exercise, date)')
+            # ユーザーごとのデータバージョンを書き込みのたびにトリガーで進める
+            self.conn.execute('CREATE TABLE IF NOT EXISTS data_versions (user TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+            for event, ref in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+                self.conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS sets_version_{event.lower()} AFTER {event} ON sets
+                    BEGIN
+                        INSERT INTO data_versions (user, version) VALUES ({ref}.user, 1)
+                        ON CONFLICT (user) DO UPDATE SET version = version + 1;
+                    END""")
+
+    def _query(self, sql, params, columns=SHEET_HEADER):
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return pd.DataFrame(rows, columns=columns)
+
+    def _load_typed(self, username):
+        # 型変換はデータバージョンごとに一度だけ
+        version = self.version(username)
+        cached = self.frames.get(username)
+        if cached is None or cached[0] != version:
+            cols = ', '.join(['id'] + self.COLUMNS)
+            if username:
+                raw = self._query(f'SELECT {cols} FROM sets WHERE user = ? ORDER BY id', (username,), ['id'] + SHEET_HEADER)
+            else:
+                raw = self._query(f'SELECT {cols} FROM sets ORDER BY id', (), ['id'] + SHEET_HEADER)
+            typed, quarantine = ingest(raw[SHEET_HEADER], raw['id'])
+            cached = (version, typed, quarantine)
+            if username:
+                self.frames[username] = cached
+        return cached
+
+    def load(self, username):
+        return self._load_typed(username)[1]
+
+    def quarantine(self, username):
+        return self._load_typed(username)[2]
+
+    def append(self, row):
+        self.append_many([row])
+
+    def append_many(self, rows):
+        placeholders = ', '.join('?' * len(self.COLUMNS))
+        with self.lock, self.conn:
+            self.conn.executemany(
+                f'INSERT INTO sets ({", ".join(self.COLUMNS)}) VALUES ({placeholders})',
+                [[str(v) for v in row[:len(self.COLUMNS)]] for row in rows])
+
+    def users(self):
+        with self.lock:
+            return [r[0] for r in self.conn.execute('SELECT DISTINCT user FROM sets ORDER BY user')]
+
+    def exercise_history(self, username, exercise):
+        cols = ', '.join(self.COLUMNS)
+        return ingest(self._query(
+            f'SELECT {cols} FROM sets WHERE user = ? AND exercise = ? ORDER BY date, id',
+            (username, exercise)))[0]
+
+    def version(self, username):
+        with self.lock:
+            row = self.conn.execute('SELECT version FROM data_versions WHERE user = ?', (username,)).fetchone()
+        return row[0] if row else 0
+
+    def exercise_summary(self, username):
+        with self.lock:
+            counts = self.conn.execute(
+                'SELECT exercise, COUNT(*) FROM sets WHERE user = ? GROUP BY exercise', (username,)).fetchall()
+            # 最新セットは索引 (user, exercise, date) を逆順にたどって種目ごとに1行だけ読む
+            last = self.conn.execute("""
+                SELECT exercise, date, weight, reps FROM sets WHERE id IN (
+                    SELECT (SELECT s.id FROM sets s
+                            WHERE s.user = e.user AND s.exercise = e.exercise
+                            ORDER BY s.date DESC, s.id DESC LIMIT 1)
+                    FROM (SELECT DISTINCT user, exercise FROM sets WHERE user = ?) e)""",
+                (username,)).fetchall()
+            best = self.conn.execute("""
+                SELECT exercise, date, weight, reps FROM (
+                    SELECT exercise, date, weight, reps, ROW_NUMBER() OVER (
+                        PARTITION BY exercise
+                        ORDER BY CAST(weight AS REAL) DESC, CAST(reps AS INTEGER) DESC, id) AS rn
+                    FROM sets WHERE user = ?)
+                WHERE rn = 1""", (username,)).fetchall()
+        summary = {ex: {'count': n} for ex, n in counts}
+        for key, rows in (('last', last), ('best', best)):
+            for ex, date, weight, reps in rows:
+                summary[ex][key] = {'date': date, 'weight': _to_float(weight), 'reps': int(_to_float(reps))}
+        return summary
+
+    def last_dates(self, username):
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT exercise, MAX(date) FROM sets WHERE user = ? GROUP BY exercise', (username,)).fetchall()
+        dates = pd.to_datetime(pd.Series(dict(rows), dtype=object), errors='coerce', format='mixed')
+        return dates.dropna().to_dict()
+
+def make_backend(name):
+    if name == 'sheets':
+        return SheetsBackend()
+    if name == 'sqlite':
+        return SQLiteBackend(SQLITE_PATH)
+    raise ValueError(f"不明なストレージ: {name}")
+
+@st.cache_resource
+def get_storage():
+    return make_backend(STORAGE_BACKEND)
+
+# --- バックエンド間の同期 ---
+def sync(source, target, users=None):
+    # source にあって target にない行だけを target へ追記する (行の重複は個数で数える)
+    copied = {}
+    for user in users or source.users():
+        remaining = Counter(tuple(r) for r in to_raw_rows(target.load(user)))
+        missing = []
+        for row in to_raw_rows(source.load(user)):
+            if remaining[tuple(row)] > 0:
+                remaining[tuple(row)] -= 1
+            else:
+                missing.append(row)
+        if missing:
+            target.append_many(missing)
+        copied[user] = len(missing)
+    target.flush()
+    return copied
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ストレージバックエンド間で記録を同期する')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sync_parser = sub.add_parser('sync', help='source にあって target にない記録を target へコピーする')
+    sync_parser.add_argument('source', choices=['sheets', 'sqlite'])
+    sync_parser.add_argument('target', choices=['sheets', 'sqlite'])
+    sync_parser.add_argument('--user', action='append', help='対象ユーザー (複数指定可、省略時は全員)')
+    compact_parser = sub.add_parser('compact', help='古いセットをアーカイブへ移し、日ごとの集計を残す (シートのみ)')
+    compact_parser.add_argument('--user', action='append', help='対象ユーザー (複数指定可、省略時は全員)')
+    compact_parser.add_argument('--days', type=int, default=ARCHIVE_HORIZON_DAYS, help='この日数より古いセットを移す')
+    compact_parser.add_argument('--dry-run', action='store_true', help='移さずに行数だけ表示する')
+    args = parser.parse_args()
+    # 動いているアプリの書き込みログは再生も送信もしない (このコマンド専用のログを使う)
+    WRITE_LOG_FILE = CLI_WRITE_LOG_FILE
+    
+    if args.command == 'compact':
+        for user in args.user or SheetsBackend().users():
+            n = compact(user, args.days, args.dry_run)
+            print(f"{user}: {n} 行を{'アーカイブできます' if args.dry_run else 'アーカイブへ移動'}")
+    else:
+        if args.source == args.target:
+            parser.error('source と target が同じです')
+        copied = sync(make_backend(args.source), make_backend(args.target), args.user)
+        for user, n in copied.items():
+            print(f"{user}: {n} 行をコピー")
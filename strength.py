@@ -0,0 +1,103 @@
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# --- 筋力指標 ---
+# 推定1RMの式と、種目 x レップ帯ごとの自己ベスト (PR) の索引。
+
+# 式名 -> (表示名, 関数)。weight / reps は配列でもスカラーでもよい
+FORMULAS = {
+    'epley': ('Epley', lambda weight, reps: weight * (1 + reps / 30)),
+    'brzycki': ('Brzycki', lambda weight, reps: weight * 36 / np.where(reps < 37, 37 - reps, np.nan)),
+    'lombardi': ('Lombardi', lambda weight, reps: weight * np.power(reps, 0.10)),
+}
+
+# レップ帯 (下限, ラベル)。上限は次の帯の下限 - 1
+REP_RANGES = [(1, '1'), (2, '2-3'), (4, '4-6'), (7, '7-10'), (11, '11-15'), (16, '16+')]
+_RANGE_BOUNDS = [low for low, _ in REP_RANGES]
+RANGE_LABELS = [label for _, label in REP_RANGES]
+
+def epley_1rm(weight, reps):
+    return FORMULAS['epley'][1](weight, reps)
+
+def one_rep_maxes(df):
+    # 全行・全式の推定1RMを列演算で一度に求める (列名は式名)
+    weight = df['重量(kg)'].to_numpy(dtype=float)
+    reps = df['回数(レップ)'].to_numpy(dtype=float)
+    return pd.DataFrame({name: fn(weight, reps) for name, (_, fn) in FORMULAS.items()}, index=df.index)
+
+def rep_range(reps):
+    # 回数 -> レップ帯の番号 (0回以下は -1)
+    return np.searchsorted(_RANGE_BOUNDS, reps, side='right') - 1
+
+class PRIndex:
+    # (種目, レップ帯) ごとの現在のベストと、ベストを更新したセットの履歴。
+    # ベストは重量が重いもの、同じ重量なら回数が多いもの (種目ごとの集計の 'best' と同じ基準)。
+    # update() は記録した順に反映する (過去の日付で追加したセットもその時点の更新として扱う)。
+    def __init__(self, df):
+        self.best = {}  # (種目, レップ帯ラベル) -> {'date', 'weight', 'reps'}
+        self.history = {}  # (種目, レップ帯ラベル) -> [セット, ...] (古い順)
+        if not df.empty:
+            self._build(df)
+
+    def _build(self, df):
+        work = pd.DataFrame({
+            'exercise': df['種目名'].astype(str).to_numpy(),
+            'range': rep_range(df['回数(レップ)'].to_numpy()),
+            'date': df['日付'].dt.strftime('%Y-%m-%d').to_numpy(),
+            'weight': df['重量(kg)'].to_numpy(dtype=float).round(3),  # float32 の端数を落とす (表に出すので)
+            'reps': df['回数(レップ)'].to_numpy(dtype=int),
+        })
+        work = work[work['range'] >= 0].sort_values('date', kind='stable')
+        # 重量優先・回数で同点を分ける1つのスコアにして、グループごとの累積最大と比べる
+        work['score'] = work['weight'] * 10000 + work['reps']
+        prev_best = work.groupby(['exercise', 'range'])['score'].cummax().groupby(
+            [work['exercise'], work['range']]).shift(fill_value=-np.inf)
+        events = work[work['score'] > prev_best]
+        for exercise, r, date, weight, reps in events[['exercise', 'range', 'date', 'weight', 'reps']].itertuples(index=False):
+            record = {'date': date, 'weight': float(weight), 'reps': int(reps)}
+            key = (exercise, RANGE_LABELS[r])
+            self.history.setdefault(key, []).append(record)
+            self.best[key] = record
+
+    def _key(self, exercise, reps):
+        r = int(rep_range(reps))
+        return (exercise, RANGE_LABELS[r]) if r >= 0 else None
+
+    def is_pr(self, exercise, weight, reps):
+        # このセットを記録したらベスト更新になるか
+        key = self._key(exercise, reps)
+        if key is None:
+            return False
+        best = self.best.get(key)
+        return best is None or (weight, reps) > (best['weight'], best['reps'])
+
+    def update(self, row):
+        # 1セット分を O(1) で反映し、ベスト更新なら True
+        date, _, exercise, weight, reps = row[:5]
+        weight = float(pd.to_numeric(weight, errors='coerce'))
+        reps = float(pd.to_numeric(reps, errors='coerce'))
+        if np.isnan(weight) or np.isnan(reps):
+            return False
+        reps = int(reps)
+        if not self.is_pr(exercise, weight, reps):
+            return False
+        record = {'date': str(date), 'weight': weight, 'reps': reps}
+        key = self._key(exercise, reps)
+        self.history.setdefault(key, []).append(record)
+        self.best[key] = record
+        return True
+
+    def bests(self, exercise):
+        # レップ帯ごとのベスト (記録のある帯だけ、帯の順)
+        return {label: self.best[(exercise, label)] for label in RANGE_LABELS if (exercise, label) in self.best}
+
+    def pr_history(self, exercise, limit=None):
+        # 種目のベスト更新の履歴 [(レップ帯ラベル, セット)] (新しい順。同じ帯の同じ日は後に更新した方が先)
+        events = [
+            (record['date'], i, label, record)
+            for label in RANGE_LABELS for i, record in enumerate(self.history.get((exercise, label), ()))
+        ]
+        events.sort(key=lambda event: event[:2], reverse=True)
+        return [(label, record) for _, _, label, record in events[:limit]]
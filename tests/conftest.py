@@ -0,0 +1,54 @@
+import logging
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+import streamlit as st
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage
+from fakesheets import FakeSpreadsheet
+
+USER = 'akito'
+EXERCISES = [('胸', 'ベンチプレス'), ('脚', 'スクワット'), ('背中', 'デッドリフト')]
+
+def workout_rows(n, users=(USER,), seed=0):
+    # 日付順に記録された SHEET_HEADER の並びの行 (同じ日に同じ種目を何セットもやる日を含む)
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2026-01-01')
+    rows = []
+    for day in np.sort(rng.integers(0, 120, n)):
+        part, exercise = EXERCISES[rng.integers(len(EXERCISES))]
+        weight = round((40 + day * 0.2 + rng.normal(0, 3)) / 2.5) * 2.5
+        rows.append([str(start + day), part, exercise, f"{weight:g}", str(rng.integers(3, 13)),
+                     users[rng.integers(len(users))]])
+    return rows
+
+def frame(rows):
+    # 読み込み時と同じ型付きの表
+    return storage.ingest(pd.DataFrame(rows, columns=storage.SHEET_HEADER))[0]
+
+@pytest.fixture(autouse=True)
+def quiet():
+    # streamlit run 以外で cache_resource を使うときの警告を抑える
+    logging.disable(logging.WARNING)
+    yield
+    logging.disable(logging.NOTSET)
+
+@pytest.fixture
+def sheets(tmp_path, monkeypatch):
+    # ユーザー1人分のワークシートを持つ偽スプレッドシートにつないだ、起動直後のプロセス
+    monkeypatch.setattr(storage, 'WRITE_LOG_FILE', str(tmp_path / 'pending_sets.jsonl'))
+    monkeypatch.setattr(storage, 'WRITE_FLUSH_IDLE', 3600)  # 送信はテストから flush() で行う
+    monkeypatch.setattr(storage, 'WRITE_FLUSH_MAX_AGE', 3600)
+    monkeypatch.setattr(storage, 'SHEETS_REQUESTS_PER_MINUTE', 60000)
+    monkeypatch.setattr(storage, 'SHEETS_BURST', 1000)
+    monkeypatch.setattr(storage, 'PARTITION_BY_USER', True)
+    fake = FakeSpreadsheet({storage.get_partition(USER): [storage.SHEET_HEADER]})
+    st.cache_resource.clear()
+    storage.get_sheet_handle().use_spreadsheet(fake)
+    yield fake
+    st.cache_resource.clear()
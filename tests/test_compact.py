@@ -0,0 +1,41 @@
+import datetime
+
+import pytest
+
+import storage
+from conftest import USER
+
+OTHER = 'mika'
+
+def day(days_ago):
+    return (datetime.date.today() - datetime.timedelta(days=days_ago)).isoformat()
+
+def test_compact_deletes_every_run_in_one_request(sheets, monkeypatch):
+    # 全員が sheet1 を共有する配置では、古いセットが他のユーザーの行と交互に並ぶ
+    monkeypatch.setattr(storage, 'PARTITION_BY_USER', False)
+    old = [[day(400 - i), '胸', 'ベンチプレス', str(60 + i % 5), '8', USER] for i in range(200)]
+    theirs = [[day(400 - i), '脚', 'スクワット', '100', '5', OTHER] for i in range(200)]
+    recent = [[day(1), '胸', 'ベンチプレス', '70', '8', USER]]
+    sheets.sheet1.rows = [storage.SHEET_HEADER] + [row for pair in zip(old, theirs) for row in pair] + recent
+    calls = sheets.calls
+
+    assert storage.compact(USER) == len(old)
+    # 行ごとの読み直し・削除ではなく、確認の読み出し1回と削除の batch_update 1回で済む
+    assert sheets.calls - calls < 15
+    assert sheets.sheet1.rows == [storage.SHEET_HEADER] + theirs + recent
+    assert sheets.worksheet(storage.archive_partition(USER)).rows == [storage.SHEET_HEADER] + old
+
+def test_compact_stops_when_the_rows_changed(sheets, monkeypatch):
+    monkeypatch.setattr(storage, 'PARTITION_BY_USER', False)
+    old = [[day(400 - i), '胸', 'ベンチプレス', '60', '8', USER] for i in range(3)]
+    sheets.sheet1.rows = [storage.SHEET_HEADER] + old
+    get_values = sheets.sheet1.get_values
+
+    def edited(range_name=None, **kwargs):
+        sheets.sheet1.rows[2][3] = '65'  # 圧縮の途中で手で直された
+        return get_values(range_name, **kwargs)
+
+    sheets.sheet1.get_values = edited
+    with pytest.raises(RuntimeError):
+        storage.compact(USER)
+    assert len(sheets.sheet1.rows) == 4
@@ -0,0 +1,52 @@
+import storage
+from conftest import USER
+
+OTHER = 'mika'
+
+def other_set(weight):
+    return ['2026-10-01', '脚', 'スクワット', weight, '5', OTHER]
+
+def test_other_users_saves_do_not_change_my_version(sheets, monkeypatch):
+    # 全員が sheet1 を共有する (既定の) 配置でも、データバージョンはユーザーごとに進む
+    monkeypatch.setattr(storage, 'PARTITION_BY_USER', False)
+    sheets.sheet1.rows = [storage.SHEET_HEADER, other_set('100')]
+    backend = storage.make_backend('sheets')
+    backend.load(OTHER)
+    backend.load(USER)
+    theirs = backend.version(OTHER)
+    mine = backend.version(USER)
+
+    backend.append(['2026-10-01', '胸', 'ベンチプレス', '60', '8', USER])
+    assert backend.version(USER) == mine + 1
+    assert backend.version(OTHER) == theirs
+
+    # 送信してキャッシュへ取り込んでも、表示の中身は変わらないのでバージョンも変わらない
+    storage.get_write_queue().flush()
+    assert len(backend.load(USER)) == 1
+    assert backend.version(USER) == mine + 1
+    assert backend.version(OTHER) == theirs
+
+    # 別の端末から追記された行は、その持ち主のバージョンだけを進める
+    sheets.sheet1.rows.append(other_set('105'))
+    storage.get_sheet_cache(None).invalidate()
+    assert len(backend.load(OTHER)) == 2
+    assert backend.version(OTHER) > theirs
+    assert backend.version(USER) == mine + 1
+
+def test_full_reload_moves_every_version_forward(sheets, monkeypatch):
+    monkeypatch.setattr(storage, 'PARTITION_BY_USER', False)
+    sheets.sheet1.rows = [storage.SHEET_HEADER, other_set('100')]
+    backend = storage.make_backend('sheets')
+    backend.load(OTHER)
+    sheets.sheet1.rows.append(other_set('105'))
+    storage.get_sheet_cache(None).invalidate()
+    backend.load(OTHER)
+    backend.load(USER)
+    before = {user: backend.version(user) for user in (OTHER, USER)}
+
+    cache = storage.get_sheet_cache(None)
+    cache.full_loaded_at = 0  # 次は全体を読み直す
+    storage.get_sheet_handle().refresh(cache, None, force=True)
+    # どのユーザーのバージョンも読み直しの前より進む (前の値に戻って古い派生インデックスを使うことがない)
+    for user, version in before.items():
+        assert backend.version(user) > version
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from conftest import EXERCISES, USER, frame, workout_rows
+from forecast import ForecastEngine
+
+OTHER = 'mika'
+NAMES = [exercise for _, exercise in EXERCISES]
+
+def test_update_matches_a_rebuild():
+    # 記録の後半を1セットずつ update() で足した結果が、全体から作り直した結果と同じになる
+    rows = workout_rows(300, users=(USER, OTHER))
+    engine = ForecastEngine(frame(rows[:100]))
+    for row in rows[100:]:
+        engine.update(row)
+    rebuilt = ForecastEngine(frame(rows))
+
+    assert engine.index.keys() == rebuilt.index.keys()
+    for key, i in rebuilt.index.items():
+        j = engine.index[key]
+        assert engine.origin[j] == rebuilt.origin[i]
+        assert np.allclose(engine.stats[j], rebuilt.stats[i])
+    for user in (USER, OTHER):
+        assert engine.forecasts(user, NAMES, '2026-06-01') == rebuilt.forecasts(user, NAMES, '2026-06-01')
+
+def test_update_adds_an_exercise_missing_from_the_first_build():
+    rows = [row for row in workout_rows(60) if row[2] != 'デッドリフト']
+    engine = ForecastEngine(frame(rows))
+    assert 'デッドリフト' not in engine.forecasts(USER, NAMES)
+
+    new_sets = [['2026-05-01', '背中', 'デッドリフト', str(100 + 5 * i), '5', USER] for i in range(3)]
+    for row in new_sets:
+        engine.update(row)
+    rebuilt = ForecastEngine(frame(rows + new_sets))
+    assert engine.forecasts(USER, NAMES, '2026-06-01') == rebuilt.forecasts(USER, NAMES, '2026-06-01')
+    # 同じ日の3セットだけなので、傾きは0で平均をそのまま予測する
+    assert engine.forecasts(USER, ['デッドリフト'], '2026-06-01')['デッドリフト']['weight'] == pytest.approx(105)
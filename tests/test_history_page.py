@@ -0,0 +1,43 @@
+import pandas as pd
+
+import app
+
+def history(days):
+    # 古い順の (日付, セットの ID) の表。days は 1日ごとのセット数
+    rows = [(pd.Timestamp('2026-03-01') + pd.Timedelta(days=d), f"{d}-{k}") for d, n in enumerate(days) for k in range(n)]
+    return pd.DataFrame(rows, columns=['日付', 'id'])
+
+def pages(df, size):
+    # 新しいページから順に (表示するセットの ID, 次のカーソル)
+    result, cursor = [], None
+    while True:
+        start, end, cursor = app.history_page(df['日付'], cursor, size)
+        result.append((list(df['id'].iloc[start:end]), cursor))
+        if cursor is None:
+            return result
+
+def test_pages_cover_every_set_once():
+    # ページの境目が同じ日のセットの途中に来ても、抜けや重複がない
+    df = history([3, 1, 4, 1, 5, 2, 6])
+    shown = [set_id for ids, _ in pages(df, 5) for set_id in ids]
+    assert sorted(shown) == sorted(df['id'])
+    assert len(shown) == len(df)
+
+def test_cursor_keeps_the_page_after_new_sets_arrive():
+    df = history([3, 1, 4, 1, 5, 2, 6])
+    (first, cursor), (second, _) = pages(df, 5)[:2]
+
+    # 表示中に新しいセットが記録された (今日の分と、最新の日に追加した分)
+    newer = pd.DataFrame([(df['日付'].iloc[-1], 'late'), (pd.Timestamp('2026-03-20'), 'today')], columns=['日付', 'id'])
+    grown = pd.concat([df, newer], ignore_index=True).sort_values('日付', kind='stable', ignore_index=True)
+    start, end, _ = app.history_page(grown['日付'], cursor, 5)
+    assert list(grown['id'].iloc[start:end]) == second
+    # 最初のページは新しい記録を含む形で作り直される
+    start, end, _ = app.history_page(grown['日付'], None, 5)
+    assert list(grown['id'].iloc[start:end])[-2:] == ['late', 'today']
+    assert first[-1] in list(grown['id'].iloc[start:end])
+
+def test_cursor_before_every_set_is_the_end():
+    # 期間を狭めてカーソルの日より前の記録がなくなったら、空のページ (画面は最初のページへ戻す)
+    df = history([3, 1, 4])
+    assert app.history_page(df['日付'], ('2026-02-01', 2), 5) == (0, 0, None)
@@ -0,0 +1,42 @@
+import os
+
+import pandas as pd
+
+import import_csv
+from catalog import DEFAULT_EXERCISES
+from conftest import USER
+
+TRAINING_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'training_data.csv')
+
+def read_rows(detector, path):
+    # (行番号, 判定した並び, 取り込む形の行) のリスト
+    rows = []
+    for _, chunk in import_csv.read_chunks(path, 5):  # chunk の境目をまたいでも行番号が続く
+        for number, fields in chunk:
+            layout = detector.detect(fields)
+            rows.append((number, layout, detector.to_row(fields, layout, USER)))
+    return rows
+
+def test_layout_is_detected_per_row():
+    # training_data.csv はヘッダーの並びの行と、日付,部位,種目名,重量,回数 の行が混在している
+    detector = import_csv.LayoutDetector(DEFAULT_EXERCISES, import_csv.KNOWN_LAYOUTS[0])
+    rows = read_rows(detector, TRAINING_DATA)
+    assert [number for number, _, _ in rows] == list(range(2, 14))
+    by_number = {number: (layout, row) for number, layout, row in rows}
+    assert by_number[2] == (import_csv.KNOWN_LAYOUTS[0], ['2026-01-13', '脚', 'スクワット', '70.0', '5', USER])
+    assert by_number[9] == (import_csv.KNOWN_LAYOUTS[1], ['2026-01-13', '胸', 'ベンチプレス', '60.0', '5', USER])
+    assert by_number[12] == (import_csv.KNOWN_LAYOUTS[1], ['2026-01-13', '胸', 'ペックフライ', '30.0', '5', USER])
+    assert [layout for _, layout, _ in rows].count(import_csv.KNOWN_LAYOUTS[1]) == 5
+
+def test_validate_quarantines_rows_with_their_line_numbers():
+    detector = import_csv.LayoutDetector(DEFAULT_EXERCISES)
+    rows = read_rows(detector, TRAINING_DATA)
+    rows.append((14, import_csv.KNOWN_LAYOUTS[1], ['2026-01-16', '胸', 'ベンチプレス', '60', '0', USER]))
+    rows.append((15, import_csv.KNOWN_LAYOUTS[1], ['2026-01-16', '胸', '謎のマシン', '40', '10', USER]))
+    kept, quarantine = import_csv.validate([row for _, _, row in rows],
+                                           pd.Series([number for number, _, _ in rows]), detector.lookup)
+    # 日付のない行 (8行目)・回数0・未登録の種目は除外し、何行目かを理由と一緒に残す
+    assert dict(zip(quarantine['行'], quarantine['理由'])) == {8: '日付', 14: '回数', 15: '未登録の種目'}
+    assert len(kept) == 11
+    # 同じセットが2行あっても両方取り込む (重複の除去は取り込み先との突き合わせで行う)
+    assert kept.count(['2026-01-13', '胸', 'ペックフライ', '30', '5', USER]) == 2
@@ -0,0 +1,41 @@
+import threading
+
+import storage
+
+def test_slow_lookup_does_not_block_other_partitions(sheets):
+    # 1人目のワークシートの問い合わせが止まっていても、2人目のワークシートは引ける
+    sheets.add_worksheet('user_slow')
+    sheets.add_worksheet('user_fast')
+    release = threading.Event()
+    entered = threading.Event()
+    worksheet = sheets.worksheet
+
+    def blocking(title):
+        if title == 'user_slow':
+            entered.set()
+            release.wait(5)
+        return worksheet(title)
+
+    sheets.worksheet = blocking
+    handle = storage.get_sheet_handle()
+    slow = threading.Thread(target=handle.get, args=('user_slow',))
+    slow.start()
+    assert entered.wait(5)
+    try:
+        assert handle.get('user_fast').title == 'user_fast'
+        assert slow.is_alive()
+    finally:
+        release.set()
+        slow.join()
+    assert handle.get('user_slow').title == 'user_slow'
+
+def test_missing_partition_is_looked_up_once(sheets):
+    handle = storage.get_sheet_handle()
+    calls = sheets.calls
+    threads = [threading.Thread(target=handle.get, args=('user_nobody',)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert handle.get('user_nobody') is None
+    assert sheets.calls - calls == 1
@@ -0,0 +1,35 @@
+from conftest import EXERCISES, USER, frame, workout_rows
+from strength import RANGE_LABELS, PRIndex, rep_range
+
+def test_update_matches_a_rebuild():
+    # 日付順に記録したセットを1つずつ update() で足すと、全体から作り直したのと同じベストと履歴になる
+    rows = workout_rows(300)
+    prs = PRIndex(frame(rows[:100]))
+    updated = 0
+    for row in rows[100:]:
+        expected = prs.is_pr(row[2], float(row[3]), int(row[4]))
+        assert prs.update(row) == expected
+        updated += expected
+    rebuilt = PRIndex(frame(rows))
+
+    assert updated > 0
+    assert prs.best == rebuilt.best
+    assert prs.history == rebuilt.history
+    for _, exercise in EXERCISES:
+        assert prs.bests(exercise) == rebuilt.bests(exercise)
+        assert prs.pr_history(exercise, 20) == rebuilt.pr_history(exercise, 20)
+
+def test_pr_history_is_newest_first():
+    rows = [
+        ['2026-03-01', '胸', 'ベンチプレス', '60', '8', USER],
+        ['2026-03-01', '胸', 'ベンチプレス', '62.5', '8', USER],  # 同じ日のうちに更新
+        ['2026-03-05', '胸', 'ベンチプレス', '80', '3', USER],
+        ['2026-03-08', '胸', 'ベンチプレス', '60', '8', USER],  # 更新ではない
+    ]
+    prs = PRIndex(frame(rows[:1]))
+    for row in rows[1:]:
+        prs.update(row)
+    three, eight = RANGE_LABELS[rep_range(3)], RANGE_LABELS[rep_range(8)]
+    history = [(label, record['date'], record['weight']) for label, record in prs.pr_history('ベンチプレス')]
+    assert history == [(three, '2026-03-05', 80.0), (eight, '2026-03-01', 62.5), (eight, '2026-03-01', 60.0)]
+    assert prs.pr_history('ベンチプレス', 1) == prs.pr_history('ベンチプレス')[:1]
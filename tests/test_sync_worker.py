@@ -0,0 +1,21 @@
+import storage
+from conftest import USER
+
+def test_rollups_are_refreshed_by_the_worker_not_the_request(sheets, monkeypatch):
+    monkeypatch.setattr(storage, 'SHEET_SYNC_INTERVAL', 3600)  # 同期はテストから呼ぶ
+    monkeypatch.setattr(storage, 'ROLLUP_REFRESH_INTERVAL', 0)  # 毎回確かめ直す時期にする
+    rollups = sheets.add_worksheet(storage.rollup_partition(USER))
+    rollups.rows = [storage.ROLLUP_HEADER]
+    backend = storage.make_backend('sheets')
+    worker = storage.get_sync_worker()
+
+    # 初回だけは読み込みの中でロールアップを読む
+    backend.load(USER)
+    assert rollups.calls == 1
+    backend.load(USER)
+    assert rollups.calls == 1
+
+    rollups.rows.append(['2026-01-01', '胸', 'ベンチプレス', '7-10', '60', '8', '3', '24', '1440', USER])
+    worker.sync_rollups(storage.get_partition(USER), USER)
+    assert rollups.calls == 2
+    assert len(backend.rollups(USER)) == 1
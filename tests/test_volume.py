@@ -0,0 +1,37 @@
+import datetime
+
+import pytest
+
+import storage
+from conftest import USER, frame, workout_rows
+from volume import VolumeAggregates
+
+OTHER = 'mika'
+
+def assert_same_tables(actual, expected):
+    assert actual.keys() == expected.keys()
+    for key, values in expected.items():
+        assert actual[key] == pytest.approx(values), key
+
+def test_update_matches_a_rebuild():
+    # 古い記録はアーカイブのロールアップ、残りはホットの記録。後半を1セットずつ update() で足す
+    rows = workout_rows(300, users=(USER, OTHER))
+    rollups = storage.build_rollups(frame(rows[:80]))
+    aggregates = VolumeAggregates(frame(rows[80:150]), rollups)
+    for row in rows[150:]:
+        aggregates.update(row)
+    rebuilt = VolumeAggregates(frame(rows[80:]), rollups)
+
+    assert_same_tables(aggregates.daily, rebuilt.daily)
+    assert_same_tables(aggregates.weekly, rebuilt.weekly)
+    for grain in ('day', 'week'):
+        for by in ('part', 'exercise'):
+            expected = rebuilt.series(USER, grain, by, 'volume', since=datetime.date(2026, 2, 1))
+            actual = aggregates.series(USER, grain, by, 'volume', since=datetime.date(2026, 2, 1))
+            assert actual.equals(expected)
+
+def test_rows_without_numbers_are_not_counted():
+    aggregates = VolumeAggregates(frame(workout_rows(20)))
+    before = dict(aggregates.weekly)
+    aggregates.update(['2026-05-01', '胸', 'ベンチプレス', '', '5', USER])
+    assert aggregates.weekly == before
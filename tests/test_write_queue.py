@@ -0,0 +1,203 @@
+import subprocess
+import sys
+import threading
+import time
+
+import gspread
+import pytest
+import streamlit as st
+
+import storage
+from conftest import USER
+from fakesheets import api_error
+
+SET = ['2026-10-01', '胸', 'ベンチプレス', '60', '8', USER]
+
+# 別のプロセスとして書き込みログのロックを持ち続ける
+HOLD_LOG = """
+import fcntl, sys, time
+f = open(sys.argv[1], 'a+')
+fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+print('locked', flush=True)
+time.sleep(30)
+"""
+
+def data_rows(fake):
+    # ヘッダーを除いた記録 (記録ID の列は除く)
+    return [row[:len(storage.SHEET_HEADER)] for row in fake.worksheet(storage.get_partition(USER)).rows[1:]]
+
+def fail_next_append(fake, written):
+    # 次の append_rows を 503 で失敗させる。written なら行は書き込まれている (応答だけが失われた)
+    worksheet = fake.worksheet(storage.get_partition(USER))
+    append_rows = worksheet.append_rows
+
+    def failing(values, **kwargs):
+        worksheet.append_rows = append_rows
+        if written:
+            append_rows(values, **kwargs)
+        raise api_error(503, 'UNAVAILABLE', 'Service unavailable (fake)')
+
+    worksheet.append_rows = failing
+
+def restart(fake):
+    # プロセスを落として起動し直す: 共有キャッシュは消え、書き込みキューはログから復元される
+    st.cache_resource.clear()
+    storage.get_sheet_handle().use_spreadsheet(fake)
+    return storage.get_write_queue()
+
+@pytest.mark.parametrize('written', [False, True])
+@pytest.mark.parametrize('crash', [False, True])
+def test_identical_set_after_failed_send_is_kept_once(sheets, written, crash):
+    queue = storage.get_write_queue()
+    queue.add(SET)
+    queue.flush()
+    assert data_rows(sheets) == [SET]
+
+    # 同じ重量・回数の2セット目の送信結果が分からなくなる
+    queue.add(SET)
+    fail_next_append(sheets, written)
+    with pytest.raises(gspread.exceptions.APIError):
+        queue.flush()
+    if crash:
+        queue = restart(sheets)
+    assert queue.pending_rows() == [SET]
+
+    queue.flush()
+    assert data_rows(sheets) == [SET, SET]
+    assert queue.pending_rows() == []
+    assert restart(sheets).pending_rows() == []
+
+def test_uncertain_batch_with_new_rows_sends_only_the_missing_ones(sheets):
+    queue = storage.get_write_queue()
+    first = SET[:3] + ['62.5', '6', USER]
+    queue.add(first)
+    fail_next_append(sheets, written=True)
+    with pytest.raises(gspread.exceptions.APIError):
+        queue.flush()
+
+    # 失敗の後に記録した行は、結果不明の行と同じバッチにまとまる
+    queue = restart(sheets)
+    queue.add(SET)
+    queue.flush()
+    assert data_rows(sheets) == [first, SET]
+
+def test_rejected_send_rolls_back_and_survives_restart(sheets):
+    queue = storage.get_write_queue()
+    queue.add(SET)
+    worksheet = sheets.worksheet(storage.get_partition(USER))
+
+    def reject(values, **kwargs):
+        raise api_error(400, 'INVALID_ARGUMENT', 'Invalid values (fake)')
+
+    worksheet.append_rows = reject
+    queue.flush()
+    assert data_rows(sheets) == []
+    assert [row for row, _ in queue.rejected_rows(storage.get_partition(USER))] == [SET]
+
+    queue = restart(sheets)
+    assert queue.pending_rows() == []
+    assert [row for row, _ in queue.rejected_rows(storage.get_partition(USER))] == [SET]
+
+def test_slow_send_does_not_block_readers(sheets):
+    backend = storage.make_backend('sheets')
+    backend.load(USER)
+    queue = storage.get_write_queue()
+    worksheet = sheets.worksheet(storage.get_partition(USER))
+    append_rows = worksheet.append_rows
+    release = threading.Event()
+    entered = threading.Event()
+
+    def slow(values, **kwargs):
+        entered.set()
+        release.wait(5)
+        return append_rows(values, **kwargs)
+
+    worksheet.append_rows = slow
+    backend.append(SET)
+    flusher = threading.Thread(target=queue.flush)
+    flusher.start()
+    assert entered.wait(5)
+    try:
+        # 送信を待っている間も、読み込みは待たされず、記録は1回だけ見える
+        start = time.perf_counter()
+        assert len(backend.load(USER)) == 1
+        backend.load('someone_else')
+        assert time.perf_counter() - start < 1
+    finally:
+        release.set()
+        flusher.join()
+    assert len(backend.load(USER)) == 1
+    assert data_rows(sheets) == [SET]
+
+def count_appends(fake):
+    worksheet = fake.worksheet(storage.get_partition(USER))
+    append_rows = worksheet.append_rows
+    calls = []
+
+    def counting(values, **kwargs):
+        calls.append(len(values))
+        return append_rows(values, **kwargs)
+
+    worksheet.append_rows = counting
+    return calls
+
+def wait_until_sent(queue, timeout=5):
+    deadline = time.time() + timeout
+    while queue.pending_rows() and time.time() < deadline:
+        time.sleep(0.01)
+    return not queue.pending_rows()
+
+def test_sets_recorded_during_a_workout_are_sent_together(sheets, monkeypatch):
+    monkeypatch.setattr(storage, 'WRITE_FLUSH_IDLE', 0.3)
+    calls = count_appends(sheets)
+    queue = storage.get_write_queue()
+    for _ in range(3):
+        queue.add(SET)  # セット間の休憩 (ここでは短く) は送信を起こさない
+        time.sleep(0.1)
+    assert calls == []
+    assert wait_until_sent(queue)
+    assert calls == [3]
+
+def test_full_queue_is_sent_without_waiting_for_idle(sheets, monkeypatch):
+    monkeypatch.setattr(storage, 'WRITE_FLUSH_ROWS', 3)
+    calls = count_appends(sheets)
+    queue = storage.get_write_queue()
+    queue.add_many([SET] * 3)
+    assert wait_until_sent(queue)
+    assert calls == [3]
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='fcntl が必要')
+def test_write_log_in_use_by_another_process_is_refused(sheets, tmp_path):
+    # 別のプロセス (動いているアプリ) がログを持っている間は、再生も送信もしない
+    path = str(tmp_path / 'server.jsonl')
+    holder = subprocess.Popen(
+        [sys.executable, '-c', HOLD_LOG, path + '.lock'], stdout=subprocess.PIPE, text=True)
+    try:
+        assert holder.stdout.readline().strip() == 'locked'
+        with pytest.raises(RuntimeError, match='別のプロセス'):
+            storage.WriteQueue(path, None, None, storage.row_partition)
+    finally:
+        holder.kill()
+        holder.wait()
+
+@pytest.mark.parametrize('code, status', [(403, 'PERMISSION_DENIED'), (404, 'NOT_FOUND')])
+def test_configuration_errors_keep_rows_for_retry(sheets, code, status):
+    # 権限を失った・ワークシートが消された は行のせいではないので、取り消さずに送り直す
+    queue = storage.get_write_queue()
+    queue.add(SET)
+    worksheet = sheets.worksheet(storage.get_partition(USER))
+    append_rows = worksheet.append_rows
+
+    def failing(values, **kwargs):
+        worksheet.append_rows = append_rows
+        raise api_error(code, status, 'Configuration error (fake)')
+
+    worksheet.append_rows = failing
+    with pytest.raises(gspread.exceptions.APIError):
+        queue.flush()
+    assert queue.pending_rows() == [SET]
+    assert queue.rejected_rows(storage.get_partition(USER)) == []
+
+    queue.flush()
+    assert data_rows(sheets) == [SET]
+    assert queue.pending_rows() == []
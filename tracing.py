@@ -0,0 +1,141 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter
+
+# --- 再実行ごとの計測 ---
+# 計測中の再実行があるときだけ Trace を contextvar に置く。
+# 計測していないときの span / count は contextvar を1回読むだけで素通りする。
+
+TRACE_LOG = os.environ.get('LIFTOS_TRACE') == '1'  # 全再実行の計測結果をログに出す
+TRACE_QUERY_PARAM = 'debug'  # ?debug=1 で開いたセッションはサイドバーに計測パネルを出す
+
+logger = logging.getLogger('liftos.trace')
+if TRACE_LOG and not logger.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_current = contextvars.ContextVar('liftos_trace', default=None)
+
+class Trace:
+    def __init__(self, **meta):
+        self.meta = meta
+        self.started_at = time.perf_counter()
+        self.spans = []  # (名前, 深さ, 開始からの ms, 所要 ms) を開始順に
+        self.depth = 0
+        self.api_calls = Counter()
+        self.status = 'ok'
+        self.total_ms = None
+
+    def record(self):
+        return {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            **self.meta,
+            'status': self.status,
+            'total_ms': self.total_ms,
+            'spans': [
+                {'name': name, 'depth': depth, 'start_ms': round(start, 2), 'ms': round(ms, 2)}
+                for name, depth, start, ms in self.spans
+            ],
+            'api_calls': dict(self.api_calls),
+        }
+
+def current():
+    return _current.get()
+
+class _Span:
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        trace = self.trace
+        self.index = len(trace.spans)
+        self.start = time.perf_counter()
+        trace.spans.append((self.name, trace.depth, (self.start - trace.started_at) * 1000, None))
+        trace.depth += 1
+
+    def __exit__(self, *exc):
+        trace = self.trace
+        trace.depth -= 1
+        name, depth, start, _ = trace.spans[self.index]
+        trace.spans[self.index] = (name, depth, start, (time.perf_counter() - self.start) * 1000)
+        return False
+
+class _NoSpan:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+def span(name):
+    # with span('...'): の形で使う
+    trace = _current.get()
+    return _NO_SPAN if trace is None else _Span(trace, name)
+
+def traced(name):
+    # 関数全体を1つの区間として計測するデコレータ
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            trace = _current.get()
+            if trace is None:
+                return fn(*args, **kwargs)
+            with _Span(trace, name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def entrypoint(name, context):
+    # コールバックやフラグメントのように、再実行の計測の外から呼ばれうる関数を計測するデコレータ。
+    # 計測中ならその中の区間になり、そうでなければ context() が返す (計測するか, メタ情報) で計測を始める
+    def decorator(fn):
+        traced_fn = traced(name)(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current.get() is not None:
+                return traced_fn(*args, **kwargs)
+            enabled, meta = context()
+            with rerun_trace(enabled, entry=name, **meta):
+                return traced_fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(kind, n=1):
+    # 外部 API の呼び出し回数を数える (計測中の再実行の中で呼ばれたものだけ)
+    trace = _current.get()
+    if trace is not None:
+        trace.api_calls[kind] += n
+
+class rerun_trace:
+    # 再実行1回分を計測し、終わったら JSON 1行のログを出す。enabled=False なら何もしない
+    def __init__(self, enabled, **meta):
+        self.trace = Trace(**meta) if enabled else None
+
+    def __enter__(self):
+        if self.trace is not None:
+            self.token = _current.set(self.trace)
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        trace = self.trace
+        if trace is None:
+            return False
+        _current.reset(self.token)
+        trace.total_ms = round((time.perf_counter() - trace.started_at) * 1000, 2)
+        if exc_type is not None:
+            # st.rerun() / st.stop() も例外で抜けてくるので、その名前を状態として残す
+            trace.status = exc_type.__name__
+        logger.info(json.dumps(trace.record(), ensure_ascii=False))
+        return False
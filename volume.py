@@ -0,0 +1,90 @@
+import datetime
+
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# --- トレーニングボリュームの集計表 ---
+# (ユーザー, 部位, 種目, 日) と (ユーザー, 部位, 種目, ISO週) ごとに
+# セット数・レップ数・ボリューム (重量×回数) を持つ。作成時に一度だけ全記録を集計し、
+# 以降の1セット追加は該当する2つの行への加算で済む。
+# グラフは集計表だけから作るので、コストは記録数ではなく日数・週数に比例する。
+
+METRICS = ['sets', 'reps', 'volume']
+METRIC_LABELS = {'volume': 'ボリューム (kg)', 'sets': 'セット数', 'reps': 'レップ数'}
+
+def week_start(day):
+    # ISO週の月曜日 (週のキー)
+    return day - datetime.timedelta(days=day.weekday())
+
+class VolumeAggregates:
+    def __init__(self, df, rollups=None):
+        # df は 日付 / 部位 / 種目名 / 重量(kg) / 回数(レップ) / ユーザー名 を持つ型付きの記録。
+        # rollups はアーカイブ済みのセットの日ごとの集計 (storage.ROLLUP_HEADER の列)
+        self.daily = {}  # (ユーザー, 部位, 種目, date) -> [セット数, レップ数, ボリューム]
+        self.weekly = {}  # (ユーザー, 部位, 種目, 週の月曜日) -> 同上
+        if not df.empty:
+            self._build(df)
+        if rollups is not None and not rollups.empty:
+            self._add_rollups(rollups)
+
+    def _build(self, df):
+        day = df['日付'].dt.normalize()
+        work = pd.DataFrame({
+            'user': df['ユーザー名'].astype(str).to_numpy(),
+            'part': df['部位'].astype(str).to_numpy(),
+            'exercise': df['種目名'].astype(str).to_numpy(),
+            'day': day.to_numpy(),
+            'week': (day - pd.to_timedelta(day.dt.weekday, unit='D')).to_numpy(),
+            'reps': df['回数(レップ)'].to_numpy(dtype=float),
+        })
+        work['volume'] = df['重量(kg)'].to_numpy(dtype=float) * work['reps']
+        for grain, table in (('day', self.daily), ('week', self.weekly)):
+            grouped = work.groupby(['user', 'part', 'exercise', grain], sort=False).agg(
+                sets=('reps', 'size'), reps=('reps', 'sum'), volume=('volume', 'sum'))
+            for (user, part, exercise, when), values in zip(grouped.index, grouped.to_numpy()):
+                table[(user, part, exercise, pd.Timestamp(when).date())] = values.tolist()
+
+    def _add_rollups(self, rollups):
+        # ロールアップはレップ帯ごとに分かれているので、日・週の行へ足し込む
+        columns = ['ユーザー名', '部位', '種目名', '日付', 'セット数', '合計回数', 'ボリューム']
+        for user, part, exercise, date, sets, reps, volume in rollups[columns].itertuples(index=False):
+            day = pd.Timestamp(date).date()
+            for table, when in ((self.daily, day), (self.weekly, week_start(day))):
+                values = table.setdefault((user, part, exercise, when), [0, 0.0, 0.0])
+                values[0] += int(sets)
+                values[1] += float(reps)
+                values[2] += float(volume)
+
+    def update(self, row):
+        # 1セット分を日・週の集計に加える
+        date, part, exercise, weight, reps, user = row[:6]
+        day = pd.Timestamp(date).date()
+        weight = pd.to_numeric(weight, errors='coerce')
+        reps = pd.to_numeric(reps, errors='coerce')
+        if np.isnan(weight) or np.isnan(reps):
+            return
+        for table, when in ((self.daily, day), (self.weekly, week_start(day))):
+            values = table.setdefault((user, part, exercise, when), [0, 0.0, 0.0])
+            values[0] += 1
+            values[1] += float(reps)
+            values[2] += float(weight) * float(reps)
+
+    def series(self, user, grain='week', by='part', metric='volume', since=None):
+        # 日付 x 部位 (または種目) の表。since より前の日・週は含めない
+        table = self.weekly if grain == 'week' else self.daily
+        column = {'part': 1, 'exercise': 2}[by]
+        m = METRICS.index(metric)
+        since = week_start(since) if since is not None and grain == 'week' else since
+        totals = {}
+        for key, values in table.items():
+            if key[0] != user or (since is not None and key[3] < since):
+                continue
+            totals[(key[3], key[column])] = totals.get((key[3], key[column]), 0) + values[m]
+        if not totals:
+            return pd.DataFrame()
+        index = pd.MultiIndex.from_tuples(list(totals), names=['日付', by])
+        result = pd.Series(list(totals.values()), index=index).unstack(fill_value=0).sort_index()
+        result.index = pd.to_datetime(result.index)
+        return result